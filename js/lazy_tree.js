@@ -0,0 +1,134 @@
+// Library tree with server side paging & lazy loading of bank contents,
+// built on bootstrap-treeview.
+//
+// loadPage(params, callback) must request a page from the server. params
+// contains PARENT, OFFSET & LIMIT. The callback receives the page object:
+// { parent, offset, limit, total, nodes }.
+
+var LAZY_TREE_PAGE_LIMIT = 100;
+
+function LazyTree(selector, loadPage, treeOptions) {
+	this.selector = selector;
+	this.loadPage = loadPage;
+	this.treeOptions = treeOptions || {};
+	this.data = [];
+	this.selectedFullpath = null;
+}
+
+LazyTree.prototype.getMoreNode = function(parent, offset, total) {
+	var text = "More ...";
+	if (total) text = "More ... (" + offset + "/" + total + ")";
+	return {
+		text: text,
+		node_type: 'MORE',
+		parent_fullpath: parent,
+		offset: offset,
+		icon: "glyphicon glyphicon-option-horizontal"
+	};
+}
+
+// Convert a page into tree nodes. Banks get a "More" node if their
+// children are not fully loaded.
+LazyTree.prototype.getPageNodes = function(page) {
+	var nodes = page.nodes.slice();
+	for (var i in nodes) {
+		var node = nodes[i];
+		if (node.nodes && node.nodes.length > 0 && node.child_count > node.nodes.length) {
+			node.nodes.push(this.getMoreNode(node.fullpath, node.nodes.length, node.child_count));
+		}
+		node.loaded = node.nodes && node.nodes.length > 0;
+	}
+	var next = page.offset + page.nodes.length;
+	if (next < page.total) {
+		nodes.push(this.getMoreNode(page.parent, next, page.total));
+	}
+	return nodes;
+}
+
+LazyTree.prototype.findNode = function(nodes, fullpath) {
+	for (var i in nodes) {
+		if (nodes[i].fullpath == fullpath) return nodes[i];
+		if (nodes[i].nodes) {
+			var res = this.findNode(nodes[i].nodes, fullpath);
+			if (res) return res;
+		}
+	}
+	return null;
+}
+
+LazyTree.prototype.load = function(page, selectedFullpath) {
+	this.data = this.getPageNodes(page);
+	this.selectedFullpath = selectedFullpath;
+	this.render(true);
+}
+
+// Replace the "More" node of the given level by the next page
+LazyTree.prototype.loadMore = function(moreNode) {
+	var self = this;
+	self.loadPage({
+		PARENT: moreNode.parent_fullpath || '',
+		OFFSET: moreNode.offset,
+		LIMIT: LAZY_TREE_PAGE_LIMIT
+	}, function(page) {
+		var nodes = self.data;
+		if (page.parent) {
+			var parent = self.findNode(self.data, page.parent);
+			if (!parent) return;
+			parent.loaded = true;
+			parent.state = { expanded: true };
+			if (!parent.nodes) parent.nodes = [];
+			nodes = parent.nodes;
+		}
+		if (nodes.length > 0 && nodes[nodes.length - 1].node_type == 'MORE') {
+			nodes.pop();
+		}
+		Array.prototype.push.apply(nodes, self.getPageNodes(page));
+		self.render(false);
+	});
+}
+
+// The selected node is kept after rendering again. Selection events are only
+// fired if fireSelect is true.
+LazyTree.prototype.render = function(fireSelect) {
+	var self = this;
+	var options = $.extend({}, self.treeOptions, {
+		data: self.data,
+		onNodeSelected: function(event, node) {
+			if (node.node_type == 'MORE') {
+				$(self.selector).treeview('unselectNode', [node.nodeId, {silent: true}]);
+				self.loadMore(node);
+			} else {
+				self.selectedFullpath = node.fullpath;
+				if (self.treeOptions.onNodeSelected) self.treeOptions.onNodeSelected(event, node);
+			}
+		},
+		onNodeExpanded: function(event, node) {
+			var mnode = self.findNode(self.data, node.fullpath);
+			if (!mnode) return;
+			mnode.state = { expanded: true };
+			if (!mnode.loaded) {
+				self.loadMore({ parent_fullpath: mnode.fullpath, offset: 0 });
+			}
+		},
+		onNodeCollapsed: function(event, node) {
+			var mnode = self.findNode(self.data, node.fullpath);
+			if (mnode) mnode.state = { expanded: false };
+		}
+	});
+	$(self.selector).treeview(options);
+	if (self.selectedFullpath) {
+		self.selectNode(self.selectedFullpath, !fireSelect);
+	}
+}
+
+LazyTree.prototype.selectNode = function(fullpath, silent) {
+	var nodes = $(this.selector).treeview('getEnabled');
+	for (var i in nodes) {
+		if (nodes[i].fullpath == fullpath) {
+			$(this.selector).treeview('revealNode', [nodes[i].nodeId, {silent: true}]);
+			$(this.selector).treeview('selectNode', [nodes[i].nodeId, {silent: silent}]);
+			return true;
+		}
+	}
+	return false;
+}
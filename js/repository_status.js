@@ -0,0 +1,34 @@
+function onRepositoryMessage(data){
+	var statusElem = $('#repository_status');
+	if (data.status == 'EOCOMMAND'){
+		statusElem.text('');
+		return;
+	}
+	var selectElem = $('select[name="ZYNTHIAN_REPO_' + data.repo + '"]');
+	if (data.status == 'FETCHED'){
+		var selected = selectElem.val();
+		selectElem.empty();
+		$.each(data.branches, function(i, branch){
+			selectElem.append($('<option>', { value: branch, text: branch }));
+		});
+		if (data.branches.indexOf(selected) < 0){
+			selectElem.append($('<option>', { value: selected, text: selected }));
+		}
+		selectElem.val(selected);
+		statusElem.text(data.repo + ': remote branches updated');
+	} else if (data.status == 'ERROR'){
+		statusElem.text(data.repo + ': ' + data.text);
+	} else {
+		statusElem.text(data.repo + ': ' + data.text);
+	}
+}
+
+$(document).ready(function(){
+	$('form#config_block_form').append('<div id="repository_status" class="text-muted"></div>');
+	var deferred = $.Deferred();
+	deferred.done(function(){
+		window.zynthianSocket.registerHandler('RepositoryMessageHandler', onRepositoryMessage);
+		window.zynthianSocket.send(JSON.stringify({ 'handler_name': 'RepositoryMessageHandler', 'data': 'SUBSCRIBE' }));
+	});
+	connectZynthianWebSocket(deferred);
+});
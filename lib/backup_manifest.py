@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Backup Manifest: file list with size, mtime & hash for incremental backups
+#
+# Copyright (C) 2020 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import json
+import time
+import uuid
+import hashlib
+import logging
+
+from lib.persistent_cache import load_cache, save_cache
+
+#------------------------------------------------------------------------------
+# Every backup archive contains a manifest with the list of backed up files
+# (path => [size, mtime_ns, sha1]). An incremental archive contains only the
+# files that changed since the previous backup of the same kind, and the list
+# of deleted files. The manifest of the last backup is kept in the cache.
+# Restoring a full archive followed by its incremental ones, in order, gives
+# the same files than the last backup.
+#------------------------------------------------------------------------------
+
+MANIFEST_ARCNAME = "zynthian_backup_manifest.json"
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+def get_file_hash(fpath):
+	sha1 = hashlib.sha1()
+	with open(fpath, "rb") as f:
+		while True:
+			data = f.read(HASH_CHUNK_SIZE)
+			if not data:
+				break
+			sha1.update(data)
+	return sha1.hexdigest()
+
+
+class BackupManifest(object):
+
+	def __init__(self, name, incremental=False):
+		self.cache_name = "backup_manifest_" + name
+		self.id = uuid.uuid4().hex
+		self.files = {}
+		self.prev = None
+		if incremental:
+			self.prev = load_cache(self.cache_name, None)
+			if not self.prev:
+				logging.info("No previous '{}' backup. Doing a full backup.".format(name))
+		self.prev_files = self.prev['files'] if self.prev else {}
+
+
+	def is_incremental(self):
+		return self.prev is not None
+
+
+	# Returns True if the file must be included in the archive. Hashes are
+	# only calculated when size is the same but mtime changed.
+	def check_file(self, fpath, stat):
+		size = stat.st_size
+		mtime = stat.st_mtime_ns
+		prev_entry = self.prev_files.get(fpath)
+		if prev_entry and prev_entry[0]==size:
+			if prev_entry[1]==mtime:
+				self.files[fpath] = prev_entry
+				return False
+			try:
+				sha1 = get_file_hash(fpath)
+			except OSError as e:
+				logging.error("Can't hash '{}' => {}".format(fpath, e))
+				self.keep_file(fpath)
+				return True
+			if sha1==prev_entry[2]:
+				self.files[fpath] = [size, mtime, sha1]
+				return False
+		return True
+
+
+	def add_file(self, fpath, stat, sha1):
+		self.files[fpath] = [stat.st_size, stat.st_mtime_ns, sha1]
+
+
+	# Call it when an existing file can't be read. The previous entry is kept,
+	# so the file is not listed as deleted and restoring the chain doesn't
+	# remove it.
+	def keep_file(self, fpath):
+		prev_entry = self.prev_files.get(fpath)
+		if prev_entry and fpath not in self.files:
+			self.files[fpath] = prev_entry
+
+
+	def get_deleted_files(self):
+		return sorted(fpath for fpath in self.prev_files if fpath not in self.files)
+
+
+	def get_data(self):
+		incremental = self.is_incremental()
+		return {
+			'id': self.id,
+			'base': self.prev['id'] if incremental else None,
+			'type': "incremental" if incremental else "full",
+			'created': time.time(),
+			'deleted': self.get_deleted_files() if incremental else [],
+			'files': self.files
+		}
+
+
+	def encode(self):
+		return json.dumps(self.get_data()).encode("utf-8")
+
+
+	# Call it when the archive was completely sent
+	def save(self):
+		save_cache(self.cache_name, { 'id': self.id, 'files': self.files })
+
+
+#------------------------------------------------------------------------------
+# Restore chain: archives sorted by creation time, checking that every
+# incremental archive is based on the previous one.
+#------------------------------------------------------------------------------
+
+def read_manifest(zf):
+	try:
+		return json.loads(zf.read(MANIFEST_ARCNAME).decode("utf-8"))
+	except KeyError:
+		return None
+
+
+# archives is a list of (fpath, manifest). Raises an exception if the chain
+# is broken.
+def sort_restore_chain(archives):
+	legacy = [a for a in archives if a[1] is None]
+	chain = sorted([a for a in archives if a[1] is not None], key=lambda a: a[1]['created'])
+	for i, (fpath, manifest) in enumerate(chain):
+		if manifest['type']=="incremental":
+			if i==0:
+				raise Exception("Missing the base backup of '{}'".format(fpath))
+			if manifest['base']!=chain[i - 1][1]['id']:
+				raise Exception("'{}' is not based on '{}'".format(fpath, chain[i - 1][0]))
+	# Archives without manifest are full backups from older versions
+	return legacy + chain
+
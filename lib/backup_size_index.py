@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Backup Size Index: per directory file sizes keyed by mtime
+#
+# Copyright (C) 2020 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import os
+import logging
+
+from lib.file_count_index import FileCountIndex
+
+#------------------------------------------------------------------------------
+# Backup Size Index
+#------------------------------------------------------------------------------
+# Extends the file count index with the size of the files in every directory,
+# split in "stored" (already compressed) and "deflated" bytes. Files are only
+# stat'ed again when the directory's mtime changes, so files rewritten in
+# place keep their old size until then. It's good enough for an estimation.
+
+class BackupSizeIndex(FileCountIndex):
+
+	def __init__(self, name="backup_size_index", stored_extensions=()):
+		super().__init__(name)
+		self.stored_extensions = stored_extensions
+
+
+	def scan_dir(self, dpath, mtime):
+		entry = super().scan_dir(dpath, mtime)
+		size = 0
+		stored_size = 0
+		for fname in entry['files']:
+			try:
+				fsize = os.stat(os.path.join(dpath, fname)).st_size
+			except OSError as e:
+				logging.debug("Can't stat '{}' => {}".format(fname, e))
+				continue
+			size += fsize
+			if os.path.splitext(fname)[1].lower() in self.stored_extensions:
+				stored_size += fsize
+		entry['bytes'] = size
+		entry['stored_bytes'] = stored_size
+		return entry
+
+
+	# Returns (bytes, stored_bytes) of the files in the directory
+	def get_dir_size(self, dpath):
+		entry = self.get_entry(os.path.normpath(dpath))
+		if entry is None:
+			return 0, 0
+		return entry.get('bytes', 0), entry.get('stored_bytes', 0)
+
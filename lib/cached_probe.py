@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Cached Probe: TTL cache for slow system queries
+#
+# Copyright (C) 2020 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import time
+import asyncio
+import logging
+import tornado.ioloop
+from concurrent.futures import ThreadPoolExecutor
+
+#------------------------------------------------------------------------------
+# Shared worker pool for blocking probes, so they don't run in the IOLoop
+#------------------------------------------------------------------------------
+
+probe_executor = ThreadPoolExecutor(max_workers=4)
+
+#------------------------------------------------------------------------------
+# Cached Probe
+#------------------------------------------------------------------------------
+
+class CachedProbe(object):
+
+	def __init__(self, func, ttl, default=None):
+		self.func = func
+		self.ttl = ttl
+		self.default = default
+		self.value = default
+		self.timestamp = None
+		self.future = None
+
+
+	def is_cached(self):
+		return self.timestamp is not None
+
+
+	def is_expired(self):
+		return self.timestamp is None or (time.monotonic() - self.timestamp) > self.ttl
+
+
+	# Returns the cached value. The first time, waits for the probe to finish.
+	# After that, an expired value is returned as is and refreshed in background.
+	async def get(self):
+		if not self.is_cached():
+			await self.refresh()
+		elif self.is_expired():
+			self.refresh()
+		return self.value
+
+
+	# Only one refresh in-flight per probe
+	def refresh(self):
+		if self.future is None:
+			self.future = asyncio.ensure_future(self.do_refresh())
+		return self.future
+
+
+	def invalidate(self):
+		self.timestamp = None
+
+
+	async def do_refresh(self):
+		try:
+			self.value = await tornado.ioloop.IOLoop.current().run_in_executor(probe_executor, self.func)
+		except Exception as e:
+			logging.error("Probe {} failed => {}".format(getattr(self.func, '__name__', self.func), e))
+			if not self.is_cached():
+				self.value = self.default
+		finally:
+			self.timestamp = time.monotonic()
+			self.future = None
+
+
+#------------------------------------------------------------------------------
+# Run a set of probes concurrently and return a {name: value} snapshot
+#------------------------------------------------------------------------------
+
+async def get_probes_snapshot(probes):
+	names = list(probes.keys())
+	values = await asyncio.gather(*[probes[name].get() for name in names])
+	return dict(zip(names, values))
+
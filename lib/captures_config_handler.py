@@ -34,6 +34,7 @@ import subprocess
 import tornado.web
 from collections import OrderedDict
 from lib.zynthian_config_handler import ZynthianBasicHandler
+from lib.file_count_index import file_count_index
 
 #------------------------------------------------------------------------------
 # Soundfont Configuration
@@ -93,6 +94,7 @@ class CapturesConfigHandler(ZynthianBasicHandler):
 				shutil.rmtree(self.selected_full_path)
 			else:
 				os.remove(self.selected_full_path)
+			file_count_index.invalidate(self.selected_full_path)
 		except:
 			pass
 
@@ -114,6 +116,8 @@ class CapturesConfigHandler(ZynthianBasicHandler):
 			if m:
 				destinationFolder = m.group(1) + newName
 				shutil.move(sourceFolder, destinationFolder)
+				file_count_index.invalidate(sourceFolder)
+				file_count_index.invalidate(destinationFolder)
 				self.selected_full_path = destinationFolder;
 
 
@@ -158,6 +162,7 @@ class CapturesConfigHandler(ZynthianBasicHandler):
 		try:
 			logging.info(cmd)
 			subprocess.check_output(cmd, stderr=subprocess.STDOUT, shell=True)
+			file_count_index.invalidate(ogg_file_name)
 		except Exception as e:
 			return e.output
 		return
@@ -210,6 +215,7 @@ class CapturesConfigHandler(ZynthianBasicHandler):
 		destination = "{}/{}.{}".format(CapturesConfigHandler.CAPTURES_DIRECTORY, fname, fext[1:4])
 		logging.info(destination)
 		shutil.move(fpath, destination)
+		file_count_index.invalidate(destination)
 
 	def walk_directory(self, directory, icon, file_extension):
 		captures = []
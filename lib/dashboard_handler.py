@@ -26,11 +26,20 @@ import os
 import re
 import sys
 import logging
+import jsonpickle
 import tornado.web
-from subprocess import check_output, DEVNULL
+import tornado.ioloop
+import tornado.websocket
+from functools import partial
+from subprocess import check_output
 from distutils import util
 from collections import OrderedDict
-from lib.zynthian_config_handler import ZynthianBasicHandler
+from lib.zynthian_config_handler import ZynthianBasicHandler, load_config_cached
+from lib.zynthian_websocket_handler import ZynthianWebSocketMessageHandler, ZynthianWebSocketMessage
+from lib.cached_probe import CachedProbe, get_probes_snapshot
+from lib.system_metrics import SystemMetrics
+from lib.file_count_index import file_count_index
+from lib.git_repo_status import get_repo_status
 
 sys.path.append(os.environ.get('ZYNTHIAN_UI_DIR'))
 import zynconf
@@ -41,21 +50,66 @@ import zynconf
 
 class DashboardHandler(ZynthianBasicHandler):
 
+	GIT_INFO_NA = { "branch": "???", "gitid": "???????", "update": None }
+
+	probes = None
+
+	@classmethod
+	def get_probes(cls):
+		if cls.probes is None:
+			my_data_dir = os.environ.get('ZYNTHIAN_MY_DATA_DIR')
+			# Probe name => (blocking function, TTL in seconds, default value)
+			cls.probes = OrderedDict([
+				['GIT_INFO_ZYNCODER', CachedProbe(partial(cls.get_git_info, "/zynthian/zyncoder"), 30, cls.GIT_INFO_NA)],
+				['GIT_INFO_UI', CachedProbe(partial(cls.get_git_info, "/zynthian/zynthian-ui"), 30, cls.GIT_INFO_NA)],
+				['GIT_INFO_SYS', CachedProbe(partial(cls.get_git_info, "/zynthian/zynthian-sys"), 30, cls.GIT_INFO_NA)],
+				['GIT_INFO_WEBCONF', CachedProbe(partial(cls.get_git_info, "/zynthian/zynthian-webconf"), 30, cls.GIT_INFO_NA)],
+				['GIT_INFO_DATA', CachedProbe(partial(cls.get_git_info, "/zynthian/zynthian-data"), 30, cls.GIT_INFO_NA)],
+				['OS_INFO', CachedProbe(cls.get_os_info, 3600, "???")],
+				['BUILD_INFO', CachedProbe(cls.get_build_info, 3600, { 'Timestamp': '???' })],
+				['I2C_CHIPS', CachedProbe(cls.get_i2c_chips, 3600, [])],
+				['RAM_INFO', CachedProbe(SystemMetrics.get_ram_info, 5, SystemMetrics.VOLUME_INFO_NA)],
+				['SD_INFO', CachedProbe(SystemMetrics.get_sd_info, 30, SystemMetrics.VOLUME_INFO_NA)],
+				['MEDIA_USB0_INFO', CachedProbe(partial(SystemMetrics.get_media_info, '/media/usb0'), 30)],
+				['TEMPERATURE', CachedProbe(SystemMetrics.get_temperature, 5, "???")],
+				['HOSTNAME', CachedProbe(SystemMetrics.get_host_name, 30, "")],
+				['WIFI_MODE', CachedProbe(zynconf.get_current_wifi_mode, 30, "???")],
+				['IP', CachedProbe(SystemMetrics.get_ip, 30, "")],
+				['RTPMIDI_ACTIVE', CachedProbe(partial(cls.is_service_active, "jackrtpmidid"), 10, False)],
+				['QMIDINET_ACTIVE', CachedProbe(partial(cls.is_service_active, "qmidinet"), 10, False)],
+				['TOUCHOSC_ACTIVE', CachedProbe(partial(cls.is_service_active, "touchosc2midi"), 10, False)],
+				['NUM_SNAPSHOTS', CachedProbe(partial(cls.get_num_of_files, my_data_dir + "/snapshots"), 10, 0)],
+				['NUM_USER_PRESETS', CachedProbe(partial(cls.get_num_of_presets, my_data_dir + "/presets"), 10, 0)],
+				['NUM_USER_SOUNDFONTS', CachedProbe(partial(cls.get_num_of_files, my_data_dir + "/soundfonts"), 10, 0)],
+				['NUM_AUDIO_CAPTURES', CachedProbe(partial(cls.get_num_of_files, my_data_dir + "/capture", "*.wav"), 10, 0)],
+				['NUM_MIDI_CAPTURES', CachedProbe(partial(cls.get_num_of_files, my_data_dir + "/capture", "*.mid"), 10, 0)]
+			])
+		return cls.probes
+
+
 	@tornado.web.authenticated
-	def get(self):
+	async def get(self):
+		# Run the probes concurrently in the worker pool, using cached values when possible
+		snapshot = await get_probes_snapshot(self.get_probes())
+		config = self.get_config(snapshot)
+		super().get("dashboard_block.html", "Dashboard", config, None)
+
+
+	@classmethod
+	def get_config(cls, snapshot):
 		# Get git info
-		git_info_zyncoder = self.get_git_info("/zynthian/zyncoder")
-		git_info_ui = self.get_git_info("/zynthian/zynthian-ui")
-		git_info_sys = self.get_git_info("/zynthian/zynthian-sys")
-		git_info_webconf = self.get_git_info("/zynthian/zynthian-webconf")
-		git_info_data = self.get_git_info("/zynthian/zynthian-data")
+		git_info_zyncoder = snapshot['GIT_INFO_ZYNCODER']
+		git_info_ui = snapshot['GIT_INFO_UI']
+		git_info_sys = snapshot['GIT_INFO_SYS']
+		git_info_webconf = snapshot['GIT_INFO_WEBCONF']
+		git_info_data = snapshot['GIT_INFO_DATA']
 
 		# Get Memory & SD Card info
-		ram_info = self.get_ram_info()
-		sd_info = self.get_sd_info()
+		ram_info = snapshot['RAM_INFO']
+		sd_info = snapshot['SD_INFO']
 
 		# get GPIO expander info
-		i2c_chips = self.get_i2c_chips()
+		i2c_chips = snapshot['I2C_CHIPS']
 		if len(i2c_chips)>0:
 			i2c_info = ", ".join(map(str, i2c_chips))
 		else:
@@ -96,11 +150,11 @@ class DashboardHandler(ZynthianBasicHandler):
 				'icon': 'glyphicon glyphicon-tasks',
 				'info': OrderedDict([
 					['OS_INFO', {
-						'title': "{}".format(self.get_os_info())
+						'title': "{}".format(snapshot['OS_INFO'])
 					}],
 					['BUILD_DATE', {
 						'title': 'Build Date',
-						'value': self.get_build_info()['Timestamp'],
+						'value': snapshot['BUILD_INFO'].get('Timestamp', '???'),
 					}],
 					['RAM', {
 						'title': 'Memory',
@@ -112,7 +166,7 @@ class DashboardHandler(ZynthianBasicHandler):
 					}],
 					['TEMPERATURE', {
 						'title': 'Temperature',
-						'value': self.get_temperature()
+						'value': snapshot['TEMPERATURE']
 					}],
 					['OVERCLOCKING', {
 						'title': 'Overclock',
@@ -136,22 +190,22 @@ class DashboardHandler(ZynthianBasicHandler):
 					}],
 					['SINGLE_ACTIVE_CHANNEL', {
 						'title': 'Receive Mode',
-						'value': self.get_midi_receive_mode(),
+						'value': cls.get_midi_receive_mode(),
 						'url': "/ui-midi-options"
 					}],
 					['ZS3_SUBSNAPSHOTS', {
 						'title': 'ZS3 Sub-SnapShots',
-						'value': self.bool2onoff(os.environ.get('ZYNTHIAN_MIDI_PROG_CHANGE_ZS3','1')),
+						'value': cls.bool2onoff(os.environ.get('ZYNTHIAN_MIDI_PROG_CHANGE_ZS3','1')),
 						'url': "/ui-midi-options"
 					}],
 					['MIDI_FILTER_OUTPUT', {
 						'title': 'MIDI to Output',
-						'value': self.bool2onoff(os.environ.get('ZYNTHIAN_MIDI_FILTER_OUTPUT','1')),
+						'value': cls.bool2onoff(os.environ.get('ZYNTHIAN_MIDI_FILTER_OUTPUT','1')),
 						'url': "/ui-midi-options"
 					}],
 					['MASTER_CHANNEL', {
 						'title': 'Master Channel',
-						'value': self.get_midi_master_chan(),
+						'value': cls.get_midi_master_chan(),
 						'url': "/ui-midi-options"
 					}]
 				])
@@ -191,27 +245,27 @@ class DashboardHandler(ZynthianBasicHandler):
 				'info': OrderedDict([
 					['SNAPSHOTS', {
 						'title': 'Snapshots',
-						'value': str(self.get_num_of_files(os.environ.get('ZYNTHIAN_MY_DATA_DIR')+"/snapshots")),
+						'value': str(snapshot['NUM_SNAPSHOTS']),
 						'url': "/lib-snapshot"
 					}],
 					['USER_PRESETS', {
 						'title': 'User Presets',
-						'value': str(self.get_num_of_presets(os.environ.get('ZYNTHIAN_MY_DATA_DIR')+"/presets")),
+						'value': str(snapshot['NUM_USER_PRESETS']),
 						'url': "/lib-presets"
 					}],
 					['USER_SOUNDFONTS', {
 						'title': 'User Soundfonts',
-						'value': str(self.get_num_of_files(os.environ.get('ZYNTHIAN_MY_DATA_DIR')+"/soundfonts")),
+						'value': str(snapshot['NUM_USER_SOUNDFONTS']),
 						'url': "/lib-soundfont"
 					}],
 					['AUDIO_CAPTURES', {
 						'title': 'Audio Captures',
-						'value': str(self.get_num_of_files(os.environ.get('ZYNTHIAN_MY_DATA_DIR')+"/capture","*.wav")),
+						'value': str(snapshot['NUM_AUDIO_CAPTURES']),
 						'url': "/lib-captures"
 					}],
 					['MIDI_CAPTURES', {
 						'title': 'MIDI Captures',
-						'value': str(self.get_num_of_files(os.environ.get('ZYNTHIAN_MY_DATA_DIR')+"/capture","*.mid")),
+						'value': str(snapshot['NUM_MIDI_CAPTURES']),
 						'url': "/lib-captures"
 					}]
 				])
@@ -221,27 +275,27 @@ class DashboardHandler(ZynthianBasicHandler):
 				'info': OrderedDict([
 					['HOSTNAME', {
 						'title': 'Hostname',
-						'value': self.get_host_name(),
+						'value': snapshot['HOSTNAME'],
 						'url': "/sys-security"
 					}],
 					['WIFI', {
 						'title': 'Wifi',
-						'value': zynconf.get_current_wifi_mode(),
+						'value': snapshot['WIFI_MODE'],
 						'url': "/sys-wifi"
 					}],
 					['IP', {
 						'title': 'IP',
-						'value': self.get_ip(),
+						'value': snapshot['IP'],
 						'url': "/sys-wifi"
 					}],
 					['RTPMIDI', {
 						'title': 'RTP-MIDI',
-						'value': self.bool2onoff(self.is_service_active("jackrtpmidid")),
+						'value': cls.bool2onoff(snapshot['RTPMIDI_ACTIVE']),
 						'url': "/ui-midi-options"
 					}],
 					['QMIDINET', {
 						'title': 'QMidiNet',
-						'value': self.bool2onoff(self.is_service_active("qmidinet")),
+						'value': cls.bool2onoff(snapshot['QMIDINET_ACTIVE']),
 						'url': "/ui-midi-options"
 					}]
 				])
@@ -255,7 +309,7 @@ class DashboardHandler(ZynthianBasicHandler):
 				'url': "/hw-wiring"
 			}
 	
-		media_usb0_info = self.get_media_info('/media/usb0')
+		media_usb0_info = snapshot['MEDIA_USB0_INFO']
 		if media_usb0_info:
 			config['SYSTEM']['info']['MEDIA_USB0'] = {
 				'title': "USB Storage",
@@ -263,38 +317,31 @@ class DashboardHandler(ZynthianBasicHandler):
 				'url': "/lib-captures"
 			}
 
-		if self.is_service_active("touchosc2midi"):
+		if snapshot['TOUCHOSC_ACTIVE']:
 			config['NETWORK']['info']['TOUCHOSC'] = {
 				'title': 'TouchOSC',
 				'value': 'on',
 				'url': "/ui-midi-options"
 			}
 
-		super().get("dashboard_block.html", "Dashboard", config, None)
+		return config
 
 
-	def get_git_info(self, path, check_updates=False):
-		branch = check_output("cd %s; git branch | grep '*'" % path, shell=True).decode()[2:-1]
-		gitid = check_output("cd %s; git rev-parse HEAD" % path, shell=True).decode()[:-1]
+	@staticmethod
+	def get_git_info(path, check_updates=False):
+		info = get_repo_status(path).get_git_info()
 		if check_updates:
-			update = check_output("cd %s; git remote update; git status --porcelain -bs | grep behind | wc -l" % path, shell=True).decode()
-		else:
-			update = None
-		return { "branch": branch, "gitid": gitid, "update": update }
-
-
-	def get_host_name(self):
-		with open("/etc/hostname") as f:
-			hostname=f.readline()
-			return hostname
-		return ""
+			info['update'] = check_output("cd %s; git remote update; git status --porcelain -bs | grep behind | wc -l" % path, shell=True).decode()
+		return info
 
 
-	def get_os_info(self):
+	@staticmethod
+	def get_os_info():
 		return check_output("lsb_release -ds", shell=True).decode()
 
 
-	def get_build_info(self):
+	@staticmethod
+	def get_build_info():
 		info = {}
 		try:
 			zynthian_dir = os.environ.get('ZYNTHIAN_DIR',"/zynthian")
@@ -315,16 +362,11 @@ class DashboardHandler(ZynthianBasicHandler):
 		return info
 
 
-	def get_ip(self):
-		#out=check_output("hostname -I | cut -f1 -d' '", shell=True).decode()
-		out=check_output("hostname -I", shell=True).decode()
-		return out
-
-
-	def get_i2c_chips(self):
+	@staticmethod
+	def get_i2c_chips():
+		res = []
 		out=check_output("gpio i2cd", shell=True).decode().split("\n")
 		if len(out)>3:
-			res = []
 			for i in range(1,8):
 				for adr in out[i][4:].split(" "):
 					try:
@@ -344,74 +386,35 @@ class DashboardHandler(ZynthianBasicHandler):
 		return res
 
 
-	def get_ram_info(self):
-		out=check_output("free -m | grep 'Mem'", shell=True).decode()
-		parts=re.split('\s+', out)
-		return { 'total': parts[1]+"M", 'used': parts[2]+"M", 'free': parts[3]+"M", 'usage': "{}%".format(int(100*float(parts[2])/float(parts[1]))) }
-
-
-	def get_temperature(self):
-		try:
-			return check_output("/opt/vc/bin/vcgencmd measure_temp", shell=True).decode()[5:-3] + "ºC"
-		except:
-			return "???"
-
-
-	def get_volume_info(self, volume='/dev/root'):
-		try:
-			out=check_output("df -h | grep '{}'".format(volume), shell=True).decode()
-			parts=re.split('\s+', out)
-			return { 'total': parts[1], 'used': parts[2], 'free': parts[3], 'usage': parts[4] }
-		except:
-			return { 'total': 'NA', 'used': 'NA', 'free': 'NA', 'usage': 'NA' }
-
-
-	def get_sd_info(self):
-		return self.get_volume_info('/dev/root')
-
-
-	def get_media_info(self, mpath="/media/usb0"):
-		try:
-			out=check_output("mountpoint '{}'".format(mpath), shell=True).decode()
-			if out.startswith("{} is a mountpoint".format(mpath)):
-				return self.get_volume_info(mpath)
-			else:
-				return None
-		except Exception as e:
-			#logging.error("Can't get info for '{}' => {}".format(mpath,e))
-			pass
-
-
-	def get_num_of_files(self, path, pattern=None):
-		if pattern:
-			pattern = "-name \"{}\"".format(pattern)
-		else:
-			pattern = ""
+	@staticmethod
+	def get_num_of_files(path, pattern=None):
 		try:
-			n=int(check_output("find {} -type f -follow {} | wc -l".format(path, pattern), shell=True, stderr=DEVNULL).decode())
+			n = file_count_index.count_files(path, pattern)
 		except Exception as e:
 			logging.error("Can't get num of files for '{}' => {}".format(path,e))
 			n=0
 		return n
 
 
-	def get_num_of_presets(self, path):
+	@staticmethod
+	def get_num_of_presets(path):
 		# LV2 presets
-		n1 = int(check_output("find {}/lv2 -type f -prune -name manifest.ttl | wc -l".format(path), shell=True).decode())
+		n1 = file_count_index.count_files(path + "/lv2", "manifest.ttl")
 		logging.debug("LV2 presets => {}".format(n1))
 		# Pianoteq presets
-		n2 = int(check_output("find {}/pianoteq -type f -prune | wc -l".format(path), shell=True).decode())
+		n2 = file_count_index.count_files(path + "/pianoteq")
 		logging.debug("Pianoteq presets => {}".format(n2))
 		# Puredata presets
-		n3 = int(check_output("find {}/puredata/*/* -type d -prune | wc -l".format(path), shell=True, stderr=DEVNULL).decode())
+		n3 = file_count_index.count_dirs(path + "/puredata", 2)
 		logging.debug("Puredata presets => {}".format(n3))
 		# ZynAddSubFX presets
-		n4 = int(check_output("find {}/zynaddsubfx -type f -name *.xiz | wc -l".format(path), shell=True).decode())
+		n4 = file_count_index.count_files(path + "/zynaddsubfx", "*.xiz")
 		logging.debug("ZynAddSubFX presets => {}".format(n4))
 		return n1 + n2 + n3 + n4
 
 
-	def get_midi_master_chan(self):
+	@staticmethod
+	def get_midi_master_chan():
 		mmc = os.environ.get('ZYNTHIAN_MIDI_MASTER_CHANNEL',"16")
 		if int(mmc)==0:
 			return "off"
@@ -419,14 +422,16 @@ class DashboardHandler(ZynthianBasicHandler):
 			return mmc
 
 
-	def get_midi_receive_mode(self):
+	@staticmethod
+	def get_midi_receive_mode():
 		if os.environ.get('ZYNTHIAN_MIDI_SINGLE_ACTIVE_CHANNEL','0'):
 			return "Stage (Omni On)"
 		else:
 			return "Multi-timbral"
 
 
-	def is_service_active(self, service):
+	@staticmethod
+	def is_service_active(service):
 		cmd="systemctl is-active %s" % service
 		try:
 			result=check_output(cmd, shell=True).decode('utf-8','ignore')
@@ -444,3 +449,115 @@ class DashboardHandler(ZynthianBasicHandler):
 		else:
 			return "Off"
 
+
+#------------------------------------------------------------------------------
+# Dashboard Sampler: samples the dashboard values and pushes the changes to
+# all the subscribed websockets. There is only one sampler, no matter how many
+# subscribers.
+#------------------------------------------------------------------------------
+
+class DashboardSampler(object):
+
+	# Sampling interval in milliseconds
+	interval = int(os.environ.get('ZYNTHIAN_WEBCONF_DASHBOARD_INTERVAL', 2000))
+
+	subscribers = []
+	periodic_callback = None
+	sampling = False
+	values = {}
+
+
+	@classmethod
+	def subscribe(cls, message_handler):
+		if message_handler not in cls.subscribers:
+			cls.subscribers.append(message_handler)
+
+		# New subscribers get all the values. Next updates are deltas.
+		if cls.values:
+			cls.send(message_handler, cls.encode(cls.values))
+
+		if cls.periodic_callback is None:
+			logging.info("Starting dashboard sampler every {} ms".format(cls.interval))
+			cls.periodic_callback = tornado.ioloop.PeriodicCallback(cls.sample, cls.interval)
+			cls.periodic_callback.start()
+			cls.sample()
+
+
+	@classmethod
+	def unsubscribe(cls, message_handler):
+		if message_handler in cls.subscribers:
+			cls.subscribers.remove(message_handler)
+
+		if not cls.subscribers and cls.periodic_callback:
+			logging.info("Stopping dashboard sampler")
+			cls.periodic_callback.stop()
+			cls.periodic_callback = None
+			cls.values = {}
+
+
+	@classmethod
+	def sample(cls):
+		# Skip if previous sample is still running
+		if not cls.sampling:
+			cls.sampling = True
+			tornado.ioloop.IOLoop.current().spawn_callback(cls.do_sample)
+
+
+	@classmethod
+	async def do_sample(cls):
+		try:
+			load_config_cached()
+			snapshot = await get_probes_snapshot(DashboardHandler.get_probes())
+			config = DashboardHandler.get_config(snapshot)
+
+			values = {}
+			for group in config:
+				for tag, info in config[group]['info'].items():
+					if 'value' in info:
+						values[tag] = str(info['value'])
+
+			delta = { tag: value for tag, value in values.items() if cls.values.get(tag) != value }
+			cls.values = values
+			if delta:
+				message = cls.encode(delta)
+				for message_handler in list(cls.subscribers):
+					cls.send(message_handler, message)
+
+		except Exception as e:
+			logging.error("Dashboard sampler failed => {}".format(e))
+
+		finally:
+			cls.sampling = False
+
+
+	@staticmethod
+	def encode(values):
+		return jsonpickle.encode(ZynthianWebSocketMessage('DashboardMessageHandler', values))
+
+
+	@classmethod
+	def send(cls, message_handler, message):
+		try:
+			message_handler.websocket.write_message(message)
+		except tornado.websocket.WebSocketClosedError:
+			cls.unsubscribe(message_handler)
+
+
+class DashboardMessageHandler(ZynthianWebSocketMessageHandler):
+
+	@classmethod
+	def is_registered_for(cls, handler_name):
+		return handler_name == 'DashboardMessageHandler'
+
+
+	def on_websocket_message(self, action):
+		if action == 'SUBSCRIBE':
+			DashboardSampler.subscribe(self)
+		elif action == 'UNSUBSCRIBE':
+			DashboardSampler.unsubscribe(self)
+		else:
+			logging.error('Unknown action {}'.format(action))
+
+
+	def on_close(self):
+		DashboardSampler.unsubscribe(self)
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# File Count Index: per-directory listing cache keyed by mtime
+#
+# Copyright (C) 2020 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import os
+import fnmatch
+import logging
+import threading
+
+from lib.persistent_cache import load_cache, save_cache
+
+#------------------------------------------------------------------------------
+# File Count Index
+#------------------------------------------------------------------------------
+# For every directory, the index keeps its mtime, the names of its
+# subdirectories and the number of files, in total and matching every pattern
+# asked for. A directory is only listed again when its mtime changes, or for
+# counting a new pattern, so counting a big library costs one stat() per
+# directory. File names are only kept if keep_files is True.
+#
+# The lock is only held for reading & updating single entries. Directories are
+# listed, and the index is saved, without holding it, so invalidate() never
+# waits for a walk.
+
+class FileCountIndex(object):
+
+	def __init__(self, name="file_count_index", keep_files=False):
+		self.name = name
+		self.keep_files = keep_files
+		self.lock = threading.RLock()
+		self.save_lock = threading.Lock()
+		self.index = None
+		self.dirty = False
+		# Incremented by invalidate(), so listings started before aren't stored
+		self.generation = 0
+
+
+	def load(self):
+		if self.index is None:
+			self.index = load_cache(self.name, {})
+
+
+	# Entries are replaced, never modified, so a shallow copy can be saved
+	# out of the lock.
+	def save(self):
+		with self.save_lock:
+			with self.lock:
+				if not self.dirty:
+					return
+				data = dict(self.index)
+				self.dirty = False
+			save_cache(self.name, data)
+
+
+	def is_valid_entry(self, entry, mtime, pattern):
+		if entry is None or entry['mtime'] != mtime or 'count' not in entry:
+			return False
+		if self.keep_files and 'files' not in entry:
+			return False
+		return pattern is None or pattern in entry['matches']
+
+
+	def get_entry(self, dpath, pattern=None):
+		try:
+			mtime = os.stat(dpath).st_mtime_ns
+		except OSError:
+			with self.lock:
+				self.load()
+				if self.index.pop(dpath, None) is not None:
+					self.dirty = True
+			return None
+
+		with self.lock:
+			self.load()
+			entry = self.index.get(dpath)
+			if self.is_valid_entry(entry, mtime, pattern):
+				return entry
+			patterns = set(entry['matches']) if entry and 'matches' in entry else set()
+			if pattern is not None:
+				patterns.add(pattern)
+			generation = self.generation
+
+		entry = self.scan_dir(dpath, mtime)
+		entry['matches'] = dict((p, len(fnmatch.filter(entry['files'], p))) for p in patterns)
+		entry['count'] = len(entry['files'])
+		if not self.keep_files:
+			del entry['files']
+
+		with self.lock:
+			if generation == self.generation:
+				self.index[dpath] = entry
+				self.dirty = True
+		return entry
+
+
+	# List the directory. Subclasses can add more data to the entry.
+	def scan_dir(self, dpath, mtime):
+		files = []
+		dirs = []
+		try:
+			with os.scandir(dpath) as it:
+				for dentry in it:
+					try:
+						# Follow symlinks, like "find -follow"
+						if dentry.is_dir():
+							dirs.append(dentry.name)
+						elif dentry.is_file():
+							files.append(dentry.name)
+					except OSError:
+						pass
+		except OSError as e:
+			logging.warning("Can't list '{}' => {}".format(dpath, e))
+		return { 'mtime': mtime, 'files': sorted(files), 'dirs': sorted(dirs) }
+
+
+	def walk(self, path, pattern=None):
+		visited = set()
+		stack = [os.path.normpath(path)]
+		while stack:
+			dpath = stack.pop()
+			# Avoid symlink loops
+			rpath = os.path.realpath(dpath)
+			if rpath in visited:
+				continue
+			visited.add(rpath)
+
+			entry = self.get_entry(dpath, pattern)
+			if entry is None:
+				continue
+			yield dpath, entry
+			for dname in entry['dirs']:
+				stack.append(os.path.join(dpath, dname))
+
+
+	def count_files(self, path, pattern=None):
+		n = 0
+		for dpath, entry in self.walk(path, pattern):
+			if pattern:
+				n += entry['matches'][pattern]
+			else:
+				n += entry['count']
+		self.save()
+		return n
+
+
+	# Yield the full path of every file below path. Only for indexes keeping
+	# the file names. The lock is not held between iterations, so a slow
+	# consumer doesn't block other users.
+	def iter_files(self, path):
+		try:
+			for dpath, entry in self.walk(path):
+				for fname in entry['files']:
+					yield os.path.join(dpath, fname)
+		finally:
+			self.save()
+
+
+	# Count not-hidden subdirectories at the given depth below path
+	def count_dirs(self, path, depth=1):
+		dpaths = [path]
+		for i in range(depth):
+			subdpaths = []
+			for dpath in dpaths:
+				entry = self.get_entry(dpath)
+				if entry:
+					subdpaths += [os.path.join(dpath, d) for d in entry['dirs'] if not d.startswith('.')]
+			dpaths = subdpaths
+		self.save()
+		return len(dpaths)
+
+
+	# Called by the handlers that add or remove files, so the change is
+	# picked even on filesystems with coarse mtime resolution (FAT). It's
+	# called from the IOLoop, so the index is saved by the next walk.
+	def invalidate(self, path):
+		with self.lock:
+			self.load()
+			self.generation += 1
+			path = os.path.normpath(path)
+			for dpath in (path, os.path.dirname(path)):
+				if self.index.pop(dpath, None) is not None:
+					self.dirty = True
+
+
+file_count_index = FileCountIndex()
+
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Git Repository Status: branch, commit id, branch & tag lists read
+# directly from the .git directory, plus background remote fetching.
+#
+# Copyright (C) 2020 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import os
+import re
+import time
+import logging
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+#------------------------------------------------------------------------------
+# Remote fetches run one at a time, out of the IOLoop
+#------------------------------------------------------------------------------
+
+git_executor = ThreadPoolExecutor(max_workers=1)
+
+#------------------------------------------------------------------------------
+# Git Repository Status
+#------------------------------------------------------------------------------
+
+class GitRepoStatus(object):
+
+	# Seconds between automatic remote fetches
+	FETCH_INTERVAL = 3600
+	# Seconds between progress notifications while fetching
+	PROGRESS_INTERVAL = 0.25
+
+	REFS_STAMP_PATHS = ("packed-refs", "refs/heads", "refs/tags", "refs/remotes/origin")
+
+	def __init__(self, repo_dir):
+		self.repo_dir = repo_dir
+		self.git_dir = self.find_git_dir()
+		self.lock = threading.Lock()
+		self.refs = None
+		self.refs_stamp = None
+		self.last_fetch = None
+
+
+	def find_git_dir(self):
+		git_dir = os.path.join(self.repo_dir, ".git")
+		# Worktrees & submodules have a ".git" file pointing to the real one
+		if os.path.isfile(git_dir):
+			with open(git_dir) as f:
+				line = f.readline().strip()
+				if line.startswith("gitdir:"):
+					git_dir = os.path.normpath(os.path.join(self.repo_dir, line[7:].strip()))
+		return git_dir
+
+
+	# Git updates loose refs by renaming a lock file in the ref's directory,
+	# so the mtime of every directory below the ref paths is stamped. Nested
+	# refs, like "refs/heads/feature/x", only change their own directory.
+	def get_refs_stamp(self):
+		stamp = []
+		for p in self.REFS_STAMP_PATHS:
+			fpath = os.path.join(self.git_dir, p)
+			try:
+				stamp.append((p, os.stat(fpath).st_mtime_ns))
+			except OSError:
+				stamp.append((p, None))
+				continue
+			if os.path.isdir(fpath):
+				for dirpath, dirnames, filenames in os.walk(fpath):
+					for dname in dirnames:
+						dpath = os.path.join(dirpath, dname)
+						try:
+							stamp.append((dpath, os.stat(dpath).st_mtime_ns))
+						except OSError:
+							stamp.append((dpath, None))
+		return tuple(stamp)
+
+
+	def read_refs(self):
+		refs = {}
+		# Packed refs first, loose refs take precedence
+		try:
+			with open(os.path.join(self.git_dir, "packed-refs")) as f:
+				for line in f:
+					line = line.strip()
+					if not line or line[0] in "#^":
+						continue
+					parts = line.split(" ", 1)
+					if len(parts) == 2:
+						refs[parts[1]] = parts[0]
+		except OSError:
+			pass
+
+		for dirpath, dirnames, filenames in os.walk(os.path.join(self.git_dir, "refs")):
+			for fname in filenames:
+				fpath = os.path.join(dirpath, fname)
+				try:
+					with open(fpath) as f:
+						value = f.read().strip()
+				except OSError:
+					continue
+				# Skip symbolic refs, like "refs/remotes/origin/HEAD"
+				if value and not value.startswith("ref:"):
+					refs[os.path.relpath(fpath, self.git_dir)] = value
+
+		return refs
+
+
+	def get_refs(self):
+		with self.lock:
+			stamp = self.get_refs_stamp()
+			if self.refs is None or stamp != self.refs_stamp:
+				self.refs = self.read_refs()
+				self.refs_stamp = stamp
+			return self.refs
+
+
+	def invalidate(self):
+		with self.lock:
+			self.refs = None
+
+
+	def get_head(self):
+		with open(os.path.join(self.git_dir, "HEAD")) as f:
+			head = f.read().strip()
+		if head.startswith("ref:"):
+			ref = head[4:].strip()
+			return ref, self.get_refs().get(ref, "")
+		else:
+			return None, head
+
+
+	@staticmethod
+	def get_branch_name(ref, gitid):
+		if ref and ref.startswith("refs/heads/"):
+			return ref[11:]
+		else:
+			return "(HEAD detached at {})".format(gitid[0:7])
+
+
+	def get_current_branch(self):
+		return self.get_branch_name(*self.get_head())
+
+
+	def get_gitid(self):
+		return self.get_head()[1]
+
+
+	def get_git_info(self):
+		ref, gitid = self.get_head()
+		return { "branch": self.get_branch_name(ref, gitid), "gitid": gitid, "update": None }
+
+
+	# Same list & order than "git branch -a": local branches, then remote ones
+	def get_branch_list(self):
+		result = ["master"]
+		refs = self.get_refs()
+		local_branches = sorted(r[11:] for r in refs if r.startswith("refs/heads/"))
+		remote_branches = sorted(r[20:] for r in refs if r.startswith("refs/remotes/origin/"))
+		for bname in local_branches + remote_branches:
+			if bname not in result and bname != "HEAD":
+				result.append(bname)
+		return result
+
+
+	def get_tag_list(self):
+		result = ["master"]
+		result += sorted(r[10:] for r in self.get_refs() if r.startswith("refs/tags/"))
+		return result
+
+
+	def needs_fetch(self):
+		return self.last_fetch is None or (time.monotonic() - self.last_fetch) > self.FETCH_INTERVAL
+
+
+	# Blocking! Run it in the git_executor. Progress lines are passed to the callback.
+	def fetch(self, progress_cb=None):
+		logging.info("Fetching remote for '{}' ...".format(self.repo_dir))
+		proc = subprocess.Popen(["git", "fetch", "origin", "--prune", "--progress"], cwd=self.repo_dir,
+			stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+		last_progress = 0
+		buf = b""
+		while True:
+			data = proc.stdout.read1(1024)
+			if not data:
+				break
+			buf += data
+			# Git uses "\r" for updating progress lines
+			lines = re.split(b"[\r\n]", buf)
+			buf = lines.pop()
+			now = time.monotonic()
+			if progress_cb and lines and (now - last_progress) > self.PROGRESS_INTERVAL:
+				last_progress = now
+				progress_cb(lines[-1].decode("utf-8", "ignore"))
+
+		if progress_cb and buf:
+			progress_cb(buf.decode("utf-8", "ignore"))
+
+		res = proc.wait()
+		self.invalidate()
+		self.last_fetch = time.monotonic()
+		if res != 0:
+			raise Exception("git fetch returned {}".format(res))
+
+
+#------------------------------------------------------------------------------
+# Status objects are shared by all the handlers
+#------------------------------------------------------------------------------
+
+repo_status_list = {}
+repo_status_lock = threading.Lock()
+
+def get_repo_status(repo_dir):
+	with repo_status_lock:
+		if repo_dir not in repo_status_list:
+			repo_status_list[repo_dir] = GitRepoStatus(repo_dir)
+		return repo_status_list[repo_dir]
+
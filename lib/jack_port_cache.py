@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# JACK Port Cache: persistent JACK client & MIDI port graph
+#
+# Copyright (C) 2020 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import jack
+import logging
+import threading
+import tornado.ioloop
+
+#------------------------------------------------------------------------------
+# Module helper functions
+#------------------------------------------------------------------------------
+
+def get_port_alias(midi_port):
+	try:
+		alias=midi_port.aliases[0]
+		logging.debug("ALIAS for %s => %s" % (midi_port.name, alias))
+		#Each returned alias string is something like that:
+		# in-hw-1-0-0-LPK25-MIDI-1
+		#or
+		# out-hw-2-0-0-MK-249C-USB-MIDI-keyboard-MIDI-
+		alias=' '.join(alias.split('-')[5:])
+	except:
+		alias=midi_port.name.replace('_',' ')
+	return alias
+
+#------------------------------------------------------------------------------
+# JACK Port Cache
+#------------------------------------------------------------------------------
+# One JACK client for the whole webconf. The MIDI ports list is read from
+# JACK only after a port is registered, unregistered or renamed: JACK
+# callbacks run in the JACK thread, so they only set the dirty flag, and the
+# list is refreshed by the next reader. If JACK goes down, the client is
+# created again on the next read, or every RETRY_INTERVAL seconds while
+# there are listeners.
+#
+# Listeners get incremental updates in the IOLoop: JACK events are passed
+# with add_callback and coalesced for UPDATE_DELAY seconds, so plugging a
+# device with many ports sends a single update with the added & removed
+# ports, and the port connections changed. Updates are diffed against the
+# last sent ports, not the cached ones, that any reader can refresh.
+
+class JackPortCache(object):
+
+	CLIENT_NAME = "ZynthianWebConf"
+	# Non-physical MIDI ports shown as devices. Only the first port of every
+	# client is used.
+	VIRTUAL_CLIENTS = ["QmidiNet", "jackrtpmidid", "TouchOSC Bridge"]
+	UPDATE_DELAY = 0.2
+	RETRY_INTERVAL = 2
+
+	def __init__(self):
+		self.lock = threading.RLock()
+		self.client = None
+		self.dirty = True
+		self.midi_ports = None
+		self.sent_midi_ports = None
+		self.loop = None
+		self.listeners = []
+		self.pending_connections = []
+		self.update_handle = None
+
+
+	def get_client(self):
+		if self.client is None:
+			client = jack.Client(self.CLIENT_NAME, no_start_server=True)
+			client.set_port_registration_callback(self.on_port_registration)
+			client.set_port_rename_callback(self.on_port_rename)
+			client.set_port_connect_callback(self.on_port_connect)
+			client.set_shutdown_callback(self.on_shutdown)
+			client.activate()
+			self.client = client
+		return self.client
+
+
+	def close_client(self):
+		client = self.client
+		self.client = None
+		if client:
+			try:
+				client.close()
+			except Exception:
+				pass
+
+
+	# JACK thread callbacks
+	def on_port_registration(self, port, register):
+		self.dirty = True
+		self.post_update()
+
+
+	def on_port_rename(self, port, old, new):
+		self.dirty = True
+		self.post_update()
+
+
+	def on_port_connect(self, a, b, connect):
+		if self.loop and a.is_midi:
+			self.post_update({ 'source': a.name, 'destination': b.name, 'connected': connect })
+
+
+	def on_shutdown(self, status, reason):
+		logging.warning("JACK shutdown => {}".format(reason))
+		self.dirty = True
+		self.client = None
+		self.post_update()
+
+
+	def post_update(self, connection=None):
+		if self.loop:
+			self.loop.add_callback(self.schedule_update, connection)
+
+
+	# Called in the IOLoop. listener(update) is called in the IOLoop too.
+	def add_listener(self, listener):
+		self.loop = tornado.ioloop.IOLoop.current()
+		if listener not in self.listeners:
+			self.listeners.append(listener)
+		# The client must exist to get the JACK events
+		midi_ports = self.get_midi_ports()
+		if self.sent_midi_ports is None:
+			self.sent_midi_ports = midi_ports
+		self.schedule_retry()
+
+
+	def remove_listener(self, listener):
+		if listener in self.listeners:
+			self.listeners.remove(listener)
+		if not self.listeners:
+			self.sent_midi_ports = None
+
+
+	def schedule_update(self, connection=None):
+		if connection:
+			self.pending_connections.append(connection)
+		if self.update_handle is None:
+			self.update_handle = self.loop.call_later(self.UPDATE_DELAY, self.send_update)
+
+
+	# Without client there are no JACK events, so try to create it again
+	def schedule_retry(self):
+		if self.client is None and self.listeners and self.update_handle is None:
+			self.update_handle = self.loop.call_later(self.RETRY_INTERVAL, self.send_update)
+
+
+	@staticmethod
+	def get_ports_diff(old_ports, new_ports):
+		old_names = set(p['name'] for p in old_ports)
+		new_names = set(p['name'] for p in new_ports)
+		return [p for p in new_ports if p['name'] not in old_names], [p['name'] for p in old_ports if p['name'] not in new_names]
+
+
+	def send_update(self):
+		self.update_handle = None
+		if not self.listeners:
+			self.pending_connections = []
+			return
+		old_midi_ports = self.sent_midi_ports or { 'IN': [], 'OUT': [] }
+		midi_ports = self.get_midi_ports()
+		self.sent_midi_ports = midi_ports
+		self.schedule_retry()
+		update = { 'added': {}, 'removed': {}, 'connections': self.pending_connections }
+		self.pending_connections = []
+		changed = bool(update['connections'])
+		for key in ('IN', 'OUT'):
+			added, removed = self.get_ports_diff(old_midi_ports[key], midi_ports[key])
+			update['added'][key] = added
+			update['removed'][key] = removed
+			changed = changed or added or removed
+		if changed:
+			for listener in list(self.listeners):
+				try:
+					listener(update)
+				except Exception as e:
+					logging.error("MIDI ports listener failed => {}".format(e))
+
+
+	@staticmethod
+	def get_port_info(port):
+		return {
+			'name': port.name,
+			'shortname': port.shortname,
+			'alias': get_port_alias(port)
+		}
+
+
+	# For jack, output/input convention are reversed => output=readable,
+	# input=writable. All MIDI ports are read with a single query.
+	def read_midi_ports(self):
+		ports = self.get_client().get_ports(is_midi=True)
+		midi_in_ports = [p for p in ports if p.is_physical and p.is_output]
+		midi_out_ports = [p for p in ports if p.is_physical and p.is_input]
+		for client_name in self.VIRTUAL_CLIENTS:
+			in_ports = [p for p in ports if not p.is_physical and p.is_output and client_name in p.name]
+			out_ports = [p for p in ports if not p.is_physical and p.is_input and client_name in p.name]
+			if in_ports and out_ports:
+				midi_in_ports.append(in_ports[0])
+				midi_out_ports.append(out_ports[0])
+		return {
+			'IN': [self.get_port_info(p) for p in midi_in_ports],
+			'OUT': [self.get_port_info(p) for p in midi_out_ports]
+		}
+
+
+	# Returns { 'IN': [...], 'OUT': [...] } with name, shortname & alias of
+	# every port. Don't modify it!
+	def get_midi_ports(self):
+		with self.lock:
+			if self.dirty or self.midi_ports is None:
+				# Clear the flag first, so changes while reading are not lost
+				self.dirty = False
+				try:
+					self.midi_ports = self.read_midi_ports()
+				except Exception as e:
+					logging.error("Can't get MIDI ports from JACK => {}".format(e))
+					# The next successful read is a full refresh
+					self.dirty = True
+					self.midi_ports = None
+					self.close_client()
+					return { 'IN': [], 'OUT': [] }
+			return self.midi_ports
+
+
+jack_port_cache = JackPortCache()
+
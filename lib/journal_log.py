@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Journal Log: journalctl JSON entries parsing & filtering
+#
+# Copyright (C) 2020 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import re
+import json
+import time
+import shlex
+import asyncio
+import logging
+from collections import OrderedDict
+
+#------------------------------------------------------------------------------
+# Journal entries
+#------------------------------------------------------------------------------
+# "journalctl -o json" lines are parsed into compact entries:
+#   { 'ts': seconds, 'priority': 0-7, 'module': str, 'message': str, 'cursor': str }
+# Zynthian UI lines are formatted by python's logging as
+# "LEVEL:module.function: message", so level & module are taken from them.
+
+PRIORITY_NAMES = ["EMERG", "ALERT", "CRIT", "ERROR", "WARNING", "NOTICE", "INFO", "DEBUG"]
+
+LOGGING_PRIORITIES = {
+	"CRITICAL": 2,
+	"ERROR": 3,
+	"WARNING": 4,
+	"INFO": 6,
+	"DEBUG": 7
+}
+
+LOGGING_LINE_RE = re.compile(r"^(CRITICAL|ERROR|WARNING|INFO|DEBUG):([\w\.<>]+): ?(.*)$", re.DOTALL)
+
+
+def get_field_text(value):
+	# Non UTF-8 fields are encoded as byte arrays
+	if isinstance(value, list):
+		return bytes(value).decode("utf-8", "replace")
+	elif value is None:
+		return ""
+	return str(value)
+
+
+def parse_journal_line(line):
+	try:
+		fields = json.loads(line)
+	except ValueError:
+		# journalctl messages, like "-- No entries --"
+		return { 'ts': None, 'priority': 6, 'module': "", 'message': line, 'cursor': None }
+
+	try:
+		ts = int(fields['__REALTIME_TIMESTAMP']) / 1000000
+	except (KeyError, ValueError):
+		ts = None
+	try:
+		priority = int(fields.get('PRIORITY', 6))
+	except ValueError:
+		priority = 6
+	module = get_field_text(fields.get('SYSLOG_IDENTIFIER') or fields.get('_COMM'))
+	message = get_field_text(fields.get('MESSAGE'))
+
+	m = LOGGING_LINE_RE.match(message)
+	if m:
+		priority = LOGGING_PRIORITIES[m.group(1)]
+		module = m.group(2)
+		message = m.group(3)
+
+	return {
+		'ts': ts,
+		'priority': priority,
+		'module': module,
+		'message': message,
+		'cursor': fields.get('__CURSOR')
+	}
+
+#------------------------------------------------------------------------------
+# Journal filter
+#------------------------------------------------------------------------------
+
+class JournalFilter(object):
+
+	# level: max priority (0-7), search: regular expression, since & until:
+	# timestamps in seconds. Raises re.error if search is not valid.
+	def __init__(self, level=7, search=None, since=None, until=None):
+		self.level = level
+		self.search_re = re.compile(search, re.IGNORECASE) if search else None
+		self.since = since
+		self.until = until
+
+
+	@classmethod
+	def from_data(cls, data):
+		def get_float(key):
+			try:
+				return float(data[key]) if data.get(key) not in (None, "") else None
+			except (TypeError, ValueError):
+				logging.warning("Invalid log filter {} => {}".format(key, data[key]))
+				return None
+
+		level = get_float('level')
+		return cls(7 if level is None else int(level), data.get('search'), get_float('since'), get_float('until'))
+
+
+	def get_key(self):
+		return (self.level, self.search_re.pattern if self.search_re else None, self.since, self.until)
+
+
+	def match(self, entry):
+		if entry['priority'] > self.level:
+			return False
+		if entry['ts'] is not None:
+			if self.since is not None and entry['ts'] < self.since:
+				return False
+			if self.until is not None and entry['ts'] > self.until:
+				return False
+		if self.search_re and not self.search_re.search(entry['message']) and not self.search_re.search(entry['module']):
+			return False
+		return True
+
+
+#------------------------------------------------------------------------------
+# Journal query
+#------------------------------------------------------------------------------
+# Pages of past entries, read with "journalctl --since/--until/--cursor".
+# Journal files are append-only, so a full page between two cursors never
+# changes: full pages are kept in a small LRU cache, indexed by the cursor
+# they start from. Filters are applied while reading, so a page can scan
+# many entries, up to MAX_SCAN_ENTRIES. The returned cursor continues the
+# scan where it stopped.
+
+class JournalQuery(object):
+
+	MAX_SCAN_ENTRIES = 20000
+	MAX_CACHED_PAGES = 64
+
+	# (unit, cursor, backward, limit, filter key) => page
+	page_cache = OrderedDict()
+
+	def __init__(self, unit, log_filter=None, cursor=None, backward=True, limit=100):
+		self.unit = unit
+		self.log_filter = log_filter or JournalFilter()
+		self.cursor = cursor
+		self.backward = backward
+		self.limit = limit
+
+
+	def get_command(self):
+		command = ["journalctl", "-o", "json", "-u", self.unit]
+		# --since/--until can't be combined with the cursor options. The time
+		# window is checked while reading, anyway.
+		if self.backward:
+			command.append("-r")
+			if self.cursor:
+				command += ["--cursor", self.cursor]
+			elif self.log_filter.until is not None:
+				command.append("--until=@{}".format(int(self.log_filter.until) + 1))
+		else:
+			if self.cursor:
+				command += ["--after-cursor", self.cursor]
+			elif self.log_filter.since is not None:
+				command.append("--since=@{}".format(int(self.log_filter.since)))
+		return command
+
+
+	def get_cache_key(self):
+		return (self.unit, self.cursor, self.backward, self.limit, self.log_filter.get_key())
+
+
+	# The start of the page must be fixed. The newest entries are not.
+	def is_cacheable(self):
+		if self.cursor:
+			return True
+		elif self.backward:
+			return self.log_filter.until is not None and self.log_filter.until < time.time()
+		else:
+			return self.log_filter.since is not None
+
+
+	def is_out_of_window(self, entry):
+		if entry['ts'] is None:
+			return False
+		if self.backward:
+			return self.log_filter.since is not None and entry['ts'] < self.log_filter.since
+		else:
+			return self.log_filter.until is not None and entry['ts'] > self.log_filter.until
+
+
+	# Returns { 'entries': [...], 'cursor': next_cursor, 'more': bool }. Entries
+	# are always in chronological order.
+	async def get_page(self):
+		key = self.get_cache_key()
+		page = self.page_cache.get(key)
+		if page is not None:
+			self.page_cache.move_to_end(key)
+			return page
+
+		page = await self.read_page()
+		if page['more'] and self.is_cacheable():
+			self.page_cache[key] = page
+			while len(self.page_cache) > self.MAX_CACHED_PAGES:
+				self.page_cache.popitem(last=False)
+		return page
+
+
+	async def read_page(self):
+		entries = []
+		next_cursor = self.cursor
+		more = False
+		scanned = 0
+		command = self.get_command()
+		logging.debug("Journal query => {}".format(" ".join(shlex.quote(c) for c in command)))
+		process = await asyncio.create_subprocess_exec(*command,
+			stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+		try:
+			while True:
+				line = await process.stdout.readline()
+				if not line:
+					break
+				entry = parse_journal_line(line.decode("utf-8", "replace"))
+				if not entry['cursor']:
+					continue
+				# "--cursor" includes the entry itself
+				if entry['cursor'] == self.cursor:
+					continue
+				if self.is_out_of_window(entry):
+					break
+				next_cursor = entry['cursor']
+				scanned += 1
+				if self.log_filter.match(entry):
+					entries.append(entry)
+				if len(entries) >= self.limit or scanned >= self.MAX_SCAN_ENTRIES:
+					more = True
+					break
+		finally:
+			if process.returncode is None:
+				try:
+					process.kill()
+				except ProcessLookupError:
+					pass
+			await process.wait()
+
+		if self.backward:
+			entries.reverse()
+		return { 'entries': entries, 'cursor': next_cursor, 'more': more }
+
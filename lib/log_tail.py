@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Log Tail: command output streamed from asyncio subprocess pipes
+#
+# Copyright (C) 2020 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import time
+import shlex
+import asyncio
+import logging
+from collections import deque
+
+#------------------------------------------------------------------------------
+# Log Tail
+#------------------------------------------------------------------------------
+# Runs a command (journalctl -f ...) as an asyncio subprocess, in the IOLoop.
+# Output lines are sent in batches, every BATCH_INTERVAL seconds or every
+# BATCH_LINES lines. The send_lines coroutine should wait until the batch is
+# written, so a slow client stops the reading and the pipe fills, blocking
+# the command instead of buffering the output in memory. Lines longer than
+# LINE_LIMIT bytes (big JSON journal entries) are skipped.
+
+class LogTail(object):
+
+	BATCH_INTERVAL = 0.05
+	BATCH_LINES = 200
+	LINE_LIMIT = 1024 * 1024
+
+	def __init__(self, command, send_lines):
+		self.command = command
+		self.send_lines = send_lines
+		self.process = None
+		self.task = None
+		self.skipping = False
+
+
+	def start(self):
+		if self.task is None:
+			self.task = asyncio.ensure_future(self.run())
+
+
+	def is_running(self):
+		return self.task is not None and not self.task.done()
+
+
+	def stop(self):
+		if self.task:
+			self.task.cancel()
+			self.task = None
+		self.kill_process()
+
+
+	def kill_process(self):
+		if self.process and self.process.returncode is None:
+			try:
+				self.process.kill()
+			except ProcessLookupError:
+				pass
+
+
+	async def run(self):
+		try:
+			# No shell, so killing the process kills the command
+			self.process = await asyncio.create_subprocess_exec(*shlex.split(self.command),
+				stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT, limit=self.LINE_LIMIT)
+			await self.read_lines(self.process.stdout)
+			await self.process.wait()
+
+		except asyncio.CancelledError:
+			pass
+
+		except Exception as e:
+			logging.error("Log tail '{}' failed => {}".format(self.command, e))
+
+		finally:
+			self.kill_process()
+
+
+	async def read_lines(self, stream):
+		lines = []
+		deadline = None
+		while True:
+			timeout = None
+			if lines:
+				timeout = max(0, deadline - time.monotonic())
+			try:
+				# A cancelled read keeps the partial line in the buffer
+				line = await asyncio.wait_for(self.read_line(stream), timeout)
+			except asyncio.TimeoutError:
+				line = None
+
+			if line:
+				if not lines:
+					deadline = time.monotonic() + self.BATCH_INTERVAL
+				lines.append(line.decode("utf-8", "replace").rstrip("\n"))
+
+			# EOF, deadline or full batch
+			if lines and (line is None or line == b"" or len(lines) >= self.BATCH_LINES):
+				await self.send_lines(lines)
+				lines = []
+
+			if line == b"":
+				break
+
+
+	# Like StreamReader.readline, but skipping the lines over the stream
+	# limit, instead of raising ValueError. The skipping state is kept in the
+	# object, so it survives a cancelled read.
+	async def read_line(self, stream):
+		while True:
+			try:
+				line = await stream.readuntil(b"\n")
+			except asyncio.IncompleteReadError as e:
+				line = e.partial
+			except asyncio.LimitOverrunError as e:
+				if not self.skipping:
+					logging.warning("Skipping too long line from '{}'".format(self.command))
+					self.skipping = True
+				await stream.read(e.consumed)
+				continue
+			if self.skipping and line:
+				# End of the skipped line
+				self.skipping = False
+				continue
+			return line
+
+
+#------------------------------------------------------------------------------
+# Shared Log Tail
+#------------------------------------------------------------------------------
+# One tail per key (systemd unit), shared by any number of subscribers. Lines
+# are parsed once by parse_line, if given, and filtered for every subscriber
+# by its match function, so filtered out lines are never sent. The last
+# BACKLOG_LINES lines are kept in a ring buffer and sent to every new
+# subscriber before the live lines. Every subscriber is fed by its own task,
+# so a slow client doesn't stop the others: when it's more than BACKLOG_LINES
+# behind, the oldest pending lines are dropped. The tail is stopped when the
+# last subscriber leaves.
+
+class SharedLogTail(object):
+
+	BACKLOG_LINES = 500
+
+	tails = {}
+
+	def __init__(self, key, command, parse_line=None):
+		self.key = key
+		self.parse_line = parse_line
+		self.backlog = deque(maxlen=self.BACKLOG_LINES)
+		# send_lines => {'pending': deque, 'match': function, 'task': Task}
+		self.subscribers = {}
+		self.log_tail = LogTail(command, self.on_lines)
+
+
+	# send_lines(lines) is a coroutine, match(line) returns True for the
+	# lines to be sent. parse_line is only used by the first subscriber.
+	@classmethod
+	def subscribe(cls, key, command, send_lines, parse_line=None, match=None):
+		tail = cls.tails.get(key)
+		if tail is None:
+			tail = cls(key, command, parse_line)
+			cls.tails[key] = tail
+		tail.add_subscriber(send_lines, match)
+		# Restart the command if it finished
+		if not tail.log_tail.is_running():
+			tail.log_tail.start()
+		return tail
+
+
+	@classmethod
+	def unsubscribe(cls, send_lines):
+		for key, tail in list(cls.tails.items()):
+			tail.remove_subscriber(send_lines)
+			if not tail.subscribers:
+				logging.info("No more subscribers for log tail '{}'".format(key))
+				tail.log_tail.stop()
+				del cls.tails[key]
+
+
+	# The backlog is sent again, with the new filter
+	@classmethod
+	def set_filter(cls, send_lines, match):
+		for tail in cls.tails.values():
+			if send_lines in tail.subscribers:
+				tail.remove_subscriber(send_lines)
+				tail.add_subscriber(send_lines, match)
+
+
+	def add_subscriber(self, send_lines, match=None):
+		if send_lines not in self.subscribers:
+			self.subscribers[send_lines] = {
+				'pending': deque(self.filter_lines(self.backlog, match), maxlen=self.BACKLOG_LINES),
+				'match': match,
+				'task': None
+			}
+			self.feed(send_lines)
+
+
+	def remove_subscriber(self, send_lines):
+		subscriber = self.subscribers.pop(send_lines, None)
+		if subscriber and subscriber['task']:
+			subscriber['task'].cancel()
+
+
+	@staticmethod
+	def filter_lines(lines, match):
+		if match:
+			return [line for line in lines if match(line)]
+		return lines
+
+
+	async def on_lines(self, lines):
+		if self.parse_line:
+			lines = [self.parse_line(line) for line in lines]
+		self.backlog.extend(lines)
+		for send_lines, subscriber in self.subscribers.items():
+			subscriber['pending'].extend(self.filter_lines(lines, subscriber['match']))
+			self.feed(send_lines)
+
+
+	def feed(self, send_lines):
+		subscriber = self.subscribers[send_lines]
+		if subscriber['pending'] and (subscriber['task'] is None or subscriber['task'].done()):
+			subscriber['task'] = asyncio.ensure_future(self.send_pending(send_lines, subscriber))
+
+
+	async def send_pending(self, send_lines, subscriber):
+		try:
+			while subscriber['pending']:
+				lines = list(subscriber['pending'])
+				subscriber['pending'].clear()
+				await send_lines(lines)
+		except asyncio.CancelledError:
+			pass
+		except Exception as e:
+			logging.error("Can't send log lines => {}".format(e))
+			self.remove_subscriber(send_lines)
@@ -23,16 +23,19 @@
 #********************************************************************
 
 import os
-import re
 import sys
-import jack
 import logging
+import jsonpickle
 import tornado.web
+import tornado.websocket
 from collections import OrderedDict
 from subprocess import check_output
 from shutil import copyfile
 
-from lib.zynthian_config_handler import ZynthianConfigHandler
+from lib.zynthian_config_handler import ZynthianConfigHandler, reload_config
+from lib.jack_port_cache import jack_port_cache
+from lib.midi_profile_cache import midi_profile_cache
+from lib.zynthian_websocket_handler import ZynthianWebSocketMessageHandler, ZynthianWebSocketMessage
 
 import zynconf
 from zyngine.zynthian_midi_filter import MidiFilterScript
@@ -44,77 +47,35 @@ from zyngine.zynthian_midi_filter import MidiFilterScript
 # Module Methods
 #------------------------------------------------------------------------------
 
+# Ports are read from the JACK port cache
 def get_ports_config(current_midi_ports=""):
 	midi_ports = { 'IN': [], 'OUT': [], 'FB': [] }
 	try:
-		#Get MIDI ports list from jack
-		client = jack.Client("ZynthianWebConf")
-		#For jack, output/input convention are reversed => output=readable, input=writable
-		midi_in_ports = client.get_ports(is_midi=True, is_physical=True, is_output=True)
-		midi_out_ports = client.get_ports(is_midi=True, is_physical=True, is_input=True)
-		#Add QMidiNet ports
-		qmidinet_in_ports=client.get_ports("QmidiNet", is_midi=True, is_physical=False, is_output=True )
-		qmidinet_out_ports=client.get_ports("QmidiNet", is_midi=True, is_physical=False, is_input=True )
-		try:
-			midi_in_ports.append(qmidinet_in_ports[0])
-			midi_out_ports.append(qmidinet_out_ports[0])
-		except:
-			pass
-
-		#Add RTP-Midi ports
-		rtpmidi_in_ports=client.get_ports("jackrtpmidid", is_midi=True, is_physical=False, is_output=True )
-		rtpmidi_out_ports=client.get_ports("jackrtpmidid", is_midi=True, is_physical=False, is_input=True )
-		try:
-			midi_in_ports.append(rtpmidi_in_ports[0])
-			midi_out_ports.append(rtpmidi_out_ports[0])
-		except:
-			pass
-
-		#Add TouchOSC-Midi ports
-		touchosc_in_ports=client.get_ports("TouchOSC Bridge", is_midi=True, is_physical=False, is_output=True )
-		touchosc_out_ports=client.get_ports("TouchOSC Bridge", is_midi=True, is_physical=False, is_input=True )
-		try:
-			midi_in_ports.append(touchosc_in_ports[0])
-			midi_out_ports.append(touchosc_out_ports[0])
-		except:
-			pass
+		jack_midi_ports = jack_port_cache.get_midi_ports()
 
 		disabled_midi_in_ports=zynconf.get_disabled_midi_in_ports(current_midi_ports)
 		enabled_midi_out_ports=zynconf.get_enabled_midi_out_ports(current_midi_ports)
 		enabled_midi_fb_ports=zynconf.get_enabled_midi_fb_ports(current_midi_ports)
 
 		#Generate MIDI_PORTS{IN,OUT,FB} configuration array
-		for idx,midi_port in enumerate(midi_in_ports):
-			alias=get_port_alias(midi_port)
-			port_id=alias.replace(' ','_')
-			midi_ports['IN'].append({
-				'name': midi_port.name,
-				'shortname': midi_port.shortname,
-				'alias': alias,
-				'id': port_id,
-				'checked': 'checked="checked"' if port_id not in disabled_midi_in_ports else ''
-			})
-		for idx,midi_port in enumerate(midi_out_ports):
-			alias=get_port_alias(midi_port)
-			port_id=alias.replace(' ','_')
-			midi_ports['OUT'].append({
-				'name': midi_port.name,
-				'shortname': midi_port.shortname,
-				'alias': alias,
-				'id': port_id,
-				'checked': 'checked="checked"' if port_id in enabled_midi_out_ports else ''
-			})
-		for idx,midi_port in enumerate(midi_out_ports):
-			alias=get_port_alias(midi_port)
-			port_id=alias.replace(' ','_')
-			midi_ports['FB'].append({
-				'name': midi_port.name,
-				'shortname': midi_port.shortname,
-				'alias': alias,
-				'id': port_id,
-				'checked': 'checked="checked"' if port_id in enabled_midi_fb_ports else ''
-			})
-
+		for midi_port in jack_midi_ports['IN']:
+			port_id=midi_port['alias'].replace(' ','_')
+			midi_ports['IN'].append(dict(midi_port,
+				id=port_id,
+				checked='checked="checked"' if port_id not in disabled_midi_in_ports else ''
+			))
+		for midi_port in jack_midi_ports['OUT']:
+			port_id=midi_port['alias'].replace(' ','_')
+			midi_ports['OUT'].append(dict(midi_port,
+				id=port_id,
+				checked='checked="checked"' if port_id in enabled_midi_out_ports else ''
+			))
+		for midi_port in jack_midi_ports['OUT']:
+			port_id=midi_port['alias'].replace(' ','_')
+			midi_ports['FB'].append(dict(midi_port,
+				id=port_id,
+				checked='checked="checked"' if port_id in enabled_midi_fb_ports else ''
+			))
 
 	except Exception as e:
 		logging.error("%s" %e)
@@ -123,20 +84,6 @@ def get_ports_config(current_midi_ports=""):
 	return midi_ports
 
 
-def get_port_alias(midi_port):
-	try:
-		alias=midi_port.aliases[0]
-		logging.debug("ALIAS for %s => %s" % (midi_port.name, alias))
-		#Each returned alias string is something like that:
-		# in-hw-1-0-0-LPK25-MIDI-1
-		#or
-		# out-hw-2-0-0-MK-249C-USB-MIDI-keyboard-MIDI-
-		alias=' '.join(alias.split('-')[5:])
-	except:
-		alias=midi_port.name.replace('_',' ')
-	return alias
-
-
 #------------------------------------------------------------------------------
 # Midi Config Handler
 #------------------------------------------------------------------------------
@@ -598,6 +545,8 @@ class MidiConfigHandler(ZynthianConfigHandler):
 					mode |= (mode & 0o444) >> 2	# copy R bits to X
 					os.chmod(self.current_midi_profile_script, mode)
 					errors = zynconf.save_config({'ZYNTHIAN_SCRIPT_MIDI_PROFILE':self.current_midi_profile_script})
+					reload_config()
+					midi_profile_cache.invalidate(self.current_midi_profile_script)
 					self.load_midi_profile_directories()
 				except:
 					errors['zynthian_midi_profile_saveas_script'] = "Can't create new profile!"
@@ -606,8 +555,10 @@ class MidiConfigHandler(ZynthianConfigHandler):
 				#DELETE
 				if self.current_midi_profile_script.startswith(self.PROFILES_DIRECTORY):
 					os.remove(self.current_midi_profile_script)
+					midi_profile_cache.invalidate(self.current_midi_profile_script)
 					self.current_midi_profile_script = "{}/default.sh".format(self.PROFILES_DIRECTORY)
 					errors = zynconf.save_config({'ZYNTHIAN_SCRIPT_MIDI_PROFILE':self.current_midi_profile_script})
+					reload_config()
 					self.load_midi_profile_directories()
 				else:
 					errors['zynthian_midi_profile_delete_script'] = 'You are allowed to delete user profiles only!'
@@ -624,6 +575,7 @@ class MidiConfigHandler(ZynthianConfigHandler):
 						del escaped_request_arguments[k]
 
 					zynconf.update_midi_profile(escaped_request_arguments, self.current_midi_profile_script)
+					midi_profile_cache.invalidate(self.current_midi_profile_script)
 					errors = self.update_config(escaped_request_arguments)
 				else:
 					errors['zynthian_midi_profile_new_script_name'] = 'No profile name!'
@@ -634,8 +586,8 @@ class MidiConfigHandler(ZynthianConfigHandler):
 
 
 	def load_midi_profile_directories(self):
-		#Get profiles list
-		self.midi_profile_scripts = ["%s/%s" % (self.PROFILES_DIRECTORY, x) for x in os.listdir(self.PROFILES_DIRECTORY)]
+		#Get profiles list (cached by directory mtime)
+		self.midi_profile_scripts = midi_profile_cache.get_scripts()
 		#If list is empty ...
 		if len(self.midi_profile_scripts)==0:
 			self.current_midi_profile_script = "%s/default.sh" % self.PROFILES_DIRECTORY
@@ -666,25 +618,10 @@ class MidiConfigHandler(ZynthianConfigHandler):
 				return "ERROR parsing MIDI filter rule: " + str(e)
 
 
+	# Profiles are only parsed again when they change
 	def load_midi_profiles(self):
-		self.midi_profile_presets=OrderedDict([])
-		p = re.compile("export (\w*)=\"(.*)\"")
-		invalidFiles = []
-		for midi_profile_script in self.midi_profile_scripts:
-			#logging.info(midi_profile_script)
-			profile_values = {}
-			try:
-				with open(midi_profile_script) as f:
-					for line in f:
-						if line[0]=='#':
-							continue
-						m = p.match(line)
-						if m:
-							profile_values[m.group(1)] = m.group(2)
-				self.midi_profile_presets[midi_profile_script] = profile_values
-				logging.debug("LOADED MIDI PROFILE %s" % midi_profile_script)
-			except:
-				invalidFiles.append(midi_profile_script)
+		self.midi_profile_presets = midi_profile_cache.get_profiles(self.midi_profile_scripts)
+		invalidFiles = [x for x in self.midi_profile_scripts if x not in self.midi_profile_presets]
 
 		for midi_profile_script in invalidFiles:
 			logging.warning("Invalid MIDI profile will be ignored: " + midi_profile_script)
@@ -703,3 +640,42 @@ class MidiConfigHandler(ZynthianConfigHandler):
 		else:
 			return default
 
+
+#------------------------------------------------------------------------------
+# MIDI ports hot-plug: JACK port changes are pushed to the subscribers
+#------------------------------------------------------------------------------
+
+class MidiPortsMessageHandler(ZynthianWebSocketMessageHandler):
+
+	websocket_message_handler_list = []
+
+	@classmethod
+	def is_registered_for(cls, handler_name):
+		return handler_name == 'MidiPortsMessageHandler'
+
+
+	def on_websocket_message(self, action):
+		if action == 'SUBSCRIBE':
+			if self not in MidiPortsMessageHandler.websocket_message_handler_list:
+				MidiPortsMessageHandler.websocket_message_handler_list.append(self)
+			jack_port_cache.add_listener(MidiPortsMessageHandler.broadcast)
+		else:
+			logging.error('Unknown action {}'.format(action))
+
+
+	def on_close(self):
+		if self in MidiPortsMessageHandler.websocket_message_handler_list:
+			MidiPortsMessageHandler.websocket_message_handler_list.remove(self)
+		if not MidiPortsMessageHandler.websocket_message_handler_list:
+			jack_port_cache.remove_listener(MidiPortsMessageHandler.broadcast)
+
+
+	# data: { 'added': {'IN': [...], 'OUT': [...]}, 'removed': {'IN': [names], 'OUT': [names]}, 'connections': [...] }
+	@classmethod
+	def broadcast(cls, data):
+		message = jsonpickle.encode(ZynthianWebSocketMessage('MidiPortsMessageHandler', data))
+		for websocket_message_handler in list(cls.websocket_message_handler_list):
+			try:
+				websocket_message_handler.websocket.write_message(message)
+			except tornado.websocket.WebSocketClosedError:
+				websocket_message_handler.on_close()
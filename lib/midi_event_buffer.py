@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# MIDI Event Buffer: MIDI input events queued for batched sending
+#
+# Copyright (C) 2020 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import time
+from collections import deque
+
+#------------------------------------------------------------------------------
+# MIDI Event Buffer
+#------------------------------------------------------------------------------
+# The MIDI input callback runs in the rtmidi thread. It only appends the raw
+# bytes & timestamp to a deque, that is thread-safe without locks for a
+# single producer & consumer. The IOLoop drains it periodically and sends the
+# events in batches. If the consumer falls behind, the oldest events are
+# dropped, and counted.
+#
+# Drained events are encoded as [time_ms, count, byte0, byte1, ...], where
+# time_ms is relative to the buffer creation. Continuous messages (CC, pitch
+# bend, aftertouch, clock, active sensing) are coalesced in every batch: only
+# the last value of every controller is kept, with the number of messages.
+
+class MidiEventBuffer(object):
+
+	MAX_EVENTS = 8192
+
+	# Status => function returning the coalescing key
+	COALESCED = {
+		0xA0: lambda data: (data[0], data[1]),
+		0xB0: lambda data: (data[0], data[1]),
+		0xD0: lambda data: (data[0],),
+		0xE0: lambda data: (data[0],)
+	}
+	COALESCED_SYSTEM = (0xF8, 0xFE)
+
+	def __init__(self):
+		self.t0 = time.monotonic()
+		self.events = deque(maxlen=self.MAX_EVENTS)
+		# Only written by the producer & consumer respectively
+		self.received = 0
+		self.consumed = 0
+
+
+	# Called from the rtmidi thread. The event is counted after appending it,
+	# so a drain in between can't take it for a dropped one.
+	def on_midi_in(self, msg):
+		self.events.append((time.monotonic(), msg.bytes()))
+		self.received += 1
+
+
+	# Returns (events, dropped)
+	def drain(self):
+		events = []
+		for i in range(len(self.events)):
+			events.append(self.events.popleft())
+		self.consumed += len(events)
+		dropped = self.received - self.consumed - len(self.events)
+		if dropped > 0:
+			self.consumed += dropped
+		else:
+			dropped = 0
+		return self.coalesce(events), dropped
+
+
+	def get_coalescing_key(self, data):
+		if not data:
+			return None
+		status = data[0]
+		if status in self.COALESCED_SYSTEM:
+			return (status,)
+		get_key = self.COALESCED.get(status & 0xF0) if status < 0xF0 else None
+		if get_key and len(data) >= 2:
+			return get_key(data)
+		return None
+
+
+	def coalesce(self, events):
+		encoded = []
+		last = {}
+		for ts, data in events:
+			time_ms = int((ts - self.t0) * 1000)
+			key = self.get_coalescing_key(data)
+			if key is not None and key in last:
+				event = last[key]
+				event[0] = time_ms
+				event[1] += 1
+				event[2:] = data
+				continue
+			event = [time_ms, 1] + list(data)
+			encoded.append(event)
+			if key is not None:
+				last[key] = event
+		return encoded
+
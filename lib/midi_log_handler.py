@@ -23,13 +23,20 @@
 #********************************************************************
 
 import os
+import time
 import logging
 import tornado.web
 import jsonpickle
 import mido
-import asyncio
+import tornado.ioloop
+import tornado.iostream
+import tornado.websocket
 from collections import OrderedDict
-from lib.tail_thread import TailThread
+from lib.midi_event_buffer import MidiEventBuffer
+from lib.midi_stats import MidiStats
+from lib.midi_recorder import midi_recorder
+from lib.captures_config_handler import CapturesConfigHandler
+from lib.file_count_index import file_count_index
 from lib.zynthian_config_handler import ZynthianBasicHandler
 from lib.zynthian_websocket_handler import ZynthianWebSocketMessageHandler, ZynthianWebSocketMessage
 from lib.midi_config_handler import get_ports_config
@@ -106,36 +113,115 @@ class MidiLogHandler(ZynthianBasicHandler):
 
 
 class MidiLogMessageHandler(ZynthianWebSocketMessageHandler):
-	mido_port = None
-	midi_port_name = None
+
+	# Batches are sent every SEND_INTERVAL ms
+	SEND_INTERVAL = 50
 
 	@classmethod
 	def is_registered_for(cls, handler_name):
 		return handler_name == 'MidiLogMessageHandler'
 
 
+	def __init__(self, handler_name, websocket):
+		super().__init__(handler_name, websocket)
+		self.mido_port = None
+		self.midi_port_name = None
+		self.event_buffer = None
+		self.write_future = None
+		self.sender = tornado.ioloop.PeriodicCallback(self.send_events, self.SEND_INTERVAL)
+
+
 	def do_start_logging(self, midi_port_name):
 		logging.info("start midi logging on {}".format(midi_port_name))
 
 		self.do_stop_logging()
-		MidiLogMessageHandler.midi_port_name = midi_port_name
+		self.midi_port_name = midi_port_name
 
 		try:
 			mido.set_backend('mido.backends.rtmidi/UNIX_JACK')
-			MidiLogMessageHandler.mido_port = mido.open_input(self.midi_port_name, callback=self.on_midi_in)
+			self.event_buffer = MidiEventBuffer()
+			self.mido_port = mido.open_input(self.midi_port_name, callback=self.event_buffer.on_midi_in)
+			self.sender.start()
 		except:
 			logging.error("Can't open MIDI Port {}".format(self.midi_port_name))
 
 
-	def on_midi_in(self, msg):
-		message = ZynthianWebSocketMessage('MidiLogMessageHandler', msg)
-		self.websocket.write_message(jsonpickle.encode(message))
+	# Runs in the IOLoop. A new batch is not sent until the previous one is
+	# written, so a slow client makes bigger batches (or drops the oldest
+	# events) instead of queueing messages in the websocket.
+	def send_events(self):
+		if self.write_future:
+			if not self.write_future.done():
+				return
+			try:
+				self.write_future.result()
+			except (tornado.websocket.WebSocketClosedError, tornado.iostream.StreamClosedError):
+				self.do_stop_logging()
+				return
+			finally:
+				self.write_future = None
+
+		events, dropped = self.event_buffer.drain()
+		if events or dropped:
+			message = ZynthianWebSocketMessage('MidiLogMessageHandler', { 'events': events, 'dropped': dropped })
+			try:
+				self.write_future = self.websocket.write_message(jsonpickle.encode(message))
+			except tornado.websocket.WebSocketClosedError:
+				self.do_stop_logging()
 
 
 	def do_stop_logging(self):
-		if MidiLogMessageHandler.mido_port:
+		self.sender.stop()
+		if self.mido_port:
 			logging.info("stop midi logging")
-			MidiLogMessageHandler.mido_port.close()
+			self.mido_port.close()
+			self.mido_port = None
+
+
+	def send_recorder_status(self, exported=None):
+		data = { 'recorder': midi_recorder.get_status() }
+		if exported:
+			data['exported'] = exported
+		message = ZynthianWebSocketMessage('MidiLogMessageHandler', data)
+		try:
+			self.websocket.write_message(jsonpickle.encode(message))
+		except tornado.websocket.WebSocketClosedError:
+			pass
+
+
+	# The recorder is not bound to the connection, it keeps recording when
+	# the page is closed.
+	def do_start_recording(self, midi_port_name):
+		if midi_port_name not in [p['name'] for p in MidiLogHandler.get_midi_in_ports()]:
+			logging.error("Invalid MIDI Port {}".format(midi_port_name))
+			self.send_recorder_status()
+			return
+		try:
+			midi_recorder.start(midi_port_name)
+		except Exception as e:
+			logging.error("Can't record MIDI Port {} => {}".format(midi_port_name, e))
+		self.send_recorder_status()
+
+
+	def do_stop_recording(self):
+		midi_recorder.stop()
+		self.send_recorder_status()
+
+
+	# Export the last secs seconds, or everything if secs is None. The window
+	# is relative, because the browser & device clocks can differ a lot.
+	async def do_export_recording(self, secs):
+		since = time.time() - secs if secs else None
+		fname = "midi_log-{}.mid".format(time.strftime("%Y%m%d-%H%M%S"))
+		fpath = os.path.join(CapturesConfigHandler.CAPTURES_DIRECTORY, fname)
+		try:
+			n = await tornado.ioloop.IOLoop.current().run_in_executor(None, midi_recorder.export_smf, fpath, since)
+			logging.info("Exported {} MIDI events to {}".format(n, fpath))
+			file_count_index.invalidate(fpath)
+			self.send_recorder_status({ 'fname': fname, 'events': n })
+		except Exception as e:
+			logging.error("Can't export MIDI recording => {}".format(e))
+			self.send_recorder_status({ 'error': str(e) })
 
 
 	def on_websocket_message(self, message):
@@ -153,6 +239,29 @@ class MidiLogMessageHandler(ZynthianWebSocketMessageHandler):
 		elif action == 'STOP_LOGGING':
 			self.do_stop_logging()
 
+		elif action == 'START_RECORDING':
+			self.do_start_recording(parts[1] if len(parts) > 1 else self.midi_port_name)
+
+		elif action == 'STOP_RECORDING':
+			self.do_stop_recording()
+
+		elif action == 'CLEAR_RECORDING':
+			try:
+				midi_recorder.clear()
+			except Exception as e:
+				logging.error("Can't clear MIDI recording => {}".format(e))
+			self.send_recorder_status()
+
+		elif action == 'GET_RECORDER':
+			self.send_recorder_status()
+
+		elif action == 'EXPORT_RECORDING':
+			try:
+				secs = float(parts[1]) if len(parts) > 1 else None
+			except ValueError:
+				secs = None
+			tornado.ioloop.IOLoop.current().spawn_callback(self.do_export_recording, secs)
+
 		elif action == 'GET_MIDI_PORT':
 			self.websocket.write_message("MIDI_PORT = {}".format(self.midi_port_name))
 
@@ -162,3 +271,88 @@ class MidiLogMessageHandler(ZynthianWebSocketMessageHandler):
 	def on_close(self):
 		logging.info("stopping tail threads")
 		self.do_stop_logging()
+
+
+#------------------------------------------------------------------------------
+# MIDI traffic statistics: only summaries are sent to the browser
+#------------------------------------------------------------------------------
+
+class MidiStatsMessageHandler(ZynthianWebSocketMessageHandler):
+
+	# Summaries are sent every SEND_INTERVAL ms
+	SEND_INTERVAL = 250
+
+	@classmethod
+	def is_registered_for(cls, handler_name):
+		return handler_name == 'MidiStatsMessageHandler'
+
+
+	def __init__(self, handler_name, websocket):
+		super().__init__(handler_name, websocket)
+		self.mido_port = None
+		self.midi_port_name = None
+		self.stats = None
+		self.write_future = None
+		self.sender = tornado.ioloop.PeriodicCallback(self.send_summary, self.SEND_INTERVAL)
+
+
+	def do_start_stats(self, midi_port_name):
+		self.do_stop_stats()
+		if midi_port_name not in [p['name'] for p in MidiLogHandler.get_midi_in_ports()]:
+			logging.error("Invalid MIDI Port {}".format(midi_port_name))
+			return
+
+		logging.info("start midi stats on {}".format(midi_port_name))
+		self.midi_port_name = midi_port_name
+		try:
+			mido.set_backend('mido.backends.rtmidi/UNIX_JACK')
+			self.stats = MidiStats()
+			self.mido_port = mido.open_input(self.midi_port_name, callback=self.stats.on_midi_in)
+			self.sender.start()
+		except:
+			logging.error("Can't open MIDI Port {}".format(self.midi_port_name))
+
+
+	def send_summary(self):
+		if self.write_future:
+			if not self.write_future.done():
+				return
+			try:
+				self.write_future.result()
+			except (tornado.websocket.WebSocketClosedError, tornado.iostream.StreamClosedError):
+				self.do_stop_stats()
+				return
+			finally:
+				self.write_future = None
+
+		summary = self.stats.get_summary()
+		summary['port'] = self.midi_port_name
+		message = ZynthianWebSocketMessage('MidiStatsMessageHandler', summary)
+		try:
+			self.write_future = self.websocket.write_message(jsonpickle.encode(message))
+		except tornado.websocket.WebSocketClosedError:
+			self.do_stop_stats()
+
+
+	def do_stop_stats(self):
+		self.sender.stop()
+		if self.mido_port:
+			logging.info("stop midi stats")
+			self.mido_port.close()
+			self.mido_port = None
+
+
+	def on_websocket_message(self, message):
+		parts = message.split(" ", maxsplit=1)
+		action = parts[0]
+		if action == 'START_STATS' and len(parts) > 1:
+			self.do_start_stats(parts[1])
+		elif action == 'STOP_STATS':
+			self.do_stop_stats()
+		elif action == 'RESET_STATS':
+			if self.stats:
+				self.stats.reset()
+
+
+	def on_close(self):
+		self.do_stop_stats()
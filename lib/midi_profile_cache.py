@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# MIDI Profile Cache: parsed MIDI profile scripts keyed by mtime
+#
+# Copyright (C) 2020 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import os
+import re
+import logging
+import threading
+from collections import OrderedDict
+
+from lib.zynthian_config_handler import get_file_stamp
+
+#------------------------------------------------------------------------------
+# MIDI Profile Cache
+#------------------------------------------------------------------------------
+# The profiles directory is only listed again when its mtime changes, and a
+# profile script is only parsed again when its stamp (inode, size & mtime)
+# changes. Shared by all the handlers. The returned values must not be
+# modified.
+
+class MidiProfileCache(object):
+
+	PROFILES_DIRECTORY = "%s/midi-profiles" % os.environ.get("ZYNTHIAN_CONFIG_DIR")
+	EXPORT_RE = re.compile("export (\w*)=\"(.*)\"")
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.dir_stamp = None
+		self.scripts = []
+		# fpath => (stamp, values)
+		self.profiles = {}
+
+
+	def get_scripts(self):
+		with self.lock:
+			stamp = get_file_stamp(self.PROFILES_DIRECTORY)
+			if stamp != self.dir_stamp:
+				self.scripts = sorted("%s/%s" % (self.PROFILES_DIRECTORY, x) for x in os.listdir(self.PROFILES_DIRECTORY))
+				self.dir_stamp = stamp
+				# Forget removed profiles
+				for fpath in [p for p in self.profiles if p not in self.scripts]:
+					del self.profiles[fpath]
+			return list(self.scripts)
+
+
+	@classmethod
+	def parse_profile(cls, fpath):
+		values = {}
+		with open(fpath) as f:
+			for line in f:
+				if line[0]=='#':
+					continue
+				m = cls.EXPORT_RE.match(line)
+				if m:
+					values[m.group(1)] = m.group(2)
+		return values
+
+
+	# Returns the exported values of the profile script, or None if it
+	# can't be read.
+	def get_profile(self, fpath):
+		with self.lock:
+			stamp = get_file_stamp(fpath)
+			cached = self.profiles.get(fpath)
+			if cached is None or cached[0] != stamp:
+				try:
+					values = self.parse_profile(fpath)
+					logging.debug("LOADED MIDI PROFILE %s" % fpath)
+				except Exception as e:
+					logging.debug("Can't load MIDI profile {} => {}".format(fpath, e))
+					values = None
+				cached = (stamp, values)
+				self.profiles[fpath] = cached
+			return cached[1]
+
+
+	# Returns { fpath: values } for the valid profiles
+	def get_profiles(self, scripts=None):
+		profiles = OrderedDict()
+		for fpath in (scripts if scripts is not None else self.get_scripts()):
+			values = self.get_profile(fpath)
+			if values is not None:
+				profiles[fpath] = values
+		return profiles
+
+
+	# Called by the handlers that create, modify or delete profiles, so the
+	# change is picked even on filesystems with coarse mtime resolution.
+	def invalidate(self, fpath=None):
+		with self.lock:
+			self.dir_stamp = None
+			if fpath:
+				self.profiles.pop(fpath, None)
+
+
+midi_profile_cache = MidiProfileCache()
+
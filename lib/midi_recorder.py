@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# MIDI Recorder: MIDI events ring buffer on disk & SMF export
+#
+# Copyright (C) 2020 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import os
+import mmap
+import time
+import mido
+import struct
+import logging
+import threading
+
+from lib.persistent_cache import CACHE_DIR
+
+#------------------------------------------------------------------------------
+# MIDI Ring Buffer
+#------------------------------------------------------------------------------
+# Preallocated file, memory-mapped, with a header and CAPACITY fixed-size
+# records: wall clock timestamp, length & raw bytes. The rtmidi thread writes
+# the record and then the total count in the header, so writing an event
+# doesn't need a syscall, and the recording survives webconf restarts.
+# Longer SysEx messages are truncated and skipped on export.
+
+class MidiRingBuffer(object):
+
+	MAGIC = b"ZYNMIDI1"
+	HEADER = struct.Struct("<8sIIQ")
+	HEADER_SIZE = 64
+	RECORD = struct.Struct("<dH22s")
+	DATA_SIZE = 22
+
+	def __init__(self, fpath, capacity=65536):
+		self.fpath = fpath
+		self.capacity = capacity
+		self.count = 0
+		self.open()
+
+
+	def get_file_size(self):
+		return self.HEADER_SIZE + self.capacity * self.RECORD.size
+
+
+	def open(self):
+		os.makedirs(os.path.dirname(self.fpath), exist_ok=True)
+		size = self.get_file_size()
+		fd = os.open(self.fpath, os.O_RDWR | os.O_CREAT, 0o644)
+		try:
+			if os.fstat(fd).st_size != size:
+				os.ftruncate(fd, size)
+			self.mmap = mmap.mmap(fd, size)
+		finally:
+			os.close(fd)
+
+		magic, capacity, record_size, count = self.HEADER.unpack_from(self.mmap, 0)
+		if magic == self.MAGIC and capacity == self.capacity and record_size == self.RECORD.size:
+			self.count = count
+		else:
+			self.clear()
+
+
+	def close(self):
+		self.mmap.flush()
+		self.mmap.close()
+
+
+	def clear(self):
+		self.count = 0
+		self.HEADER.pack_into(self.mmap, 0, self.MAGIC, self.capacity, self.RECORD.size, 0)
+
+
+	# Called from the rtmidi thread
+	def append(self, ts, data):
+		offset = self.HEADER_SIZE + (self.count % self.capacity) * self.RECORD.size
+		self.RECORD.pack_into(self.mmap, offset, ts, len(data), bytes(data[:self.DATA_SIZE]))
+		self.count += 1
+		self.HEADER.pack_into(self.mmap, 0, self.MAGIC, self.capacity, self.RECORD.size, self.count)
+
+
+	# Yield (ts, data) from the oldest event, skipping the truncated ones.
+	# The rtmidi thread keeps writing while reading: event i is overwritten
+	# by event i + capacity, so records are skipped if the count reached it
+	# after reading them, as they could be half-written. It stops if the
+	# buffer is cleared.
+	def iter_events(self, since=None, until=None):
+		count = self.count
+		for i in range(max(0, count - self.capacity), count):
+			offset = self.HEADER_SIZE + (i % self.capacity) * self.RECORD.size
+			ts, length, data = self.RECORD.unpack_from(self.mmap, offset)
+			count_now = self.count
+			if count_now < count:
+				break
+			if count_now - i >= self.capacity:
+				continue
+			if length > self.DATA_SIZE:
+				continue
+			if since is not None and ts < since:
+				continue
+			if until is not None and ts > until:
+				break
+			yield ts, data[:length]
+
+
+	def get_timestamp(self, i):
+		return self.RECORD.unpack_from(self.mmap, self.HEADER_SIZE + (i % self.capacity) * self.RECORD.size)[0]
+
+
+	def get_time_range(self):
+		count = self.count
+		if count == 0:
+			return None, None
+		return self.get_timestamp(max(0, count - self.capacity)), self.get_timestamp(count - 1)
+
+#------------------------------------------------------------------------------
+# MIDI Recorder
+#------------------------------------------------------------------------------
+# Records a MIDI port into the ring buffer, independently of any browser
+# connection. Time windows can be exported as Standard MIDI Files.
+
+class MidiRecorder(object):
+
+	RING_FPATH = CACHE_DIR + "/midi_log.ring"
+	# SMF timing: 120 BPM, 480 ticks per beat => 960 ticks per second
+	TICKS_PER_BEAT = 480
+	TEMPO = 500000
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.ring = None
+		self.mido_port = None
+		self.midi_port_name = None
+
+
+	def get_ring(self):
+		if self.ring is None:
+			self.ring = MidiRingBuffer(self.RING_FPATH)
+		return self.ring
+
+
+	def is_recording(self):
+		return self.mido_port is not None
+
+
+	def start(self, midi_port_name):
+		with self.lock:
+			self.close_port()
+			self.open_port(midi_port_name)
+
+
+	def stop(self):
+		with self.lock:
+			self.close_port()
+
+
+	# The port is closed while clearing, so the rtmidi thread can't write
+	# the old count back to the header after it.
+	def clear(self):
+		with self.lock:
+			midi_port_name = self.midi_port_name if self.is_recording() else None
+			self.close_port()
+			self.get_ring().clear()
+			if midi_port_name:
+				self.open_port(midi_port_name)
+
+
+	# Call them with the lock held
+	def open_port(self, midi_port_name):
+		ring = self.get_ring()
+		mido.set_backend('mido.backends.rtmidi/UNIX_JACK')
+		self.mido_port = mido.open_input(midi_port_name, callback=lambda msg: ring.append(time.time(), msg.bytes()))
+		self.midi_port_name = midi_port_name
+		logging.info("start midi recording on {}".format(midi_port_name))
+
+
+	def close_port(self):
+		if self.mido_port:
+			logging.info("stop midi recording")
+			self.mido_port.close()
+			self.mido_port = None
+			self.ring.mmap.flush()
+
+
+	def get_status(self):
+		ring = self.get_ring()
+		first, last = ring.get_time_range()
+		return {
+			'recording': self.is_recording(),
+			'port': self.midi_port_name,
+			'events': min(ring.count, ring.capacity),
+			'first': first,
+			'last': last
+		}
+
+
+	# Export the events between since & until (timestamps) to a type 0 SMF.
+	# System real-time & common messages can't be stored in a SMF. Returns
+	# the number of exported events.
+	def export_smf(self, fpath, since=None, until=None):
+		mid = mido.MidiFile(type=0, ticks_per_beat=self.TICKS_PER_BEAT)
+		track = mido.MidiTrack()
+		mid.tracks.append(track)
+		track.append(mido.MetaMessage('set_tempo', tempo=self.TEMPO, time=0))
+		ticks_per_second = self.TICKS_PER_BEAT * 1000000 / self.TEMPO
+
+		n = 0
+		last_tick = None
+		for ts, data in self.get_ring().iter_events(since, until):
+			if not data or (data[0] > 0xF0):
+				continue
+			try:
+				msg = mido.Message.from_bytes(data)
+			except (ValueError, TypeError) as e:
+				logging.debug("Skipping MIDI event {} => {}".format(data.hex(), e))
+				continue
+			tick = int(round(ts * ticks_per_second))
+			# Wall clock could go back
+			msg.time = 0 if last_tick is None else max(0, tick - last_tick)
+			last_tick = tick
+			track.append(msg)
+			n += 1
+
+		track.append(mido.MetaMessage('end_of_track', time=0))
+		mid.save(fpath)
+		return n
+
+
+midi_recorder = MidiRecorder()
+
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# MIDI Stats: rolling MIDI traffic counters, rate & clock jitter
+#
+# Copyright (C) 2020 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import math
+import time
+from array import array
+
+#------------------------------------------------------------------------------
+# MIDI message types
+#------------------------------------------------------------------------------
+
+MIDI_TYPES = [
+	"note_off", "note_on", "polytouch", "control_change", "program_change", "aftertouch", "pitchwheel",
+	"sysex", "quarter_frame", "songpos", "song_select", "tune_request",
+	"clock", "start", "continue", "stop", "active_sensing", "reset", "other"
+]
+
+MIDI_SYSTEM_TYPES = {
+	0xF0: "sysex", 0xF1: "quarter_frame", 0xF2: "songpos", 0xF3: "song_select", 0xF6: "tune_request",
+	0xF8: "clock", 0xFA: "start", 0xFB: "continue", 0xFC: "stop", 0xFE: "active_sensing", 0xFF: "reset"
+}
+
+# Status byte => type index
+def get_type_table():
+	table = array('B', [MIDI_TYPES.index("other")] * 256)
+	for status in range(0x80, 0xF0):
+		table[status] = (status >> 4) - 8
+	for status, name in MIDI_SYSTEM_TYPES.items():
+		table[status] = MIDI_TYPES.index(name)
+	return table
+
+MIDI_TYPE_TABLE = get_type_table()
+
+#------------------------------------------------------------------------------
+# MIDI Stats
+#------------------------------------------------------------------------------
+# Updated from the rtmidi thread, without locks: all the counters live in
+# fixed-size arrays written only by on_midi_in. Rolling counters are kept in
+# ring buffers of time bins. Every bin stores its bin number, so the reader
+# can skip the old bins that were not overwritten because no message came.
+# Summaries can be slightly inconsistent while messages arrive, that's fine
+# for monitoring.
+
+class MidiStats(object):
+
+	# Rolling counters by channel & type: 1 second bins
+	WINDOW_BINS = 10
+	# Message rate: 100ms bins
+	RATE_BIN_TIME = 0.1
+	RATE_BINS = 100
+	# Last clock intervals: 4 beats at 24 ppqn
+	CLOCK_INTERVALS = 96
+
+	def __init__(self):
+		self.reset()
+
+
+	def reset(self):
+		n_types = len(MIDI_TYPES)
+		self.t0 = time.monotonic()
+		self.total = 0
+		self.total_channels = array('L', [0] * 16)
+		self.total_types = array('L', [0] * n_types)
+
+		self.window_ids = array('q', [-1] * self.WINDOW_BINS)
+		self.window_channels = array('L', [0] * (16 * self.WINDOW_BINS))
+		self.window_types = array('L', [0] * (n_types * self.WINDOW_BINS))
+
+		self.rate_ids = array('q', [-1] * self.RATE_BINS)
+		self.rate_counts = array('L', [0] * self.RATE_BINS)
+
+		self.clock_intervals = array('d', [0.0] * self.CLOCK_INTERVALS)
+		self.clock_count = 0
+		self.last_clock = None
+
+
+	# Called from the rtmidi thread
+	def on_midi_in(self, msg):
+		data = msg.bytes()
+		if not data:
+			return
+		now = time.monotonic()
+		status = data[0]
+		type_index = MIDI_TYPE_TABLE[status]
+		n_types = len(MIDI_TYPES)
+
+		self.total += 1
+		self.total_types[type_index] += 1
+
+		# Rolling counters
+		window_id = int(now - self.t0)
+		i = window_id % self.WINDOW_BINS
+		if self.window_ids[i] != window_id:
+			for j in range(16):
+				self.window_channels[i * 16 + j] = 0
+			for j in range(n_types):
+				self.window_types[i * n_types + j] = 0
+			self.window_ids[i] = window_id
+		self.window_types[i * n_types + type_index] += 1
+		if status < 0xF0:
+			channel = status & 0x0F
+			self.total_channels[channel] += 1
+			self.window_channels[i * 16 + channel] += 1
+
+		# Message rate
+		rate_id = int((now - self.t0) / self.RATE_BIN_TIME)
+		i = rate_id % self.RATE_BINS
+		if self.rate_ids[i] != rate_id:
+			self.rate_counts[i] = 0
+			self.rate_ids[i] = rate_id
+		self.rate_counts[i] += 1
+
+		# Clock jitter
+		if status == 0xF8:
+			if self.last_clock is not None:
+				self.clock_intervals[self.clock_count % self.CLOCK_INTERVALS] = now - self.last_clock
+				self.clock_count += 1
+			self.last_clock = now
+		elif status in (0xFA, 0xFC):
+			self.last_clock = None
+
+
+	def get_window_counts(self, now):
+		n_types = len(MIDI_TYPES)
+		channels = [0] * 16
+		types = [0] * n_types
+		current_id = int(now - self.t0)
+		for i in range(self.WINDOW_BINS):
+			if current_id - self.window_ids[i] < self.WINDOW_BINS:
+				for j in range(16):
+					channels[j] += self.window_channels[i * 16 + j]
+				for j in range(n_types):
+					types[j] += self.window_types[i * n_types + j]
+		return channels, types
+
+
+	# Messages per second in every rate bin, oldest first
+	def get_rate_histogram(self, now):
+		current_id = int((now - self.t0) / self.RATE_BIN_TIME)
+		rates = []
+		for rate_id in range(current_id - self.RATE_BINS + 1, current_id + 1):
+			i = rate_id % self.RATE_BINS
+			count = self.rate_counts[i] if self.rate_ids[i] == rate_id else 0
+			rates.append(round(count / self.RATE_BIN_TIME))
+		return rates
+
+
+	def get_clock_stats(self):
+		n = min(self.clock_count, self.CLOCK_INTERVALS)
+		if n == 0:
+			return None
+		intervals = self.clock_intervals[:n]
+		mean = sum(intervals) / n
+		jitter = math.sqrt(sum((x - mean) ** 2 for x in intervals) / n)
+		return {
+			'bpm': round(60 / (mean * 24), 2) if mean > 0 else 0,
+			'interval_ms': round(mean * 1000, 3),
+			'jitter_ms': round(jitter * 1000, 3),
+			'max_deviation_ms': round(max(abs(x - mean) for x in intervals) * 1000, 3)
+		}
+
+
+	def get_summary(self):
+		now = time.monotonic()
+		window_channels, window_types = self.get_window_counts(now)
+		rates = self.get_rate_histogram(now)
+		return {
+			'elapsed': round(now - self.t0, 1),
+			'total': self.total,
+			'window': self.WINDOW_BINS,
+			'channels': [[self.total_channels[i], window_channels[i]] for i in range(16)],
+			'types': { name: [self.total_types[i], window_types[i]] for i, name in enumerate(MIDI_TYPES) if self.total_types[i] },
+			'rate_bin_ms': int(self.RATE_BIN_TIME * 1000),
+			'rates': rates,
+			'max_rate': max(rates),
+			'clock': self.get_clock_stats()
+		}
+
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Persistent Cache: JSON files for indexes that survive restarts
+#
+# Copyright (C) 2020 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import os
+import json
+import logging
+
+#------------------------------------------------------------------------------
+# Cache directory. It's not under the config or data directories, so it's
+# not included in backups.
+#------------------------------------------------------------------------------
+
+CACHE_DIR = os.environ.get('ZYNTHIAN_WEBCONF_CACHE_DIR', "/var/cache/zynthian-webconf")
+
+#------------------------------------------------------------------------------
+# Module helper functions
+#------------------------------------------------------------------------------
+
+def get_cache_fpath(name):
+	return "{}/{}.json".format(CACHE_DIR, name)
+
+
+def load_cache(name, default=None):
+	try:
+		with open(get_cache_fpath(name), "r") as f:
+			return json.load(f)
+	except FileNotFoundError:
+		pass
+	except Exception as e:
+		logging.warning("Can't load cache '{}' => {}".format(name, e))
+	return default
+
+
+def save_cache(name, data):
+	fpath = get_cache_fpath(name)
+	tmp_fpath = fpath + ".tmp"
+	try:
+		os.makedirs(CACHE_DIR, exist_ok=True)
+		with open(tmp_fpath, "w") as f:
+			json.dump(data, f)
+		# Atomic replace, so a crash never leaves a half-written index
+		os.replace(tmp_fpath, fpath)
+	except Exception as e:
+		logging.error("Can't save cache '{}' => {}".format(name, e))
+
+
+def remove_cache(name):
+	try:
+		os.remove(get_cache_fpath(name))
+	except OSError:
+		pass
+
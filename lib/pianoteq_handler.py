@@ -36,7 +36,7 @@ from subprocess import check_output
 from collections import OrderedDict
 from xml.etree import ElementTree as ET
 
-from lib.zynthian_config_handler import ZynthianBasicHandler
+from lib.zynthian_config_handler import ZynthianBasicHandler, reload_config
 from zyngine.zynthian_engine_pianoteq import *
 
 sys.path.append(os.environ.get('ZYNTHIAN_UI_DIR'))
@@ -180,3 +180,4 @@ class PianoteqHandler(ZynthianBasicHandler):
 			sconfig[vn]=config[vn][0]
 
 		zynconf.save_config(sconfig, update_sys=True)
+		reload_config()
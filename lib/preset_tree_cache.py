@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Preset Tree Cache: engine banks & presets kept in memory
+#
+# Copyright (C) 2020 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import os
+import time
+import logging
+import threading
+
+#------------------------------------------------------------------------------
+# Preset Tree Cache
+#------------------------------------------------------------------------------
+# Bank lists and preset lists returned by the engine's zynapi are cached by
+# engine. Handlers invalidate the banks they touch. Presets of directory banks
+# are also reloaded when the bank's mtime changes, so presets saved from the
+# UI are shown too. Bank lists are reloaded when the mtime of any bank root
+# directory changes, so banks created out of webconf (UI, SFTP, Samba) are
+# shown too. If the engine has no bank directory, they expire after BANKS_TTL.
+
+class PresetTreeCache(object):
+
+	# Seconds before reloading bank lists without root directories to check
+	BANKS_TTL = 10
+
+	def __init__(self):
+		self.lock = threading.RLock()
+		self.engines = {}
+
+
+	def get_engine_cache(self, engine):
+		if engine not in self.engines:
+			self.engines[engine] = { 'banks': None, 'banks_roots': (), 'banks_stamp': None, 'banks_time': 0, 'presets': {} }
+		return self.engines[engine]
+
+
+	@staticmethod
+	def get_bank_stamp(bank_fullpath):
+		try:
+			return os.stat(bank_fullpath).st_mtime_ns
+		except:
+			return None
+
+
+	# The engine's bank directories, plus the directories containing the banks
+	@staticmethod
+	def get_bank_roots(engine_cls, banks):
+		roots = set()
+		for bank_dir in getattr(engine_cls, 'bank_dirs', None) or []:
+			if isinstance(bank_dir, (tuple, list)):
+				bank_dir = bank_dir[-1]
+			if isinstance(bank_dir, str):
+				roots.add(bank_dir)
+		for bank in banks:
+			fullpath = bank.get('fullpath')
+			if isinstance(fullpath, str) and os.path.isabs(fullpath):
+				roots.add(os.path.dirname(os.path.normpath(fullpath)))
+		return tuple(sorted(r for r in roots if os.path.isdir(r)))
+
+
+	@staticmethod
+	def get_roots_stamp(roots):
+		return tuple(PresetTreeCache.get_bank_stamp(root) for root in roots)
+
+
+	def get_banks(self, engine, engine_cls):
+		with self.lock:
+			ecache = self.get_engine_cache(engine)
+			if ecache['banks'] is not None:
+				if ecache['banks_roots']:
+					if self.get_roots_stamp(ecache['banks_roots']) != ecache['banks_stamp']:
+						ecache['banks'] = None
+				elif time.monotonic() - ecache['banks_time'] > self.BANKS_TTL:
+					ecache['banks'] = None
+			if ecache['banks'] is None:
+				banks = engine_cls.zynapi_get_banks()
+				ecache['banks_roots'] = self.get_bank_roots(engine_cls, banks)
+				ecache['banks_stamp'] = self.get_roots_stamp(ecache['banks_roots'])
+				ecache['banks_time'] = time.monotonic()
+				ecache['banks'] = banks
+			return ecache['banks']
+
+
+	def get_presets(self, engine, engine_cls, bank):
+		with self.lock:
+			ecache = self.get_engine_cache(engine)
+			stamp = self.get_bank_stamp(bank['fullpath'])
+			pcache = ecache['presets'].get(bank['fullpath'])
+			if pcache is None or pcache['stamp'] != stamp:
+				pcache = { 'stamp': stamp, 'presets': engine_cls.zynapi_get_presets(bank) }
+				ecache['presets'][bank['fullpath']] = pcache
+			return pcache['presets']
+
+
+	# Drop the presets of the bank. If banks is True, the bank list is
+	# dropped too, because banks were added, renamed or removed.
+	def invalidate_bank(self, engine, bank_fullpath, banks=False):
+		with self.lock:
+			ecache = self.get_engine_cache(engine)
+			if bank_fullpath:
+				ecache['presets'].pop(bank_fullpath, None)
+			if banks:
+				ecache['banks'] = None
+			logging.debug("Invalidated preset cache for {} => {}".format(engine, bank_fullpath))
+
+
+	def invalidate(self, engine=None):
+		with self.lock:
+			if engine:
+				self.engines.pop(engine, None)
+			else:
+				self.engines = {}
+
+
+preset_tree_cache = PresetTreeCache()
+
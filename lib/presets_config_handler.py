@@ -38,6 +38,9 @@ import tornado.web
 from collections import OrderedDict
 
 from lib.zynthian_config_handler import ZynthianBasicHandler
+from lib.file_count_index import file_count_index
+from lib.tree_pager import get_tree_page, filter_tree, DEFAULT_PAGE_LIMIT
+from lib.preset_tree_cache import preset_tree_cache
 from zyngui.zynthian_gui_engine import *
 
 #------------------------------------------------------------------------------
@@ -52,7 +55,8 @@ class PresetsConfigHandler(ZynthianBasicHandler):
 
 		config['engines'] = self.get_engine_info()
 		config['engine'] = self.get_argument('ENGINE', 'ZY')
-		config['sel_node_id'] = self.get_argument('SEL_NODE_ID', -1)
+		config['sel_fullpath'] = self.get_argument('SEL_FULLPATH', '')
+		config['sel_bank_fullpath'] = self.get_argument('SEL_BANK_FULLPATH', '')
 		config['musical_artifact_tags'] = self.get_argument('MUSICAL_ARTIFACT_TAGS', '')
 		config['ZYNTHIAN_UPLOAD_MULTIPLE'] = True
 
@@ -98,7 +102,11 @@ class PresetsConfigHandler(ZynthianBasicHandler):
 		try:
 			result['methods'] =	self.engine_cls.get_zynapi_methods()
 			result['formats'] =	self.get_upload_formats()
-			result['presets'] = self.get_presets_data()
+			result['presets'] = get_tree_page(self.get_presets_tree(),
+				parent=self.get_argument('PARENT', None),
+				offset=self.get_argument('OFFSET', 0),
+				limit=self.get_argument('LIMIT', DEFAULT_PAGE_LIMIT),
+				sel_fullpath=self.get_argument('SEL_FULLPATH', None))
 		except Exception as e:
 			result['methods'] =  None
 			result['formats'] =  None
@@ -116,6 +124,7 @@ class PresetsConfigHandler(ZynthianBasicHandler):
 		except Exception as e:
 			logging.error(e)
 			result['errors'] = "Can't create new bank: {}".format(e)
+		preset_tree_cache.invalidate_bank(self.engine, None, True)
 
 		result.update(self.do_get_tree())
 		return result
@@ -125,9 +134,11 @@ class PresetsConfigHandler(ZynthianBasicHandler):
 		result = {}
 		try:
 			self.engine_cls.zynapi_rename_bank(self.get_argument('SEL_FULLPATH'), self.get_argument('SEL_BANK_NAME'))
+			file_count_index.invalidate(self.get_argument('SEL_FULLPATH'))
 		except Exception as e:
 			logging.error(e)
 			result['errors'] = "Can't rename bank: {}".format(e)
+		preset_tree_cache.invalidate_bank(self.engine, self.get_argument('SEL_FULLPATH'), True)
 
 		result.update(self.do_get_tree())
 		return result
@@ -137,9 +148,11 @@ class PresetsConfigHandler(ZynthianBasicHandler):
 		result = {}
 		try:
 			self.engine_cls.zynapi_remove_bank(self.get_argument('SEL_FULLPATH'))
+			file_count_index.invalidate(self.get_argument('SEL_FULLPATH'))
 		except Exception as e:
 			logging.error(e)
 			result['errors'] = "Can't remove bank: {}".format(e)
+		preset_tree_cache.invalidate_bank(self.engine, self.get_argument('SEL_FULLPATH'), True)
 
 		result.update(self.do_get_tree())
 		return result
@@ -149,9 +162,11 @@ class PresetsConfigHandler(ZynthianBasicHandler):
 		result = {}
 		try:
 			self.engine_cls.zynapi_rename_preset(self.get_argument('SEL_FULLPATH'), self.get_argument('SEL_PRESET_NAME'))
+			file_count_index.invalidate(self.get_argument('SEL_FULLPATH'))
 		except Exception as e:
 			logging.error(e)
 			result['errors'] = "Can't rename preset: {}".format(e)
+		preset_tree_cache.invalidate_bank(self.engine, self.get_argument('SEL_BANK_FULLPATH'))
 
 		result.update(self.do_get_tree())
 		return result
@@ -161,9 +176,11 @@ class PresetsConfigHandler(ZynthianBasicHandler):
 		result = {}
 		try:
 			self.engine_cls.zynapi_remove_preset(self.get_argument('SEL_FULLPATH'))
+			file_count_index.invalidate(self.get_argument('SEL_FULLPATH'))
 		except Exception as e:
 			logging.error(e)
 			result['errors'] = "Can't remove preset: {}".format(e)
+		preset_tree_cache.invalidate_bank(self.engine, self.get_argument('SEL_BANK_FULLPATH'))
 
 		result.update(self.do_get_tree())
 		return result
@@ -306,8 +323,11 @@ class PresetsConfigHandler(ZynthianBasicHandler):
 			logging.info("Installing '{}' => '{}' ...".format(dpath, bank_fullpath))
 
 			self.engine_cls.zynapi_install(dpath, bank_fullpath)
+			file_count_index.invalidate(bank_fullpath)
 
 		finally:
+			# Installing may add new banks too
+			preset_tree_cache.invalidate_bank(self.engine, self.get_argument('SEL_BANK_FULLPATH', None), True)
 			try:
 				os.remove(fpath)
 			except:
@@ -342,47 +362,61 @@ class PresetsConfigHandler(ZynthianBasicHandler):
 			return ""
 
 
-	def get_presets_data(self):
+	# Presets are only loaded for the banks that are needed: the expanded one,
+	# the one containing the selected preset, or all of them when searching.
+	def get_presets_tree(self):
+		search = self.get_argument('SEARCH', '')
+		load_banks = (self.get_argument('PARENT', None), self.get_argument('SEL_BANK_FULLPATH', None))
+		banks_data = []
 		try:
-			i = 0
-			banks_data = []
-			for b in self.engine_cls.zynapi_get_banks():
-				brow = {
-					'id': i,
-					'text': b['text'],
-					'name': b['name'],
-					'fullpath': b['fullpath'],
-					'readonly': b['readonly'],
-					'node_type': 'BANK',
-					'nodes': [],
-					'icon': "glyphicon glyphicon-link" if b['readonly'] else None,
-				}
-				i += 1
-				try:
-					presets_data = []
-					for p in self.engine_cls.zynapi_get_presets(b):
-						prow = {
-							'id': i,
-							'text': p['text'],
-							'name': p['name'],
-							'fullpath': p['fullpath'],
-							'readonly': p['readonly'] or b['readonly'],
-							'bank_fullpath' : b['fullpath'],
-							'node_type': 'PRESET',
-							'icon': "glyphicon glyphicon-link" if p['readonly'] else None
-						}
-						i += 1
-						presets_data.append(prow)
-
-					brow['nodes'] = presets_data
-
-				except Exception as e:
-					logging.error("PRESET NODE {} => {}".format(i,e))
-
+			for b in preset_tree_cache.get_banks(self.engine, self.engine_cls):
+				brow = self.get_bank_node(b)
+				if search or b['fullpath'] in load_banks:
+					brow['nodes'] = self.get_preset_nodes(b)
 				banks_data.append(brow)
 
 		except Exception as e:
-			logging.error("BANK NODE {} => {}".format(i,e))
+			logging.error("BANK NODE {} => {}".format(len(banks_data), e))
+
+		return filter_tree(banks_data, search, self.get_search_fields)
+
+
+	def get_search_fields(self, node, bank_node):
+		if node['node_type']=='BANK':
+			return { 'name': [node['name']], 'bank': [node['name'], node['text']], 'engine': [self.engine, self.engine_info[1]] }
+		else:
+			return { 'name': [node['name'], node['text']], 'bank': [bank_node['name'], bank_node['text']], 'engine': [self.engine, self.engine_info[1]] }
+
+
+	@staticmethod
+	def get_bank_node(b):
+		return {
+			'text': b['text'],
+			'name': b['name'],
+			'fullpath': b['fullpath'],
+			'readonly': b['readonly'],
+			'node_type': 'BANK',
+			'nodes': None,
+			'icon': "glyphicon glyphicon-link" if b['readonly'] else None,
+		}
+
+
+	def get_preset_nodes(self, b):
+		presets_data = []
+		try:
+			for p in preset_tree_cache.get_presets(self.engine, self.engine_cls, b):
+				presets_data.append({
+					'text': p['text'],
+					'name': p['name'],
+					'fullpath': p['fullpath'],
+					'readonly': p['readonly'] or b['readonly'],
+					'bank_fullpath' : b['fullpath'],
+					'node_type': 'PRESET',
+					'icon': "glyphicon glyphicon-link" if p['readonly'] else None
+				})
+
+		except Exception as e:
+			logging.error("PRESET NODE {} => {}".format(b['fullpath'], e))
 
-		return banks_data
+		return presets_data
 
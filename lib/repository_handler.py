@@ -25,11 +25,16 @@
 import os
 import re
 import logging
+import jsonpickle
 import tornado.web
+import tornado.ioloop
+import tornado.websocket
 from collections import OrderedDict
 from subprocess import check_output, call
 
 from lib.zynthian_config_handler import ZynthianConfigHandler
+from lib.zynthian_websocket_handler import ZynthianWebSocketMessageHandler, ZynthianWebSocketMessage
+from lib.git_repo_status import get_repo_status, git_executor
 from lib.audio_config_handler import AudioConfigHandler
 from lib.display_config_handler import DisplayConfigHandler
 from lib.wiring_config_handler import WiringConfigHandler
@@ -51,9 +56,13 @@ class RepositoryHandler(ZynthianConfigHandler):
 		['zyncoder', True]
 	]
 
+	fetch_future = None
+
 	@tornado.web.authenticated
 	def get(self, errors=None):
 		super().get("Repositories", self.get_config_info(), errors)
+		# Refresh remote branches in background. Changes are pushed by websocket.
+		self.start_fetch()
 
 	@tornado.web.authenticated
 	def post(self):
@@ -114,42 +123,53 @@ class RepositoryHandler(ZynthianConfigHandler):
 			}
 			stable_overall &= (branch == 'stable')
 		config["STABLE"]['value'] = '1' if stable_overall else '0'
+		config["_repository_status_script"] = {
+			'type': 'jscript',
+			'script_file': 'repository_status.js'
+		}
 		return config
 
-	def get_repo_tag_list(self, repo_name):
-		result = ["master"]
-		repo_dir = self.zynthian_base_dir + "/" + repo_name
+	def get_repo_status(self, repo_name):
+		return get_repo_status(self.zynthian_base_dir + "/" + repo_name)
+
+	@classmethod
+	def start_fetch(cls, force=False):
+		if cls.fetch_future is None or cls.fetch_future.done():
+			loop = tornado.ioloop.IOLoop.current()
+			cls.fetch_future = loop.run_in_executor(git_executor, cls.fetch_repos, loop, force)
+		return cls.fetch_future
+
+	# Run in the git_executor thread. Messages are sent from the IOLoop.
+	@classmethod
+	def fetch_repos(cls, loop, force=False):
+		for repitem in cls.repository_list:
+			repo_name = repitem[0]
+			repo_status = get_repo_status(cls.zynthian_base_dir + "/" + repo_name)
+			if not force and not repo_status.needs_fetch():
+				continue
 
-		check_output("cd {}; git remote update origin --prune".format(repo_dir), shell=True)
-		for byteLine in check_output("cd {}; git tag".format(repo_dir), shell=True).splitlines():
-			result.append(byteLine.decode("utf-8").strip())
+			def progress_cb(text):
+				loop.add_callback(RepositoryMessageHandler.broadcast, {'repo': repo_name, 'status': 'FETCHING', 'text': text})
 
-		return result
+			progress_cb("Fetching ...")
+			try:
+				repo_status.fetch(progress_cb)
+				data = {'repo': repo_name, 'status': 'FETCHED', 'text': '', 'branches': repo_status.get_branch_list()}
+			except Exception as e:
+				logging.error("Can't fetch remote for '{}' => {}".format(repo_name, e))
+				data = {'repo': repo_name, 'status': 'ERROR', 'text': str(e)}
+			loop.add_callback(RepositoryMessageHandler.broadcast, data)
 
-	def get_repo_branch_list(self, repo_name):
-		result = ["master"]
-		repo_dir = self.zynthian_base_dir + "/" + repo_name
+		loop.add_callback(RepositoryMessageHandler.broadcast, {'status': 'EOCOMMAND'})
 
-		check_output("cd {}; git remote update origin --prune".format(repo_dir), shell=True)
-		for byteLine in check_output("cd {}; git branch -a".format(repo_dir), shell=True).splitlines():
-			bname = byteLine.decode("utf-8").strip()
-			if bname.startswith("*"):
-				bname = bname[2:]
-			if bname.startswith("remotes/origin/"):
-				bname = bname[15:]
-			if "->" in bname:
-				continue
-			if bname not in result:
-				result.append(bname)
+	def get_repo_tag_list(self, repo_name):
+		return self.get_repo_status(repo_name).get_tag_list()
 
-		return result
+	def get_repo_branch_list(self, repo_name):
+		return self.get_repo_status(repo_name).get_branch_list()
 
 	def get_repo_current_branch(self, repo_name):
-		repo_dir = self.zynthian_base_dir + "/" + repo_name
-
-		for byteLine in check_output("cd {}; git branch | grep \* | cut -d ' ' -f2".format(repo_dir),
-									 shell=True).splitlines():
-			return byteLine.decode("utf-8")
+		return self.get_repo_status(repo_name).get_current_branch()
 
 	def set_repo_tag(self, repo_name, tag_name):
 		logging.info("Changing repository '{}' to tag '{}'".format(repo_name, tag_name))
@@ -178,3 +198,34 @@ class RepositoryHandler(ZynthianConfigHandler):
 			logging.info("... needs change: '{}' != '{}'".format(current_branch, branch_name))
 			check_output("cd {}; git checkout .; git checkout {}".format(repo_dir, branch_name), shell=True)
 			return True
+
+
+class RepositoryMessageHandler(ZynthianWebSocketMessageHandler):
+
+	websocket_message_handler_list = []
+
+	@classmethod
+	def is_registered_for(cls, handler_name):
+		return handler_name == 'RepositoryMessageHandler'
+
+	def on_websocket_message(self, action):
+		if action == 'SUBSCRIBE':
+			if self not in RepositoryMessageHandler.websocket_message_handler_list:
+				RepositoryMessageHandler.websocket_message_handler_list.append(self)
+		elif action == 'FETCH':
+			RepositoryHandler.start_fetch(True)
+		else:
+			logging.error('Unknown action {}'.format(action))
+
+	def on_close(self):
+		if self in RepositoryMessageHandler.websocket_message_handler_list:
+			RepositoryMessageHandler.websocket_message_handler_list.remove(self)
+
+	@classmethod
+	def broadcast(cls, data):
+		message = jsonpickle.encode(ZynthianWebSocketMessage('RepositoryMessageHandler', data))
+		for websocket_message_handler in list(cls.websocket_message_handler_list):
+			try:
+				websocket_message_handler.websocket.write_message(message)
+			except tornado.websocket.WebSocketClosedError:
+				websocket_message_handler.on_close()
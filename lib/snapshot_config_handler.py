@@ -23,7 +23,6 @@
 #********************************************************************
 
 import os
-import re
 import json
 import base64
 import shutil
@@ -33,6 +32,10 @@ import tornado.web
 from collections import OrderedDict
 
 from lib.zynthian_config_handler import ZynthianBasicHandler
+from lib.file_count_index import file_count_index
+from lib.snapshot_index import snapshot_index
+from lib.midi_profile_cache import midi_profile_cache
+from lib.tree_pager import get_tree_page, filter_tree, DEFAULT_PAGE_LIMIT
 
 #------------------------------------------------------------------------------
 # Snapshot Config Handler
@@ -53,21 +56,24 @@ class SnapshotConfigHandler(ZynthianBasicHandler):
 		ssdata = self.get_snapshots_data()
 		#logging.debug(snapshot)
 
-		config['SNAPSHOTS'] = json.dumps(ssdata)
+		# Try to maintain selection after a POST action...
+		config['SEL_FULLPATH'] = self.get_selected_node_fullpath(ssdata)
+		config['SNAPSHOTS'] = json.dumps(get_tree_page(ssdata, sel_fullpath=config['SEL_FULLPATH']))
 		config['BANKS'] = self.get_existing_banks(ssdata, True)
 		config['NEXT_BANK_NUM'] = self.calculate_next_bank(self.get_existing_banks(ssdata, False))
 		config['PROGS_NUM'] = map(lambda x: str(x).zfill(3), list(range(0, 128)))
-		config['MIDI_PROFILE_SCRIPTS'] = {os.path.splitext(x)[0]:  "%s/%s" % (self.PROFILES_DIRECTORY, x) for x in os.listdir(self.PROFILES_DIRECTORY)}
+		config['MIDI_PROFILE_SCRIPTS'] = {os.path.splitext(os.path.basename(x))[0]: x for x in midi_profile_cache.get_scripts()}
 		config['ZYNTHIAN_UPLOAD_MULTIPLE'] = True
 
-		# Try to maintain selection after a POST action...
-		config['SEL_NODE_ID'] = self.get_selected_node_id(ssdata)
-
 		super().get("snapshots.html", "Snapshots", config, errors)
 
 
 	@tornado.web.authenticated
 	def post(self, action):
+		if action=='get_tree':
+			self.write(self.do_get_tree())
+			return
+
 		if action:
 			result = {
 				'new_bank': lambda: self.do_new_bank(),
@@ -79,8 +85,9 @@ class SnapshotConfigHandler(ZynthianBasicHandler):
 			}[action]()
 
 		ssdata = self.get_snapshots_data()
-		result['SNAPSHOTS'] = ssdata
-		result['SEL_NODE_ID'] = self.get_selected_node_id(ssdata)
+		result['SEL_FULLPATH'] = self.get_selected_node_fullpath(ssdata)
+		result['SNAPSHOTS'] = get_tree_page(self.filter_snapshots_data(ssdata), sel_fullpath=result['SEL_FULLPATH'],
+			limit=self.get_argument('LIMIT', DEFAULT_PAGE_LIMIT))
 		result['BANKS'] = self.get_existing_banks(ssdata, True)
 		result['NEXT_BANK_NUM'] = self.calculate_next_bank(self.get_existing_banks(ssdata, False))
 		snapshot_warning = self.get_snapshot_warning(ssdata)
@@ -90,6 +97,15 @@ class SnapshotConfigHandler(ZynthianBasicHandler):
 		self.write(result)
 
 
+	def do_get_tree(self):
+		ssdata = self.filter_snapshots_data(self.get_snapshots_data())
+		return get_tree_page(ssdata,
+			parent=self.get_argument('PARENT', None),
+			offset=self.get_argument('OFFSET', 0),
+			limit=self.get_argument('LIMIT', DEFAULT_PAGE_LIMIT),
+			sel_fullpath=self.get_argument('SEL_FULLPATH', None))
+
+
 	def do_new_bank(self):
 		result = {}
 		existing_banks = self.get_existing_banks(self.get_snapshots_data(), False)
@@ -101,6 +117,7 @@ class SnapshotConfigHandler(ZynthianBasicHandler):
 			bank_dpath = self.SNAPSHOTS_DIRECTORY + '/' + new_bank_dname
 			if not os.path.exists(bank_dpath):
 				os.makedirs(bank_dpath)
+				file_count_index.invalidate(bank_dpath)
 		return result
 
 
@@ -112,6 +129,7 @@ class SnapshotConfigHandler(ZynthianBasicHandler):
 				shutil.rmtree(fullPath)
 			else:
 				os.remove(fullPath)
+			file_count_index.invalidate(fullPath)
 		return result
 
 
@@ -158,6 +176,8 @@ class SnapshotConfigHandler(ZynthianBasicHandler):
 
 		try:
 			os.rename(fullPath, newFullPath)
+			file_count_index.invalidate(fullPath)
+			file_count_index.invalidate(newFullPath)
 		except OSError:
 			result['errors'] = 'Move ' + fullPath + ' to ' + newFullPath + ' failed!'
 		return result
@@ -186,6 +206,7 @@ class SnapshotConfigHandler(ZynthianBasicHandler):
 		src = self.get_argument('SEL_FULLPATH')
 		logging.info("Copy %s to %s" % (src, dest))
 		shutil.copyfile(src, dest)
+		file_count_index.invalidate(dest)
 		return result
 
 
@@ -195,6 +216,7 @@ class SnapshotConfigHandler(ZynthianBasicHandler):
 		src = self.get_argument('SEL_FULLPATH')
 		logging.info("Copy %s to %s" % (src, dest))
 		shutil.copyfile(src, dest)
+		file_count_index.invalidate(dest)
 		return result
 
 
@@ -236,101 +258,46 @@ class SnapshotConfigHandler(ZynthianBasicHandler):
 
 
 	def get_snapshots_data(self):
-		return self.walk_directory(SnapshotConfigHandler.SNAPSHOTS_DIRECTORY)
-
-
-	def walk_directory(self, directory, idx=0, _bank_num=None, _bank_name=None):
-		snapshots = []
-		file_list =  sorted(os.listdir(directory))
-		for f in file_list:
-			fullpath = os.path.join(directory, f)
-			if os.path.isdir(fullpath):
-				node_type = "BANK"
-				parts = f.split("-", 1)
-				bank_num = parts[0]
-				if len(parts)==2:
-					bank_name = parts[1]
-				else:
-					bank_name = ""
-				prog_name = ""
-				prog_num = ""
-				prog_details = ""
-				name = bank_name
-			else:
-				fname = f[:-4]
-				fext = f[-4:]
-				if fext==".zss":
-					node_type = "SNAPSHOT"
-					if _bank_num is not None:
-						bank_num = _bank_num.zfill(3)
-						bank_name = _bank_name
-						parts = fname.split("-", 1)
-						prog_num = parts[0]
-						if len(parts)==2:
-							prog_name = fname[len(prog_num)+1:]
-						else:
-							prog_name = ""
-					else:
-						bank_num = ''
-						bank_name = ''
-						prog_num = ''
-						prog_name = fname
-					name = prog_name
-
-					with open(fullpath) as ssfile:
-						try:
-							prog_details = json.load(ssfile)
-						except:
-							pass
-						ssfile.close()
-				else:
-					continue
-
-			snapshot = {
-				'id': idx,
-				'text': f,
-				'name': name,
-				'fullpath': fullpath,
-				'node_type': node_type,
-				'bank_num': bank_num,
-				'bank_name': bank_name,
-				'prog_num': prog_num,
-				'prog_name': prog_name,
-				'prog_details': prog_details
-			}
-			
-			idx += 1
-			if os.path.isdir(fullpath):
-				snapshot['nodes'] = self.walk_directory(fullpath, idx, bank_num, bank_name)
-				idx+=len(snapshot['nodes'])
+		return snapshot_index.get_tree(SnapshotConfigHandler.SNAPSHOTS_DIRECTORY)
+
 
-			snapshots.append(snapshot)
+	def filter_snapshots_data(self, ssdata):
+		return filter_tree(ssdata, self.get_argument('SEARCH', ''), self.get_search_fields)
 
-		return snapshots
+
+	@staticmethod
+	def get_search_fields(node, bank_node):
+		if node['node_type']=='BANK':
+			return { 'name': [node['name']], 'bank': [node['bank_num'], node['bank_name']] }
+		else:
+			return {
+				'name': [node['name'], node['text']],
+				'bank': [node['bank_num'], node['bank_name']],
+				'engine': node.get('summary', {}).get('engines', [])
+			}
 
 
-	def get_selected_node_id(self, ssdata):
-		selected_node = 0
+	def get_selected_node_fullpath(self, ssdata):
+		selected_node = ssdata[0]['fullpath'] if ssdata else ''
 		try:
 			for ssbank in ssdata:
 				try:
 					if int(ssbank['bank_num'])==int(self.get_argument('SEL_BANK_NUM')):
-						if not selected_node:
-							selected_node = ssbank['id']
-
-					if ssbank['nodes']:
+						selected_node = ssbank['fullpath']
 						for ssprog in ssbank['nodes']:
 							try:
 								if int(ssprog['prog_num'])==int(self.get_argument('SEL_PROG_NUM')):
-									selected_node = ssprog['id']
+									selected_node = ssprog['fullpath']
+									break
 							except:
 								pass
+						break
 				except:
 					action = self.get_argument('ACTION', '')
 					if action == 'SAVE_AS_DEFAULT' and ssbank['name'] == 'default':
-						selected_node = ssbank['id']
+						selected_node = ssbank['fullpath']
 					elif action == 'SAVE_AS_LAST_STATE' and ssbank['name'] == 'last_state':
-						selected_node = ssbank['id']
+						selected_node = ssbank['fullpath']
 
 		except Exception as e:
 			logging.debug("ERROR:" + str(e))
@@ -344,6 +311,7 @@ class SnapshotConfigHandler(ZynthianBasicHandler):
 		destination = "{}/{}".format(self.get_argument('SEL_FULLPATH'), os.path.basename(fpath))
 		logging.info(destination)
 		shutil.move(fpath, destination)
+		file_count_index.invalidate(destination)
 
 
 class SnapshotRemoveLayerHandler(tornado.web.RequestHandler):
@@ -427,19 +395,13 @@ class SnapshotAddOptionsHandler(tornado.web.RequestHandler):
 				data = json.load(fp)
 				fp.close()
 
-			p = re.compile("export ZYNTHIAN_MIDI_(\w*)=\"(.*)\"")
-			profile_values = {}
-			with open(midi_profile_script, "r") as midi_fp:
-				for line in midi_fp:
-					if line[0] == '#':
-						continue
-					m = p.match(line)
-					if m:
-						profile_values[m.group(1)] = m.group(2)
-				midi_fp.close()
+			profile_values = midi_profile_cache.get_profile(midi_profile_script)
+			if profile_values is None:
+				raise Exception("Can't load MIDI profile {}".format(midi_profile_script))
 
-			for profile_value in profile_values:
-				data['midi_profile_state'][profile_value] = profile_values[profile_value]
+			for key, value in profile_values.items():
+				if key.startswith("ZYNTHIAN_MIDI_"):
+					data['midi_profile_state'][key[len("ZYNTHIAN_MIDI_"):]] = value
 
 			with open(snapshot_file, "w") as fp:
 				json.dump(data, fp)
@@ -456,6 +418,31 @@ class SnapshotAddOptionsHandler(tornado.web.RequestHandler):
 			self.write(result)
 
 
+class SnapshotDetailsHandler(tornado.web.RequestHandler):
+
+	def get_current_user(self):
+		return self.get_secure_cookie("user")
+
+	@tornado.web.authenticated
+	def get(self, snapshot_file_b64):
+		result = {}
+		try:
+			snapshot_file = os.path.realpath(str(base64.b64decode(snapshot_file_b64), 'utf-8'))
+			# Only snapshots from the library can be read
+			snapshots_dir = os.path.realpath(SnapshotConfigHandler.SNAPSHOTS_DIRECTORY)
+			if not snapshot_file.endswith(".zss") or not snapshot_file.startswith(snapshots_dir + os.sep):
+				raise Exception("'{}' is not a snapshot".format(snapshot_file))
+			with open(snapshot_file, "r") as fp:
+				result = json.load(fp)
+
+		except Exception as err:
+			result['errors'] = "Can't load snapshot details: {}".format(err)
+			logging.error(err)
+
+		# JSON Ouput
+		self.write(result)
+
+
 class SnapshotDownloadHandler(tornado.web.RequestHandler):
 
 	def get_current_user(self):
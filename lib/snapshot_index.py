@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Snapshot Index: snapshot library tree with summaries keyed by mtime
+#
+# Copyright (C) 2020 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import os
+import json
+import logging
+import threading
+
+from lib.persistent_cache import load_cache, save_cache
+
+#------------------------------------------------------------------------------
+# Snapshot Index
+#------------------------------------------------------------------------------
+# Snapshot files are only parsed when their mtime or size changes. The index
+# keeps a short summary of every snapshot (layer count & engines), so the
+# library tree can be built without loading the full snapshot data.
+
+class SnapshotIndex(object):
+
+	def __init__(self, name="snapshot_index"):
+		self.name = name
+		self.lock = threading.RLock()
+		self.index = None
+		self.dirty = False
+
+
+	def load(self):
+		if self.index is None:
+			self.index = load_cache(self.name, {})
+
+
+	def save(self):
+		if self.dirty:
+			save_cache(self.name, self.index)
+			self.dirty = False
+
+
+	@staticmethod
+	def get_summary(fpath):
+		summary = { 'layers': 0, 'engines': [] }
+		try:
+			with open(fpath) as f:
+				data = json.load(f)
+			for layer in data.get('layers', []):
+				summary['layers'] += 1
+				engine = layer.get('engine_nick')
+				if engine and engine not in summary['engines']:
+					summary['engines'].append(engine)
+		except Exception as e:
+			logging.warning("Can't parse snapshot '{}' => {}".format(fpath, e))
+		return summary
+
+
+	def get_entry(self, fpath, stat):
+		key = (stat.st_mtime_ns, stat.st_size)
+		entry = self.index.get(fpath)
+		if entry is None or (entry['mtime'], entry['size']) != key:
+			entry = { 'mtime': key[0], 'size': key[1], 'summary': self.get_summary(fpath) }
+			self.index[fpath] = entry
+			self.dirty = True
+		return entry
+
+
+	@staticmethod
+	def split_num_name(fname):
+		parts = fname.split("-", 1)
+		if len(parts)==2:
+			return parts[0], parts[1]
+		else:
+			return parts[0], ""
+
+
+	def get_tree(self, directory):
+		with self.lock:
+			self.load()
+			seen = set()
+			tree = self.walk_directory(directory, seen)
+			# Forget removed snapshots
+			for fpath in [p for p in self.index if p not in seen]:
+				del self.index[fpath]
+				self.dirty = True
+			self.save()
+			return tree
+
+
+	def walk_directory(self, directory, seen, _bank_num=None, _bank_name=None):
+		snapshots = []
+		try:
+			dentries = sorted(os.scandir(directory), key=lambda e: e.name)
+		except OSError as e:
+			logging.error("Can't list '{}' => {}".format(directory, e))
+			return snapshots
+
+		for dentry in dentries:
+			f = dentry.name
+			fullpath = dentry.path
+			summary = None
+			if dentry.is_dir():
+				node_type = "BANK"
+				bank_num, bank_name = self.split_num_name(f)
+				prog_num = ""
+				prog_name = ""
+				name = bank_name
+			elif f.endswith(".zss"):
+				node_type = "SNAPSHOT"
+				fname = f[:-4]
+				if _bank_num is not None:
+					bank_num = _bank_num.zfill(3)
+					bank_name = _bank_name
+					prog_num, prog_name = self.split_num_name(fname)
+				else:
+					bank_num = ''
+					bank_name = ''
+					prog_num = ''
+					prog_name = fname
+				name = prog_name
+				try:
+					summary = self.get_entry(fullpath, dentry.stat())['summary']
+					seen.add(fullpath)
+				except OSError:
+					continue
+			else:
+				continue
+
+			snapshot = {
+				'text': f,
+				'name': name,
+				'fullpath': fullpath,
+				'node_type': node_type,
+				'bank_num': bank_num,
+				'bank_name': bank_name,
+				'prog_num': prog_num,
+				'prog_name': prog_name
+			}
+			if summary:
+				snapshot['summary'] = summary
+				snapshot['tags'] = [", ".join(summary['engines'])] if summary['engines'] else []
+
+			if node_type=="BANK":
+				snapshot['nodes'] = self.walk_directory(fullpath, seen, bank_num, bank_name)
+
+			snapshots.append(snapshot)
+
+		return snapshots
+
+
+snapshot_index = SnapshotIndex()
+
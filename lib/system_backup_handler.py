@@ -23,15 +23,25 @@
 #********************************************************************
 
 import os
+import queue
+import inspect
+import hashlib
 import logging
+import threading
 import tornado.web
+import tornado.ioloop
+import tornado.iostream
+import tornado.websocket
 import zipfile
-from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 from collections import OrderedDict
 import time
 import jsonpickle
 from lib.zynthian_config_handler import ZynthianBasicHandler
 from lib.zynthian_websocket_handler import ZynthianWebSocketMessageHandler, ZynthianWebSocketMessage
+from lib.backup_manifest import BackupManifest, MANIFEST_ARCNAME, read_manifest, sort_restore_chain
+from lib.file_count_index import FileCountIndex
+from lib.backup_size_index import BackupSizeIndex
 
 #------------------------------------------------------------------------------
 # Module helper functions
@@ -41,6 +51,119 @@ def get_backup_items(filename):
 	with open(filename) as f:
 		return f.read().splitlines()
 
+#------------------------------------------------------------------------------
+# Backups are generated in a worker thread, out of the IOLoop. zipfile writes
+# to the output stream and the collected data is passed to the handler by a
+# bounded queue, so a slow client blocks the producer instead of filling the
+# memory. The stream is not seekable, so zipfile uses data descriptors and
+# never goes back to rewrite the local headers.
+#------------------------------------------------------------------------------
+
+backup_executor = ThreadPoolExecutor(max_workers=2)
+
+# Plans & restores have their own workers, so running downloads don't block them
+plan_executor = ThreadPoolExecutor(max_workers=1)
+restore_executor = ThreadPoolExecutor(max_workers=1)
+
+# Directory listings of the excluded folders
+backup_file_index = FileCountIndex("backup_file_index", keep_files=True)
+
+class BackupCancelled(Exception):
+	pass
+
+
+class RestoreCancelled(Exception):
+	pass
+
+
+#------------------------------------------------------------------------------
+# Prefix trie for checking paths against the allowed restore items. A path
+# matches if any of the items is a prefix of it. Checking a path costs its
+# length, whatever the number of items.
+#------------------------------------------------------------------------------
+
+class PrefixTrie(object):
+
+	END = None
+
+	def __init__(self, prefixes=()):
+		self.root = {}
+		for prefix in prefixes:
+			self.add(prefix)
+
+
+	def add(self, prefix):
+		node = self.root
+		for c in prefix:
+			node = node.setdefault(c, {})
+		node[PrefixTrie.END] = True
+
+
+	def match(self, path):
+		node = self.root
+		if PrefixTrie.END in node:
+			return True
+		for c in path:
+			node = node.get(c)
+			if node is None:
+				return False
+			if PrefixTrie.END in node:
+				return True
+		return False
+
+
+class ZipOutputStream(object):
+
+	QUEUE_SIZE = 8
+
+	def __init__(self):
+		self.chunks = []
+		self.pos = 0
+		self.queue = queue.Queue(ZipOutputStream.QUEUE_SIZE)
+		self.cancelled = threading.Event()
+
+
+	def write(self, data):
+		self.chunks.append(bytes(data))
+		self.pos += len(data)
+		return len(data)
+
+
+	def tell(self):
+		return self.pos
+
+
+	def flush(self):
+		pass
+
+
+	def pop(self):
+		data = b"".join(self.chunks)
+		self.chunks = []
+		return data
+
+
+	# Called from the producer thread. Blocks while the queue is full.
+	def put(self, item):
+		while True:
+			if self.cancelled.is_set():
+				raise BackupCancelled()
+			try:
+				self.queue.put(item, timeout=0.5)
+				return
+			except queue.Full:
+				pass
+
+
+	def push(self):
+		data = self.pop()
+		if data:
+			self.put(data)
+
+
+	def cancel(self):
+		self.cancelled.set()
+
 #------------------------------------------------------------------------------
 # Snapshot Config Handler
 #------------------------------------------------------------------------------
@@ -50,6 +173,18 @@ class SystemBackupHandler(ZynthianBasicHandler):
 	CONFIG_BACKUP_ITEMS_FILE = "/zynthian/config/config_backup_items.txt"
 	DATA_BACKUP_ITEMS_FILE = "/zynthian/config/data_backup_items.txt"
 	EXCLUDE_SUFFIX = ".exclude"
+	CHUNK_SIZE = 64 * 1024
+	# Already compressed formats are stored. Deflating them wastes CPU for nothing.
+	# WAV & SF2 deflate poorly and are big, so they are stored too.
+	STORED_EXTENSIONS = (
+		".ogg", ".oga", ".opus", ".mp3", ".flac", ".m4a", ".wav",
+		".sf2", ".sf3", ".gig",
+		".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z",
+		".jpg", ".jpeg", ".png"
+	)
+	# Rough deflate ratio of config & data files (XML, JSON, text ...), used
+	# by the backup planner.
+	DEFLATE_RATIO = 0.4
 
 
 	@tornado.web.authenticated
@@ -103,7 +238,7 @@ class SystemBackupHandler(ZynthianBasicHandler):
 
 
 	@tornado.web.authenticated
-	def post(self):
+	async def post(self):
 		command = self.get_argument('_command', '')
 		logging.info("COMMAND = {}".format(command))
 		if command:
@@ -112,8 +247,12 @@ class SystemBackupHandler(ZynthianBasicHandler):
 				'BACKUP_ALL': lambda: self.do_backup_all(),
 				'BACKUP_CONFIG': lambda: self.do_backup_config(),
 				'BACKUP_DATA': lambda: self.do_backup_data(),
-				'SAVE_BACKUP_CONFIG': lambda: self.do_save_backup_config()
+				'SAVE_BACKUP_CONFIG': lambda: self.do_save_backup_config(),
+				'PLAN_BACKUP': lambda: self.do_plan_backup()
 			}[command]()
+			# Backups are streamed
+			if inspect.isawaitable(errors):
+				errors = await errors
 
 
 	def do_save_backup_config(self):
@@ -144,71 +283,278 @@ class SystemBackupHandler(ZynthianBasicHandler):
 		self.do_get(active_tab)
 
 
-	def do_backup_all(self):
+	async def do_backup_all(self):
 		backup_items = get_backup_items(SystemBackupHandler.CONFIG_BACKUP_ITEMS_FILE)
 		backup_items += get_backup_items(SystemBackupHandler.DATA_BACKUP_ITEMS_FILE)
-		self.do_backup('zynthian_backup', backup_items)
+		await self.do_backup('zynthian_backup', backup_items)
 
 
-	def do_backup_config(self):
+	async def do_backup_config(self):
 		backup_items = get_backup_items(SystemBackupHandler.CONFIG_BACKUP_ITEMS_FILE)
-		self.do_backup('zynthian_config_backup', backup_items)
+		await self.do_backup('zynthian_config_backup', backup_items)
 
 
-	def do_backup_data(self):
+	async def do_backup_data(self):
 		backup_items = get_backup_items(SystemBackupHandler.DATA_BACKUP_ITEMS_FILE)
-		self.do_backup('zynthian_data_backup', backup_items)
+		await self.do_backup('zynthian_data_backup', backup_items)
+
+
+	# Dry run: files, bytes & estimated archive size of every backup set,
+	# without reading any file. Items not saved yet can be posted too, so
+	# they can be checked before saving them.
+	async def do_plan_backup(self):
+		config_items = self.get_posted_backup_items("CONFIG", SystemBackupHandler.CONFIG_BACKUP_ITEMS_FILE)
+		data_items = self.get_posted_backup_items("DATA", SystemBackupHandler.DATA_BACKUP_ITEMS_FILE)
+		try:
+			result = await tornado.ioloop.IOLoop.current().run_in_executor(plan_executor, self.plan_backups, config_items, data_items)
+		except Exception as e:
+			logging.error("Can't plan backup => {}".format(e))
+			result = { 'errors': str(e) }
+		self.write(result)
+
+
+	def get_posted_backup_items(self, prefix, items_file):
+		dirs = self.get_argument(prefix + '_BACKUP_DIRS', None)
+		if dirs is None:
+			return get_backup_items(items_file)
+		backup_items = []
+		for dpath in self.get_argument(prefix + '_BACKUP_DIRS_EXCLUDED', '').split("\n"):
+			if dpath.strip():
+				backup_items.append("^" + dpath.strip())
+		for dpath in dirs.split("\n"):
+			if dpath.strip():
+				backup_items.append(dpath.strip())
+		return backup_items
+
+
+	# Run in the plan_executor
+	def plan_backups(self, config_items, data_items):
+		try:
+			return {
+				'CONFIG': self.plan_backup(config_items),
+				'DATA': self.plan_backup(data_items),
+				'ALL': self.plan_backup(config_items + data_items)
+			}
+		finally:
+			backup_size_index.save()
+
+
+	# Walk the backup items like produce_backup does, taking the sizes from
+	# the index. The estimated size is the stored bytes, plus the deflated
+	# bytes by DEFLATE_RATIO, plus the zip headers of every entry.
+	def plan_backup(self, backup_items):
+		plan = { 'dirs': 0, 'files': 0, 'bytes': 0, 'stored_bytes': 0, 'estimated_size': 0 }
+		deflated_bytes = 0
+		overhead = 0
+		for dirname, subdirs, files, excluded_folder in self.iter_backup_entries(backup_items):
+			if excluded_folder:
+				size = sum(len(fpath) + 1 for fpath in backup_file_index.iter_files(excluded_folder))
+				plan['files'] += 1
+				plan['bytes'] += size
+				deflated_bytes += size
+				overhead += self.get_zip_entry_overhead(files[0])
+				continue
+
+			dir_bytes, dir_stored_bytes = backup_size_index.get_dir_size(dirname)
+			plan['dirs'] += 1
+			plan['files'] += len(files)
+			plan['bytes'] += dir_bytes
+			plan['stored_bytes'] += dir_stored_bytes
+			deflated_bytes += dir_bytes - dir_stored_bytes
+			overhead += self.get_zip_entry_overhead(dirname)
+			for filename in files:
+				overhead += self.get_zip_entry_overhead(os.path.join(dirname, filename))
 
+		plan['estimated_size'] = int(plan['stored_bytes'] + deflated_bytes * SystemBackupHandler.DEFLATE_RATIO + overhead)
+		return plan
 
-	def do_backup(self, fname_prefix, backup_items):
-		zipname = '{0}{1}.zip'.format(fname_prefix, time.strftime("%Y%m%d-%H%M%S"))
-		f=BytesIO()
-		zf = zipfile.ZipFile(f, "w")
 
-		def zip_backup_items(dirname, subdirs, files):
-			logging.info(dirname)
-			if dirname != '/':
-				zf.write(dirname)
-			for filename in files:
-				logging.info(filename)
-				zf.write(os.path.join(dirname, filename))
+	# Local header + data descriptor + central directory record
+	@staticmethod
+	def get_zip_entry_overhead(arcname):
+		return 30 + 16 + 46 + 2 * len(arcname)
 
-		self.walk_backup_items(zip_backup_items, backup_items)
 
-		zf.close()
+	# The zip file is sent to the client while it's being generated, so memory
+	# usage doesn't depend on the backup size. Incremental backups only contain
+	# the files changed since the previous backup, and the deleted files list.
+	async def do_backup(self, fname_prefix, backup_items):
+		manifest = BackupManifest(fname_prefix, self.get_argument('BACKUP_MODE', 'FULL')=='INCREMENTAL')
+		if manifest.is_incremental():
+			fname_prefix += "_incremental"
+		zipname = '{0}{1}.zip'.format(fname_prefix, time.strftime("%Y%m%d-%H%M%S"))
 		self.set_header('Content-Type', 'application/zip')
 		self.set_header('Content-Disposition', 'attachment; filename=%s' % zipname)
 
-		self.write(f.getvalue())
-		f.close()
-		self.finish()
+		loop = tornado.ioloop.IOLoop.current()
+		stream = ZipOutputStream()
+		progress = BackupProgress(loop, zipname)
+		producer = loop.run_in_executor(backup_executor, self.produce_backup, backup_items, manifest, stream, progress)
+		try:
+			while True:
+				data = await loop.run_in_executor(None, stream.queue.get)
+				if data is None:
+					break
+				self.write(data)
+				await self.flush()
+			# Raise producer errors
+			await producer
+			self.finish()
+			manifest.save()
+			progress.send("DONE")
+
+		except tornado.iostream.StreamClosedError:
+			logging.warning("Backup '{}' cancelled: connection closed".format(zipname))
+			stream.cancel()
+			self.abort_download()
+			progress.send("CANCELLED")
+
+		except Exception as e:
+			logging.error("Backup '{}' failed => {}".format(zipname, e))
+			stream.cancel()
+			self.abort_download()
+			progress.send("ERROR", str(e))
+
+
+	# Headers and chunks could be already sent, so an error can't be returned.
+	# The connection is closed without the last chunk, so the client sees a
+	# failed download instead of a truncated archive. Auto-finish doesn't
+	# write anything on a closed connection.
+	def abort_download(self):
+		try:
+			self.request.connection.close()
+		except Exception as e:
+			logging.error("Can't close the backup connection => {}".format(e))
+
+
+	# Run in the backup_executor
+	def produce_backup(self, backup_items, manifest, stream, progress):
+		try:
+			with zipfile.ZipFile(stream, "w") as zf:
+				for dirname, subdirs, files, excluded_folder in self.iter_backup_entries(backup_items):
+					logging.info(dirname)
+					# Exclude lists, generated for every backup
+					if excluded_folder:
+						self.zip_exclude_list(zf, stream, files[0], excluded_folder)
+						continue
+
+					if not manifest.is_incremental():
+						zf.write(dirname)
+					for filename in files:
+						fpath = os.path.join(dirname, filename)
+						try:
+							stat = os.stat(fpath)
+						except FileNotFoundError:
+							# Removed while walking: listed as deleted
+							continue
+						except OSError as e:
+							logging.error("Can't backup '{}' => {}".format(fpath, e))
+							manifest.keep_file(fpath)
+							continue
+						if manifest.check_file(fpath, stat):
+							logging.info(filename)
+							progress.update(fpath)
+							sha1 = self.zip_backup_file(zf, stream, fpath, progress)
+							if sha1:
+								manifest.add_file(fpath, stat, sha1)
+							else:
+								manifest.keep_file(fpath)
+
+				zf.writestr(MANIFEST_ARCNAME, manifest.encode(), zipfile.ZIP_DEFLATED)
+			stream.push()
+			stream.put(None)
+
+		except BackupCancelled:
+			pass
+
+		except:
+			# Unblock the handler before raising
+			stream.put(None)
+			raise
+
+
+	@staticmethod
+	def get_compress_type(fpath):
+		if os.path.splitext(fpath)[1].lower() in SystemBackupHandler.STORED_EXTENSIONS:
+			return zipfile.ZIP_STORED
+		else:
+			return zipfile.ZIP_DEFLATED
+
+
+	# Returns the file's SHA1 hash, or None if it can't be read
+	def zip_backup_file(self, zf, stream, fpath, progress=None):
+		sha1 = hashlib.sha1()
+		try:
+			zinfo = zipfile.ZipInfo.from_file(fpath)
+			zinfo.compress_type = self.get_compress_type(fpath)
+			with open(fpath, "rb") as src, zf.open(zinfo, "w") as dst:
+				while True:
+					data = src.read(SystemBackupHandler.CHUNK_SIZE)
+					if not data:
+						break
+					sha1.update(data)
+					dst.write(data)
+					stream.push()
+					if progress:
+						progress.add_bytes(len(data))
+		except OSError as e:
+			logging.error("Can't backup '{}' => {}".format(fpath, e))
+			sha1 = None
+		stream.push()
+		return sha1.hexdigest() if sha1 else None
 
 
 	def walk_backup_items(self, worker, backup_items):
+		for dirname, subdirs, files in self.iter_backup_items(backup_items):
+			worker(dirname, subdirs, files)
+
+
+	def iter_backup_items(self, backup_items):
+		for dirname, subdirs, files, excluded_folder in self.iter_backup_entries(backup_items):
+			yield dirname, subdirs, files
+
+
+	# Excluded folders are yielded as a "/<folder name>.exclude" file, with the
+	# excluded folder as 4th element. Its content, the list of excluded files,
+	# is generated when writing the archive.
+	def iter_backup_entries(self, backup_items):
 		excluded_folders = []
 		for backupFolder in backup_items:
 			sourceFolder = os.path.expandvars(backupFolder)
 			if sourceFolder.startswith("^"):
 				sourceFolder = os.path.expandvars(sourceFolder[1:])
 				excluded_folders.append(sourceFolder)
-				exclude_filename = '/' + os.path.basename(os.path.normpath(sourceFolder)) + SystemBackupHandler.EXCLUDE_SUFFIX
-				with open(exclude_filename, "w") as exclude_file:
-					for dirname, subdirs, files in os.walk(sourceFolder):
-						for filename in files:
-							exclude_file.write(os.path.join(dirname,filename) + '\n')
+				exclude_filename = os.path.basename(os.path.normpath(sourceFolder)) + SystemBackupHandler.EXCLUDE_SUFFIX
 				logging.info(exclude_filename)
-				worker('/', None , exclude_filename[1:].split(':')) #convert single string to array of 1 string
-				os.remove(exclude_filename)
+				yield '/', None, [exclude_filename], sourceFolder
 			else:
 				try:
 					for dirname, subdirs, files in os.walk(sourceFolder):
 						if not any(dirname.startswith(s) for s in excluded_folders):
-							worker(dirname, subdirs, files)
+							yield dirname, subdirs, files, None
 
-				except:
+				except Exception:
 					pass
 
 
+	# Write the list of excluded files straight into the archive. Directory
+	# listings are cached by mtime, so unchanged trees are not walked again.
+	def zip_exclude_list(self, zf, stream, arcname, excluded_folder):
+		zinfo = zipfile.ZipInfo(arcname, time.localtime()[0:6])
+		zinfo.compress_type = zipfile.ZIP_DEFLATED
+		zinfo.external_attr = 0o644 << 16
+		lines = []
+		with zf.open(zinfo, "w") as dst:
+			for fpath in backup_file_index.iter_files(excluded_folder):
+				lines.append(fpath + "\n")
+				if len(lines) >= 1000:
+					dst.write("".join(lines).encode("utf-8"))
+					lines = []
+					stream.push()
+			dst.write("".join(lines).encode("utf-8"))
+		stream.push()
+
+
 	def is_valid_restore_item(self, validRestoreItems, restoreMember):
 		for validRestoreItem in validRestoreItems:
 			if str("/" + restoreMember).startswith(os.path.expandvars(validRestoreItem)):
@@ -216,48 +562,248 @@ class SystemBackupHandler(ZynthianBasicHandler):
 		return False
 
 
+# File sizes of the backup items, for the backup planner
+backup_size_index = BackupSizeIndex("backup_size_index", SystemBackupHandler.STORED_EXTENSIONS)
+
+
 class RestoreMessageHandler(ZynthianWebSocketMessageHandler):
 
+	# Seconds between progress messages
+	PROGRESS_INTERVAL = 0.5
+
 	@classmethod
 	def is_registered_for(cls, handler_name):
 		return handler_name == 'RestoreMessageHandler'
 
 
-	def is_valid_restore_item(self, validRestoreItems, restoreMember):
-		for validRestoreItem in validRestoreItems:
-			if str("/" + restoreMember).startswith(os.path.expandvars(validRestoreItem)):
-				return True
-		return False
+	def __init__(self, handler_name, websocket):
+		super().__init__(handler_name, websocket)
+		self.loop = tornado.ioloop.IOLoop.current()
+		self.restore_future = None
+		self.cancelled = threading.Event()
+		self.progress = {}
+		self.progress_time = 0
 
 
-	def on_websocket_message(self, restoreFile):
-		#fileinfo = self.request.files['ZYNTHIAN_RESTORE_FILE'][0]
-		#restoreFile = fileinfo['filename']
-		with open(restoreFile , "rb") as f:
-			validRestoreItems = get_backup_items(SystemBackupHandler.CONFIG_BACKUP_ITEMS_FILE)
-			validRestoreItems += get_backup_items(SystemBackupHandler.DATA_BACKUP_ITEMS_FILE)
-
-			with zipfile.ZipFile(f,'r') as restoreZip:
-				for member in restoreZip.namelist():
-					if self.is_valid_restore_item(validRestoreItems, member):
-						logMessage = "Restored: " + member
-						restoreZip.extract(member, "/")
-						logging.debug(logMessage)
-						message = ZynthianWebSocketMessage('RestoreMessageHandler', logMessage)
-						self.websocket.write_message(jsonpickle.encode(message))
-					else:
-						if member.endswith(SystemBackupHandler.EXCLUDE_SUFFIX):
-							restoreZip.extract(member, "/")
-							with open("/" + member, 'r') as exclude_file:
-								message = ZynthianWebSocketMessage('RestoreMessageHandler',"<b>Please ensure that the following files does exist:<br />" + exclude_file.read().replace('\n', '<br />') + "</b>")
-								self.websocket.write_message(jsonpickle.encode(message))
-							os.remove('/' + member)
-						else:
-							logging.warn("Restore of " + member + " not permitted")
-
-				restoreZip.close()
-			f.close()
-		os.remove(restoreFile)
+	def is_valid_restore_item(self, validRestoreItems, restoreMember):
+		path = "/" + restoreMember
+		# Members with ".." components could go out of the allowed paths
+		if ".." in path.split("/"):
+			return False
+		return validRestoreItems.match(path)
+
+
+	def send_message(self, data):
+		message = ZynthianWebSocketMessage('RestoreMessageHandler', data)
+		try:
+			self.websocket.write_message(jsonpickle.encode(message))
+		except tornado.websocket.WebSocketClosedError:
+			self.cancelled.set()
+
+
+	# Thread safe version
+	def post_message(self, data):
+		self.loop.add_callback(self.send_message, data)
+
+
+	def post_progress(self, force=False):
+		now = time.monotonic()
+		if force or now - self.progress_time >= RestoreMessageHandler.PROGRESS_INTERVAL:
+			self.progress_time = now
+			self.post_message(dict(self.progress))
+
+
+	# Several archives can be uploaded at once: a full backup and the
+	# incremental backups based on it. They are restored in order, in a
+	# background thread. Send "CANCEL" for stopping it.
+	def on_websocket_message(self, data):
+		if data == 'CANCEL':
+			self.cancelled.set()
+		elif self.restore_future and not self.restore_future.done():
+			self.send_message("<b>A restore is already running</b>")
+		else:
+			restoreFiles = [fpath.strip() for fpath in data.split(",") if fpath.strip()]
+			self.cancelled.clear()
+			self.restore_future = self.loop.run_in_executor(restore_executor, self.restore, restoreFiles)
+
+
+	def on_close(self):
+		self.cancelled.set()
+
+
+	# Run in the restore_executor
+	def restore(self, restoreFiles):
+		validRestoreItems = PrefixTrie(os.path.expandvars(item) for item in
+			get_backup_items(SystemBackupHandler.CONFIG_BACKUP_ITEMS_FILE) + get_backup_items(SystemBackupHandler.DATA_BACKUP_ITEMS_FILE)
+			if item and not item.startswith("^"))
+		try:
+			archives = []
+			total_files = 0
+			total_bytes = 0
+			for restoreFile in restoreFiles:
+				with zipfile.ZipFile(restoreFile, 'r') as restoreZip:
+					archives.append((restoreFile, read_manifest(restoreZip)))
+					for zinfo in restoreZip.infolist():
+						if not zinfo.is_dir() and self.is_valid_restore_item(validRestoreItems, zinfo.filename):
+							total_files += 1
+							total_bytes += zinfo.file_size
+
+			self.progress = { 'files': 0, 'total_files': total_files, 'bytes': 0, 'total_bytes': total_bytes }
+			self.post_progress(True)
+			for restoreFile, manifest in sort_restore_chain(archives):
+				self.restore_archive(validRestoreItems, restoreFile, manifest)
+			self.post_progress(True)
+
+		except RestoreCancelled:
+			logging.info("Restore cancelled")
+			self.post_progress(True)
+			self.post_message("<b>Restore cancelled</b>")
+
+		except Exception as e:
+			logging.error("Restore failed => {}".format(e))
+			self.post_message("<b>Restore failed: {}</b>".format(e))
+
+		for restoreFile in restoreFiles:
+			try:
+				os.remove(restoreFile)
+			except OSError:
+				pass
 		SystemBackupHandler.update_sys()
-		message = ZynthianWebSocketMessage('RestoreMessageHandler', 'EOCOMMAND')
-		self.websocket.write_message(jsonpickle.encode(message))		
+		self.post_message('EOCOMMAND')
+
+
+	def restore_archive(self, validRestoreItems, restoreFile, manifest):
+		if manifest:
+			self.post_message("<b>Restoring {} backup {} ...</b>".format(manifest['type'], os.path.basename(restoreFile)))
+
+		with zipfile.ZipFile(restoreFile, 'r') as restoreZip:
+			for zinfo in restoreZip.infolist():
+				member = zinfo.filename
+				if member == MANIFEST_ARCNAME:
+					continue
+				if self.is_valid_restore_item(validRestoreItems, member):
+					self.extract_member(restoreZip, zinfo)
+					logMessage = "Restored: " + member
+					logging.debug(logMessage)
+					self.post_message(logMessage)
+				else:
+					if member.endswith(SystemBackupHandler.EXCLUDE_SUFFIX):
+						self.post_message("<b>Please ensure that the following files does exist:<br />" + restoreZip.read(member).decode('utf-8').replace('\n', '<br />') + "</b>")
+					else:
+						logging.warn("Restore of " + member + " not permitted")
+
+		# Files deleted since the previous backup
+		if manifest:
+			for fpath in manifest['deleted']:
+				if self.is_valid_restore_item(validRestoreItems, fpath.lstrip("/")):
+					try:
+						os.remove(fpath)
+						self.post_message("Deleted: " + fpath)
+					except FileNotFoundError:
+						pass
+					except OSError as e:
+						logging.error("Can't delete '{}' => {}".format(fpath, e))
+
+
+	# Extract in chunks, updating progress & checking for cancellation
+	def extract_member(self, restoreZip, zinfo):
+		dest = os.path.normpath("/" + zinfo.filename)
+		if zinfo.is_dir():
+			os.makedirs(dest, exist_ok=True)
+			return
+
+		os.makedirs(os.path.dirname(dest), exist_ok=True)
+		with restoreZip.open(zinfo) as src, open(dest, "wb") as dst:
+			while True:
+				if self.cancelled.is_set():
+					raise RestoreCancelled()
+				data = src.read(SystemBackupHandler.CHUNK_SIZE)
+				if not data:
+					break
+				dst.write(data)
+				self.progress['bytes'] += len(data)
+				self.post_progress()
+		self.progress['files'] += 1
+		self.post_progress()
+
+
+#------------------------------------------------------------------------------
+# Backup progress, sent to the subscribed websockets
+#------------------------------------------------------------------------------
+
+class BackupProgress(object):
+
+	# Seconds between progress messages
+	INTERVAL = 0.5
+
+	def __init__(self, loop, zipname):
+		self.loop = loop
+		self.zipname = zipname
+		self.files = 0
+		self.bytes = 0
+		self.fpath = ""
+		self.last_time = 0
+
+
+	# Called from the producer thread
+	def update(self, fpath):
+		self.files += 1
+		self.fpath = fpath
+		self.send_throttled()
+
+
+	def add_bytes(self, n):
+		self.bytes += n
+		self.send_throttled()
+
+
+	def send_throttled(self):
+		now = time.monotonic()
+		if now - self.last_time >= BackupProgress.INTERVAL:
+			self.last_time = now
+			self.send("RUNNING")
+
+
+	def send(self, status, error=None):
+		data = {
+			'status': status,
+			'zipname': self.zipname,
+			'files': self.files,
+			'bytes': self.bytes,
+			'fpath': self.fpath
+		}
+		if error:
+			data['error'] = error
+		self.loop.add_callback(BackupMessageHandler.broadcast, data)
+
+
+class BackupMessageHandler(ZynthianWebSocketMessageHandler):
+
+	websocket_message_handler_list = []
+
+	@classmethod
+	def is_registered_for(cls, handler_name):
+		return handler_name == 'BackupMessageHandler'
+
+
+	def on_websocket_message(self, action):
+		if action == 'SUBSCRIBE':
+			if self not in BackupMessageHandler.websocket_message_handler_list:
+				BackupMessageHandler.websocket_message_handler_list.append(self)
+		else:
+			logging.error('Unknown action {}'.format(action))
+
+
+	def on_close(self):
+		if self in BackupMessageHandler.websocket_message_handler_list:
+			BackupMessageHandler.websocket_message_handler_list.remove(self)
+
+
+	@classmethod
+	def broadcast(cls, data):
+		message = jsonpickle.encode(ZynthianWebSocketMessage('BackupMessageHandler', data))
+		for websocket_message_handler in list(cls.websocket_message_handler_list):
+			try:
+				websocket_message_handler.websocket.write_message(message)
+			except tornado.websocket.WebSocketClosedError:
+				websocket_message_handler.on_close()
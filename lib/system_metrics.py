@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# System Metrics: memory, storage, temperature & network info
+# read from /proc, /sys and statvfs, without spawning processes.
+#
+# Copyright (C) 2020 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+import os
+import math
+import fcntl
+import socket
+import struct
+import logging
+
+#------------------------------------------------------------------------------
+# System Metrics
+#------------------------------------------------------------------------------
+
+class SystemMetrics(object):
+
+	MEMINFO_FPATH = "/proc/meminfo"
+	THERMAL_ZONE_FPATH = "/sys/class/thermal/thermal_zone0/temp"
+	IF_INET6_FPATH = "/proc/net/if_inet6"
+	SIOCGIFADDR = 0x8915
+
+	VOLUME_INFO_NA = { 'total': 'NA', 'used': 'NA', 'free': 'NA', 'usage': 'NA' }
+
+
+	@staticmethod
+	def human_size(nbytes):
+		# Same format than "df -h"
+		for unit in ['', 'K', 'M', 'G', 'T']:
+			if nbytes < 1024 or unit == 'T':
+				break
+			nbytes /= 1024.0
+		if unit and nbytes < 10:
+			return "{:.1f}{}".format(math.ceil(nbytes * 10) / 10, unit)
+		else:
+			return "{}{}".format(int(math.ceil(nbytes)), unit)
+
+
+	@classmethod
+	def get_meminfo(cls):
+		meminfo = {}
+		with open(cls.MEMINFO_FPATH) as f:
+			for line in f:
+				parts = line.split()
+				if len(parts) >= 2:
+					# Values are in kB
+					meminfo[parts[0].rstrip(':')] = int(parts[1])
+		return meminfo
+
+
+	@classmethod
+	def get_ram_info(cls):
+		mi = cls.get_meminfo()
+		total = mi['MemTotal']
+		free = mi['MemFree']
+		# Same calculation than "free"
+		if 'MemAvailable' in mi:
+			used = total - mi['MemAvailable']
+		else:
+			used = total - free - mi.get('Buffers', 0) - mi.get('Cached', 0) - mi.get('SReclaimable', 0)
+		return {
+			'total': "{}M".format(total // 1024),
+			'used': "{}M".format(used // 1024),
+			'free': "{}M".format(free // 1024),
+			'usage': "{}%".format(int(100 * used / total))
+		}
+
+
+	@classmethod
+	def get_volume_info(cls, mpath='/'):
+		try:
+			st = os.statvfs(mpath)
+			total = st.f_blocks * st.f_frsize
+			used = (st.f_blocks - st.f_bfree) * st.f_frsize
+			avail = st.f_bavail * st.f_frsize
+			if used + avail > 0:
+				usage = int(math.ceil(100.0 * used / (used + avail)))
+			else:
+				usage = 0
+			return {
+				'total': cls.human_size(total),
+				'used': cls.human_size(used),
+				'free': cls.human_size(avail),
+				'usage': "{}%".format(usage)
+			}
+		except Exception as e:
+			logging.error("Can't get volume info for '{}' => {}".format(mpath, e))
+			return dict(cls.VOLUME_INFO_NA)
+
+
+	@classmethod
+	def get_sd_info(cls):
+		return cls.get_volume_info('/')
+
+
+	@classmethod
+	def get_media_info(cls, mpath="/media/usb0"):
+		if os.path.ismount(mpath):
+			return cls.get_volume_info(mpath)
+		else:
+			return None
+
+
+	@classmethod
+	def get_temperature(cls):
+		try:
+			with open(cls.THERMAL_ZONE_FPATH) as f:
+				# millidegrees Celsius
+				return "{:.1f}ºC".format(int(f.read().strip()) / 1000.0)
+		except:
+			return "???"
+
+
+	@classmethod
+	def get_ipv4_addresses(cls):
+		res = []
+		s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		try:
+			for index, ifname in socket.if_nameindex():
+				if ifname == 'lo':
+					continue
+				try:
+					ifreq = fcntl.ioctl(s.fileno(), cls.SIOCGIFADDR, struct.pack('256s', ifname[:15].encode()))
+					res.append(socket.inet_ntoa(ifreq[20:24]))
+				except OSError:
+					# Interface without IPv4 address
+					pass
+		finally:
+			s.close()
+		return res
+
+
+	@classmethod
+	def get_ipv6_addresses(cls):
+		res = []
+		try:
+			with open(cls.IF_INET6_FPATH) as f:
+				for line in f:
+					parts = line.split()
+					# Only global scope addresses, like "hostname -I"
+					if len(parts) >= 6 and parts[3] == '00' and parts[5] != 'lo':
+						res.append(socket.inet_ntop(socket.AF_INET6, bytes.fromhex(parts[0])))
+		except OSError:
+			pass
+		return res
+
+
+	@classmethod
+	def get_ip(cls):
+		return " ".join(cls.get_ipv4_addresses() + cls.get_ipv6_addresses())
+
+
+	@staticmethod
+	def get_host_name():
+		try:
+			with open("/etc/hostname") as f:
+				return f.readline()
+		except:
+			return ""
+
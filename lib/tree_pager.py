@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+#********************************************************************
+# ZYNTHIAN PROJECT: Zynthian Web Configurator
+#
+# Tree Pager: server side paging & filtering of library trees
+#
+# Copyright (C) 2020 Fernando Moyano <jofemodo@zynthian.org>
+#
+#********************************************************************
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of
+# the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# For a full copy of the GNU General Public License see the LICENSE.txt file.
+#
+#********************************************************************
+
+#------------------------------------------------------------------------------
+# A library tree is a list of nodes. Bank nodes have a "nodes" list with their
+# children. Pages contain the nodes of one level only: bank nodes are returned
+# with an empty "nodes" list and the number of children in "child_count", so
+# the client can load them when the bank is expanded.
+#
+# Search strings are a list of words, optionally qualified by field, like
+# "bank:piano engine:zy grand". Words without field are matched against all
+# the fields. Every word must match, on the node or on its bank.
+#------------------------------------------------------------------------------
+
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+
+def get_search_terms(search):
+	terms = []
+	if search:
+		for word in search.lower().split():
+			field, sep, value = word.rpartition(":")
+			if value:
+				terms.append((field or None, value))
+	return terms
+
+
+def match_terms(terms, fields):
+	for field, value in terms:
+		if field:
+			values = fields.get(field, [])
+		else:
+			values = [v for fvalues in fields.values() for v in fvalues]
+		if not any(value in v.lower() for v in values if v):
+			return False
+	return True
+
+
+# get_fields(node, bank_node) returns a dict: field name => list of strings
+def filter_tree(tree, search, get_fields):
+	terms = get_search_terms(search)
+	if not terms:
+		return tree
+
+	result = []
+	for node in tree:
+		if 'nodes' in node:
+			if match_terms(terms, get_fields(node, None)):
+				result.append(node)
+			else:
+				subnodes = [subnode for subnode in node['nodes'] or [] if match_terms(terms, get_fields(subnode, node))]
+				if subnodes:
+					fnode = dict(node)
+					fnode['nodes'] = subnodes
+					result.append(fnode)
+		elif match_terms(terms, get_fields(node, None)):
+			result.append(node)
+	return result
+
+
+def get_page_node(node, sel_fullpath=None, limit=DEFAULT_PAGE_LIMIT):
+	pnode = dict(node)
+	if 'nodes' in node:
+		# Children may be not loaded yet (None). Then the count is unknown.
+		pnode['child_count'] = len(node['nodes']) if node['nodes'] is not None else None
+		pnode['nodes'] = []
+		# Include the children of the bank containing the selected node
+		if sel_fullpath and node['nodes']:
+			for i, subnode in enumerate(node['nodes']):
+				if subnode['fullpath']==sel_fullpath:
+					pnode['nodes'] = [get_page_node(n) for n in node['nodes'][0:max(limit, i + 1)]]
+					pnode['state'] = { 'expanded': True }
+					break
+	return pnode
+
+
+def find_node(tree, fullpath):
+	for node in tree:
+		if node['fullpath']==fullpath:
+			return node
+		if node.get('nodes'):
+			res = find_node(node['nodes'], fullpath)
+			if res:
+				return res
+	return None
+
+
+def get_limit(limit):
+	try:
+		limit = int(limit)
+	except:
+		return DEFAULT_PAGE_LIMIT
+	return max(1, min(limit, MAX_PAGE_LIMIT))
+
+
+def get_offset(offset):
+	try:
+		offset = int(offset or 0)
+	except:
+		return 0
+	return max(0, offset)
+
+
+def get_tree_page(tree, parent=None, offset=0, limit=DEFAULT_PAGE_LIMIT, sel_fullpath=None):
+	offset = get_offset(offset)
+	limit = get_limit(limit)
+	if parent:
+		parent_node = find_node(tree, parent)
+		nodes = parent_node.get('nodes') or [] if parent_node else []
+	else:
+		nodes = tree
+
+	return {
+		'parent': parent,
+		'offset': offset,
+		'limit': limit,
+		'total': len(nodes),
+		'nodes': [get_page_node(node, sel_fullpath, limit) for node in nodes[offset:offset + limit]]
+	}
+
@@ -23,16 +23,18 @@
 #********************************************************************
 
 
+import re
 import logging
 import time
-import asyncio
 import subprocess
 import jsonpickle
 import tornado.web
+import tornado.ioloop
+import tornado.websocket
 from collections import OrderedDict
-from multiprocessing import Queue
 from subprocess import check_output
-from lib.tail_thread import TailThread, AsynchronousFileReader
+from lib.log_tail import SharedLogTail
+from lib.journal_log import parse_journal_line, JournalFilter, JournalQuery
 
 from lib.zynthian_config_handler import ZynthianBasicHandler
 from lib.zynthian_websocket_handler import ZynthianWebSocketMessageHandler, ZynthianWebSocketMessage
@@ -55,65 +57,110 @@ class UiLogHandler(ZynthianBasicHandler):
 		self.get()
 
 
-class UiTailThread(TailThread):
-
-	def __init__(self, websocket, loop, process_command):
-		TailThread.__init__(self, websocket, loop)
-		self.process_command = process_command
-		self.loop = loop
-
-
-	def run(self):
-		asyncio.set_event_loop(self.loop)
-		process = subprocess.Popen(self.process_command, shell=True, stderr=subprocess.PIPE,
-				stdout=subprocess.PIPE)
-
-		stdout_queue = Queue()
-		stdout_reader = AsynchronousFileReader(process.stdout, stdout_queue)
-		stdout_reader.start()
-		stderr_queue = Queue()
-		stderr_reader = AsynchronousFileReader(process.stderr, stderr_queue)
-		stderr_reader.start()
+#------------------------------------------------------------------------------
+# UI Log Query: pages of past journal entries
+#------------------------------------------------------------------------------
 
-		while self.is_running and (not stdout_reader.eof() or not stderr_reader.eof()):
-			while self.is_running and not stdout_queue.empty() and not stdout_reader.eof():
-				line = stdout_queue.get()
-				logging.info("stdout: %s" % line.decode())
-				message = ZynthianWebSocketMessage('UiLogMessageHandler', line.decode())
-				self.websocket.write_message(jsonpickle.encode(message))
+class UiLogQueryHandler(ZynthianBasicHandler):
 
-			while self.is_running and not stderr_queue.empty() and not stderr_reader.eof():
-				line = stderr_queue.get()
-				logging.info("stderr: %s" % line.decode())
-				message = ZynthianWebSocketMessage('UiLogMessageHandler', line.decode())
-				self.websocket.write_message(jsonpickle.encode(message))
+	MAX_LIMIT = 1000
 
-		stdout_reader.join()
-		stderr_reader.join()
-		process.stdout.close()
-		process.stderr.close()
+	@tornado.web.authenticated
+	async def get(self):
+		try:
+			log_filter = JournalFilter.from_data({
+				'level': self.get_argument('LEVEL', None),
+				'search': self.get_argument('SEARCH', None),
+				'since': self.get_argument('SINCE', None),
+				'until': self.get_argument('UNTIL', None)
+			})
+		except re.error as e:
+			self.write({ 'errors': "Invalid search expression: {}".format(e) })
+			return
+
+		try:
+			limit = min(max(int(self.get_argument('LIMIT', 100)), 1), self.MAX_LIMIT)
+		except ValueError:
+			limit = 100
+
+		query = JournalQuery(UiLogMessageHandler.get_service_name(self.get_argument('DEBUG', '0') == '1'),
+			log_filter,
+			self.get_argument('CURSOR', None) or None,
+			self.get_argument('DIRECTION', 'BACKWARD') != 'FORWARD',
+			limit)
+		try:
+			self.write(await query.get_page())
+		except Exception as e:
+			logging.error("Journal query failed => {}".format(e))
+			self.write({ 'errors': str(e) })
 
 
 class UiLogMessageHandler(ZynthianWebSocketMessageHandler):
-	logging_thread = None
-
 
 	@classmethod
 	def is_registered_for(cls, handler_name):
 		return handler_name == 'UiLogMessageHandler'
 
 
+	def __init__(self, handler_name, websocket):
+		super().__init__(handler_name, websocket)
+		self.closed = False
+		self.log_filter = None
+
+
+	@staticmethod
+	def get_service_name(debug_logging):
+		return ('zynthian_debug' if debug_logging else 'zynthian')
+
+
+	# JSON output, so priority, timestamp & module can be parsed. The backlog
+	# is filled with the last lines.
 	def get_process_command(self, debug_logging):
-		service_name = ('zynthian_debug' if debug_logging else 'zynthian')
-		logging.info("journalctl -f -u %s" % service_name)
-		return "journalctl  -f -u %s" % service_name
+		service_name = self.get_service_name(debug_logging)
+		logging.info("journalctl -f -o json -u %s" % service_name)
+		return "journalctl -f -o json -n %d -u %s" % (SharedLogTail.BACKLOG_LINES, service_name)
+
+
+	def send_message(self, data):
+		message = ZynthianWebSocketMessage('UiLogMessageHandler', data)
+		return self.websocket.write_message(jsonpickle.encode(message))
+
 
+	# Lines are sent as parsed entries. Wait until the batch is written, so
+	# the entries sent to a slow client are kept in its pending queue.
+	async def send_lines(self, lines):
+		try:
+			await self.send_message(lines)
+		except tornado.websocket.WebSocketClosedError:
+			self.stop_log_tail()
 
-	def spawn_tail_thread(self, debug_level):
-		logging.info("spawn_tail_thread")
-		loop = asyncio.get_event_loop()
-		UiLogMessageHandler.logging_thread = UiTailThread(self.websocket, loop, self.get_process_command(debug_level))
-		UiLogMessageHandler.logging_thread.start()
+
+	# The journal reader of every unit is shared by all the clients
+	def start_log_tail(self, debug_logging):
+		self.stop_log_tail()
+		if not self.closed:
+			logging.info("start log tail")
+			SharedLogTail.subscribe(self.get_service_name(debug_logging), self.get_process_command(debug_logging),
+				self.send_lines, parse_journal_line, self.get_log_filter_match())
+
+
+	def stop_log_tail(self):
+		SharedLogTail.unsubscribe(self.send_lines)
+
+
+	def get_log_filter_match(self):
+		return self.log_filter.match if self.log_filter else None
+
+
+	# Level, search & time window are applied before sending the entries.
+	# The matching backlog entries are sent again.
+	def do_set_filter(self, data):
+		try:
+			self.log_filter = JournalFilter.from_data(data)
+		except re.error as e:
+			self.send_message("Invalid search expression: {}".format(e))
+			return
+		SharedLogTail.set_filter(self.send_lines, self.get_log_filter_match())
 
 
 	def toggle_service(self, running_service, next_service):
@@ -138,45 +185,44 @@ class UiLogMessageHandler(ZynthianWebSocketMessageHandler):
 		check_output("(systemctl start %s)&" % next_service, shell=True)
 
 
-	def do_start_debug_logging(self):
-		logging.info("start debug logging")
-		message = ZynthianWebSocketMessage('UiLogMessageHandler', 'Restarting UI in debug mode')
-		self.websocket.write_message(jsonpickle.encode(message))
-		if UiLogMessageHandler.logging_thread:
-			UiLogMessageHandler.logging_thread.stop()
+	# Services are toggled in a worker thread, out of the IOLoop
+	async def do_toggle_logging(self, message, running_service, next_service, debug_logging):
+		self.send_message(message)
+		self.stop_log_tail()
+		try:
+			await tornado.ioloop.IOLoop.current().run_in_executor(None, self.toggle_service, running_service, next_service)
+		except Exception as e:
+			logging.error("Can't restart UI => {}".format(e))
+		self.start_log_tail(debug_logging)
 
-		self.toggle_service("zynthian", "zynthian_debug")
 
-		self.spawn_tail_thread(True)
+	def do_start_debug_logging(self):
+		logging.info("start debug logging")
+		tornado.ioloop.IOLoop.current().spawn_callback(self.do_toggle_logging,
+			'Restarting UI in debug mode', "zynthian", "zynthian_debug", True)
 
 
 	def do_stop_debug_logging(self):
 		logging.info("stop debug logging")
-		message = ZynthianWebSocketMessage('UiLogMessageHandler', 'Restarting UI in normal mode')
-		self.websocket.write_message(jsonpickle.encode(message))
-		if UiLogMessageHandler.logging_thread:
-			UiLogMessageHandler.logging_thread.stop()
-
-		self.toggle_service("zynthian_debug", "zynthian")
-
-		self.spawn_tail_thread(False)
+		tornado.ioloop.IOLoop.current().spawn_callback(self.do_toggle_logging,
+			'Restarting UI in normal mode', "zynthian_debug", "zynthian", False)
 
 
 	def on_websocket_message(self, action):
 		logging.debug("action: %s " % action)
-		if action == 'SHOW_DEBUG_LOGGING':
+		if isinstance(action, dict):
+			if action.get('action') == 'FILTER':
+				self.do_set_filter(action)
+		elif action == 'SHOW_DEBUG_LOGGING':
 			self.do_start_debug_logging()
 		elif action == 'HIDE_DEBUG_LOGGING':
 			self.do_stop_debug_logging()
 		elif action == 'SHOW_DEFAULT':
-			if UiLogMessageHandler.logging_thread:
-				UiLogMessageHandler.logging_thread.stop()
-			self.spawn_tail_thread(False)
+			self.start_log_tail(False)
 		logging.debug("message handled.")  # this needs to show up early to get the socket working again.
 
 
 	def on_close(self):
-		logging.debug("stopping tail threads")
-		if UiLogMessageHandler.logging_thread:
-			UiLogMessageHandler.logging_thread.stop()
-
+		logging.debug("stopping log tail")
+		self.closed = True
+		self.stop_log_tail()
@@ -32,6 +32,7 @@ import datetime
 import jsonpickle
 
 from lib.zynthian_websocket_handler import ZynthianWebSocketMessageHandler, ZynthianWebSocketMessage
+from lib.file_count_index import file_count_index
 
 #from lib.post_streamer import PostDataStreamer
 from tornadostreamform.multipart_streamer import MultiPartStreamer, StreamedPart, TemporaryFileStreamedPart
@@ -110,6 +111,7 @@ class UploadPostDataStreamer(MultiPartStreamer):
 				logging.info(part.get_name())
 				logging.info("destinationPath: " + self.destinationPath)
 				part.move(self.destinationPath + "/" + destinationFilename)
+				file_count_index.invalidate(self.destinationPath + "/" + destinationFilename)
 
 class UploadProgressHandler(ZynthianWebSocketMessageHandler):
 	clientId = '1'
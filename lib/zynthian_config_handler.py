@@ -27,6 +27,7 @@ import re
 import sys
 import liblo
 import logging
+import threading
 import tornado.web
 from subprocess import check_output
 
@@ -43,6 +44,52 @@ zynconf_logger.setLevel(logging.INFO)
 
 zynthian_ui_osc_addr = liblo.Address('localhost',1370,liblo.UDP)
 
+#------------------------------------------------------------------------------
+# Zynthian Config Cache
+#------------------------------------------------------------------------------
+# zynconf parses the envars & MIDI profile scripts and exports them to
+# os.environ. It's only done again when the files change (or after saving).
+
+config_cache_lock = threading.Lock()
+config_cache_stamps = { 'config': None, 'midi_config': None }
+
+
+def get_file_stamp(fpath):
+	try:
+		st = os.stat(fpath)
+		return (fpath, st.st_ino, st.st_size, st.st_mtime_ns)
+	except OSError:
+		return (fpath, None, None, None)
+
+
+def load_config_cached():
+	with config_cache_lock:
+		stamp = get_file_stamp(zynconf.get_config_fpath())
+		if stamp != config_cache_stamps['config']:
+			logging.debug("Loading config from {}".format(stamp[0]))
+			zynconf.load_config()
+			config_cache_stamps['config'] = stamp
+			# Envars could override MIDI profile values => reload it too
+			config_cache_stamps['midi_config'] = None
+
+		# MIDI profile path depends on ZYNTHIAN_SCRIPT_MIDI_PROFILE
+		stamp = get_file_stamp(zynconf.get_midi_config_fpath())
+		if stamp != config_cache_stamps['midi_config']:
+			logging.debug("Loading MIDI config from {}".format(stamp[0]))
+			zynconf.load_midi_config()
+			config_cache_stamps['midi_config'] = stamp
+
+
+def invalidate_config_cache():
+	with config_cache_lock:
+		config_cache_stamps['config'] = None
+		config_cache_stamps['midi_config'] = None
+
+
+def reload_config():
+	invalidate_config_cache()
+	load_config_cached()
+
 #------------------------------------------------------------------------------
 # Zynthian Basic Handler
 #------------------------------------------------------------------------------
@@ -65,8 +112,7 @@ class ZynthianBasicHandler(tornado.web.RequestHandler):
 
 
 	def prepare(self):
-		zynconf.load_config()
-		zynconf.load_midi_config()
+		load_config_cached()
 
 		self.read_reboot_flag()
 		self.genjson=False
@@ -200,6 +246,7 @@ class ZynthianConfigHandler(ZynthianBasicHandler):
 				sconfig[vn]=config[vn][0]
 
 		zynconf.save_config(sconfig, updsys=True)
+		reload_config()
 
 
 	def config_env(self, config):
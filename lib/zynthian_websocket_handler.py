@@ -76,7 +76,6 @@ class ZynthianWebSocketMessage(object):
 
 
 class ZynthianWebSocketHandler(tornado.websocket.WebSocketHandler):
-	handlers = []
 
 	def check_origin(self, origin):
 		return True
@@ -84,18 +83,24 @@ class ZynthianWebSocketHandler(tornado.websocket.WebSocketHandler):
 	# the client connected
 	def open(self):
 		logging.info("New client connected to ZynthianWebSocketHandler")
+		# One message handler per handler name and connection
+		self.handlers = {}
 
 	# the client sent the message
 	def on_message(self, message):
 		if message:
 			decoded_message = jsonpickle.decode(message)
 			logging.info("incoming ws message %s " % decoded_message)
-			handler = ZynthianWebSocketMessageHandlerFactory(decoded_message['handler_name'], self)
+			handler_name = decoded_message['handler_name']
+			handler = self.handlers.get(handler_name)
+			if handler is None:
+				handler = ZynthianWebSocketMessageHandlerFactory(handler_name, self)
+				self.handlers[handler_name] = handler
 			handler.on_websocket_message(decoded_message['data'])
-			self.handlers.append(handler)
 
 	# client disconnected
 	def on_close(self):
 		logging.info("Client disconnected")
-		for handler in self.handlers:
+		for handler in self.handlers.values():
 			handler.on_close()
+		self.handlers = {}
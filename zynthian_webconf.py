@@ -48,7 +48,7 @@ from lib.wiring_config_handler import WiringConfigHandler
 from lib.hwoptions_config_handler import HWOptionsConfigHandler
 from lib.wifi_config_handler import WifiConfigHandler
 from lib.wifi_list_handler import WifiListHandler
-from lib.snapshot_config_handler import SnapshotConfigHandler, SnapshotRemoveOptionHandler, SnapshotAddOptionsHandler, SnapshotDownloadHandler, SnapshotRemoveLayerHandler
+from lib.snapshot_config_handler import SnapshotConfigHandler, SnapshotRemoveOptionHandler, SnapshotAddOptionsHandler, SnapshotDownloadHandler, SnapshotRemoveLayerHandler, SnapshotDetailsHandler
 from lib.midi_config_handler import MidiConfigHandler
 from lib.upload_handler import UploadHandler
 from lib.system_backup_handler import SystemBackupHandler
@@ -58,7 +58,7 @@ from lib.zynthian_websocket_handler import ZynthianWebSocketHandler
 from lib.pianoteq_handler import PianoteqHandler
 from lib.captures_config_handler import CapturesConfigHandler
 from lib.jalv_lv2_handler import JalvLv2Handler
-from lib.ui_log_handler import UiLogHandler
+from lib.ui_log_handler import UiLogHandler, UiLogQueryHandler
 from lib.midi_log_handler import MidiLogHandler
 from lib.repository_handler import RepositoryHandler
 from lib.audio_mixer_handler import AudioConfigMessageHandler, AudioMixerHandler
@@ -140,6 +140,7 @@ def make_app():
 		(r"/lib-snapshot$", SnapshotConfigHandler),
 		(r"/lib-snapshot/ajax/(.*)$", SnapshotConfigHandler),
 		(r"/lib-snapshot/download/(.*)$", SnapshotDownloadHandler),
+		(r"/lib-snapshot/details/(.*)$", SnapshotDetailsHandler),
 		(r"/lib-snapshot/remove/(.*)/(.*)$", SnapshotRemoveOptionHandler),
 		(r"/lib-snapshot/remove-layer/(.*)/(.*)$", SnapshotRemoveLayerHandler),
 		(r"/lib-snapshot/add/(.*)/(.*)$", SnapshotAddOptionsHandler),
@@ -161,6 +162,7 @@ def make_app():
 		(r"/ui-options$", UiConfigHandler),
 		(r"/ui-keybind$", UiKeybindHandler),
 		(r"/ui-log$", UiLogHandler),
+		(r"/ui-log/query$", UiLogQueryHandler),
 		(r"/ui-midi-options$", MidiConfigHandler),
 		(r"/ui-midi-log$", MidiLogHandler),
 		(r"/sys-wifi$", WifiConfigHandler),